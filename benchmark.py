@@ -0,0 +1,1058 @@
+"""ytdlp-gui 性能基准测试
+
+用法:
+    python benchmark.py parser      # 进度行解析器对比
+    python benchmark.py protocol    # 结构化进度记录与文本解析的吞吐量对比
+    python benchmark.py startup     # 启动耗时（延迟导入 yt_dlp、工具查找缓存）
+    python benchmark.py engine      # 每个任务新建 YoutubeDL 与复用引擎池的首字节耗时
+    python benchmark.py reactor     # 外部进程输出：每进程一个读取线程与单线程 reactor 的 CPU/线程数对比
+    python benchmark.py tracing     # 追踪（Tracer）未启用/启用时进度回调热路径的开销
+    python benchmark.py e2e         # 端到端：本地合成站点 + 模拟 yt-dlp，各下载路径的吞吐量、延迟、CPU 和内存
+    python benchmark.py e2e --items 50 --size 8192 --throttle 4096 --save before.json
+    python benchmark.py e2e --baseline before.json   # 切换到另一个提交后对比
+    python benchmark.py cancel      # 各下载路径在解析/传输/后处理阶段停止的延迟、临时文件清理和子进程遗留
+"""
+import argparse
+import contextlib
+import functools
+import http.server
+import importlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ytdlp-gui.py")
+
+
+def load_app():
+    """加载 ytdlp-gui.py（文件名带连字符，无法直接 import）"""
+    path = APP_PATH
+    spec = importlib.util.spec_from_file_location("ytdlp_gui", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# 真实 yt-dlp --newline 输出中截取的行
+SAMPLE_OUTPUT_LINES = [
+    "[youtube] Extracting URL: https://www.youtube.com/watch?v=aqz-KE-bpKQ",
+    "[youtube] aqz-KE-bpKQ: Downloading webpage",
+    "[youtube] aqz-KE-bpKQ: Downloading ios player API JSON",
+    "[info] aqz-KE-bpKQ: Downloading 1 format(s): 401+251",
+    "[download] Destination: /home/user/Downloads/Big Buck Bunny 60fps 4K - Official Blender Foundation Short Film.f401.mp4",
+    "[download]   0.0% of  642.13MiB at  Unknown B/s ETA Unknown",
+    "[download]   0.0% of  642.13MiB at  345.67KiB/s ETA 31:41",
+    "[download]   0.1% of  642.13MiB at    2.37MiB/s ETA 04:30",
+    "[download]  12.4% of  642.13MiB at    9.81MiB/s ETA 00:57",
+    "[download]  65.3% of ~ 100.00MiB at    2.50MiB/s ETA 00:12 (frag 13/20)",
+    "[download]  99.9% of  642.13MiB at   10.02MiB/s ETA 00:00",
+    "[download] 100% of  642.13MiB in 00:01:04 at 9.98MiB/s",
+    "[download] 100.0% of   3.21GiB in 00:05:31 at 9.93MiB/s",
+    "[download]  45.7MiB/100.0MiB",
+    "[download] /home/user/Downloads/clip.mp4 has already been downloaded",
+    "[Merger] Merging formats into \"/home/user/Downloads/clip.webm\"",
+]
+
+
+# 与上面进度行对应的 --progress-template 记录行（PROGRESS_TEMPLATE 的输出格式）
+SAMPLE_PROGRESS_RECORDS = [
+    "__YTDLP_GUI_PROGRESS__ downloading 1024 673322106 NA NA NA",
+    "__YTDLP_GUI_PROGRESS__ downloading 2048 673322106 NA 353966.08 1901",
+    "__YTDLP_GUI_PROGRESS__ downloading 673322 673322106 NA 2485125.12 270",
+    "__YTDLP_GUI_PROGRESS__ downloading 83491941 673322106 NA 10286530.56 57",
+    "__YTDLP_GUI_PROGRESS__ downloading 68472012 NA 104857600.0 2621440.0 12",
+    "__YTDLP_GUI_PROGRESS__ downloading 672648784 673322106 NA 10506731.52 0",
+    "__YTDLP_GUI_PROGRESS__ finished 673322106 673322106 NA 10464788.48 NA",
+    "__YTDLP_GUI_PROGRESS__ finished 3446711255 3446711255 NA 10412359.68 NA",
+]
+
+
+def legacy_parse_ytdlp_progress(line):
+    """旧版 DownloadWorker.parse_ytdlp_progress（逐个 re.search），作为对比基线"""
+    try:
+        percent = 0
+        speed = 0
+        eta = None
+
+        percent_match = re.search(r'(\d+\.\d+|\d+)%', line)
+        if percent_match:
+            percent = float(percent_match.group(1))
+
+        speed_match = re.search(r'(\d+\.\d+|\d+)\s*([KM]?i?B)/s', line, re.IGNORECASE)
+        if speed_match:
+            speed_value = float(speed_match.group(1))
+            speed_unit = speed_match.group(2).upper()
+            if speed_unit == 'B/S':
+                speed = speed_value
+            elif speed_unit == 'KB/S' or speed_unit == 'KIB/S':
+                speed = speed_value * 1024
+            elif speed_unit == 'MB/S' or speed_unit == 'MIB/S':
+                speed = speed_value * 1024 * 1024
+            elif speed_unit == 'GB/S' or speed_unit == 'GIB/S':
+                speed = speed_value * 1024 * 1024 * 1024
+
+        if speed == 0:
+            speed_match2 = re.search(r'(\d+\.\d+|\d+)([KM]?i?B/s)', line, re.IGNORECASE)
+            if speed_match2:
+                speed_value = float(speed_match2.group(1))
+                speed_unit = speed_match2.group(2).upper()
+                if speed_unit == 'B/S':
+                    speed = speed_value
+                elif speed_unit == 'KB/S' or speed_unit == 'KIB/S':
+                    speed = speed_value * 1024
+                elif speed_unit == 'MB/S' or speed_unit == 'MIB/S':
+                    speed = speed_value * 1024 * 1024
+                elif speed_unit == 'GB/S' or speed_unit == 'GIB/S':
+                    speed = speed_value * 1024 * 1024 * 1024
+
+        eta_match = re.search(r'(ETA|in)\s+(\d+:\d+(:\d+)?)', line)
+        if eta_match:
+            eta = eta_match.group(2)
+        else:
+            eta_match_simple = re.search(r'(?<!\d)(\d+:\d+(:\d+)?)(?!\d)', line)
+            if eta_match_simple and 'download' in line.lower():
+                eta = eta_match_simple.group(1)
+
+        size_match = re.search(r'(\d+\.\d+|\d+)([KM]?i?B)\s*/\s*(\d+\.\d+|\d+)([KM]?i?B)', line, re.IGNORECASE)
+        if size_match and percent == 0:
+            downloaded = float(size_match.group(1))
+            total = float(size_match.group(3))
+            downloaded_unit = size_match.group(2).upper()
+            total_unit = size_match.group(4).upper()
+
+            def convert_to_bytes(value, unit):
+                unit = unit.upper()
+                if unit == 'B':
+                    return value
+                elif unit == 'KB' or unit == 'KIB':
+                    return value * 1024
+                elif unit == 'MB' or unit == 'MIB':
+                    return value * 1024 * 1024
+                elif unit == 'GB' or unit == 'GIB':
+                    return value * 1024 * 1024 * 1024
+                else:
+                    return value
+
+            downloaded_bytes = convert_to_bytes(downloaded, downloaded_unit)
+            total_bytes = convert_to_bytes(total, total_unit)
+            if total_bytes > 0:
+                percent = (downloaded_bytes / total_bytes) * 100
+
+        return percent, speed, eta
+
+    except Exception:
+        return 0, 0, None
+
+
+def report(name, seconds, count):
+    print(f"  {name:<28} {seconds * 1e6 / count:8.2f} us/行   {count / seconds:12,.0f} 行/秒")
+
+
+def bench_parser(args):
+    """旧版逐项 re.search 与新版单次扫描解析器的对比"""
+    app = load_app()
+    lines = [line for line in SAMPLE_OUTPUT_LINES if line.startswith('[download]')]
+
+    # 两者对相同输入的结果必须一致（旧版把完成行 "in 00:01:04" 的已用时间当作 ETA，新版只取 ETA 后面的时间）
+    for line in lines:
+        percent, downloaded, total, speed, eta = app.parse_progress_line(line)
+        expected = legacy_parse_ytdlp_progress(line)
+        expected_eta = expected[2] if 'ETA' in line else None
+        if (round(percent, 6), speed, eta) != (round(expected[0], 6), expected[1], expected_eta):
+            print(f"结果不一致: {line!r}\n  旧: {expected}\n  新: {(percent, speed, eta)}")
+            return 1
+
+    count = len(lines) * args.number
+    print(f"进度行解析 ({len(lines)} 种样本行 x {args.number} 次)")
+
+    def run_legacy():
+        for line in lines:
+            legacy_parse_ytdlp_progress(line)
+
+    def run_new():
+        for line in lines:
+            app.parse_progress_line(line)
+
+    legacy = min(timeit.repeat(run_legacy, number=args.number, repeat=args.repeat))
+    new = min(timeit.repeat(run_new, number=args.number, repeat=args.repeat))
+    report("旧版 parse_ytdlp_progress", legacy, count)
+    report("parse_progress_line", new, count)
+    print(f"  加速比: {legacy / new:.2f}x")
+    return 0
+
+
+def bench_protocol(args):
+    """外部 yt-dlp 输出的结构化记录解析与文本正则解析的吞吐量对比"""
+    app = load_app()
+    text_lines = [line for line in SAMPLE_OUTPUT_LINES if '%' in line]
+    records = SAMPLE_PROGRESS_RECORDS
+
+    def run_records():
+        for line in records:
+            app.parse_progress_record(line)
+
+    def run_text():
+        for line in text_lines:
+            app.parse_progress_line(line)
+
+    def run_legacy():
+        for line in text_lines:
+            legacy_parse_ytdlp_progress(line)
+
+    print(f"进度协议 ({len(records)} 条记录 / {len(text_lines)} 行文本 x {args.number} 次)")
+    for name, func, count in (("--progress-template 记录", run_records, len(records)),
+                              ("文本 parse_progress_line", run_text, len(text_lines)),
+                              ("文本 旧版正则", run_legacy, len(text_lines))):
+        seconds = min(timeit.repeat(func, number=args.number, repeat=args.repeat))
+        report(name, seconds, count * args.number)
+    return 0
+
+
+def time_module_load(extra_code, repeat):
+    """在新进程中测量加载 ytdlp-gui.py 的耗时（取最快一次）"""
+    code = (
+        "import importlib.util, time\n"
+        "t = time.perf_counter()\n"
+        f"spec = importlib.util.spec_from_file_location('ytdlp_gui', {APP_PATH!r})\n"
+        "module = importlib.util.module_from_spec(spec)\n"
+        "spec.loader.exec_module(module)\n"
+        f"{extra_code}\n"
+        "print(time.perf_counter() - t)\n"
+    )
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        results.append(float(output.strip().splitlines()[-1]))
+    return min(results)
+
+
+def make_fake_tool(directory, name, output):
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        f.write(f"#!/bin/sh\necho '{output}'\n")
+    os.chmod(path, 0o755)
+    return path
+
+
+def bench_startup(args):
+    """启动耗时：模块加载时是否导入 yt_dlp，以及工具查找有无磁盘缓存"""
+    print("启动耗时")
+    lazy = time_module_load("", args.repeat)
+    print(f"  加载模块（延迟导入 yt_dlp）     {lazy * 1000:8.1f} ms")
+    if importlib.util.find_spec("yt_dlp") is not None:
+        eager = time_module_load("import yt_dlp", args.repeat)
+        print(f"  加载模块 + import yt_dlp（旧）  {eager * 1000:8.1f} ms")
+    else:
+        print("  未安装 yt_dlp，跳过立即导入的对比")
+
+    if os.name != 'posix':
+        print("  工具查找对比需要 POSIX 系统，跳过")
+        return 0
+
+    app = load_app()
+    with tempfile.TemporaryDirectory() as program_dir:
+        # 模拟程序目录：大量子目录，工具放在较深的位置
+        for i in range(200):
+            sub = os.path.join(program_dir, f"lib{i}", "data")
+            os.makedirs(sub)
+            open(os.path.join(sub, "file.bin"), 'w').close()
+        tool_dir = os.path.join(program_dir, "lib199", "bin")
+        os.makedirs(tool_dir)
+        make_fake_tool(tool_dir, "bench-ffmpeg", "ffmpeg version 6.0")
+        make_fake_tool(tool_dir, "bench-yt-dlp", "2025.01.01")
+
+        tools = {
+            'ffmpeg': dict(app.ToolDiscovery.TOOLS['ffmpeg'], names=["bench-ffmpeg"], extra=[]),
+            'yt-dlp': dict(app.ToolDiscovery.TOOLS['yt-dlp'], names=["bench-yt-dlp"], extra=[]),
+        }
+        cache_path = os.path.join(program_dir, "tools.json")
+
+        start = time.perf_counter()
+        discovery = app.ToolDiscovery(cache_path, program_dir, tools)
+        found = [discovery.discover(name) for name in tools]
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        discovery = app.ToolDiscovery(cache_path, program_dir, tools)
+        cached = [discovery.cached(name) for name in tools]
+        warm = time.perf_counter() - start
+
+        if found != [path for hit, path in cached] or not all(hit for hit, path in cached):
+            print(f"  缓存结果不一致: {found} / {cached}")
+            return 1
+        print(f"  工具查找（遍历目录 + 探测）     {cold * 1000:8.1f} ms")
+        print(f"  工具查找（磁盘缓存）            {warm * 1000:8.1f} ms")
+    return 0
+
+
+def start_media_server(directory):
+    """在本机随机端口启动静态文件服务器，返回 (server, base_url)"""
+    class QuietHandler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    class QuietServer(http.server.ThreadingHTTPServer):
+        def handle_error(self, request, client_address):
+            # 客户端提前断开（例如只读取文件头）属于正常情况
+            pass
+
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = QuietServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def bench_engine(args):
+    """每个任务新建 YoutubeDL 与复用 YoutubeDLPool 的首字节耗时对比（本地服务器）"""
+    if importlib.util.find_spec("yt_dlp") is None:
+        print("引擎池: 未安装 yt_dlp，跳过")
+        return 0
+
+    app = load_app()
+    items = 20
+    with tempfile.TemporaryDirectory() as media_dir, tempfile.TemporaryDirectory() as out_dir:
+        for i in range(items):
+            with open(os.path.join(media_dir, f"clip{i}.mp4"), 'wb') as f:
+                f.write(os.urandom(256 * 1024))
+        server, base_url = start_media_server(media_dir)
+        try:
+            def run(pool_for_item):
+                ttfbs = []
+                for i in range(items):
+                    opts = {
+                        'outtmpl': os.path.join(out_dir, f"{pool_for_item.__name__}-%(title)s.%(ext)s"),
+                        'quiet': True,
+                        'noprogress': True,
+                        'no_warnings': True,
+                    }
+                    started = time.perf_counter()
+                    first = []
+
+                    def hook(d):
+                        if d['status'] == 'downloading' and d.get('downloaded_bytes') and not first:
+                            first.append(time.perf_counter() - started)
+
+                    pool = pool_for_item()
+                    with pool.lease(opts, hook) as (ydl, reused):
+                        ydl.download([f"{base_url}/clip{i}.mp4"])
+                    if pool is not shared_pool:
+                        pool.close()
+                    ttfbs.append(first[0] if first else time.perf_counter() - started)
+                return sum(ttfbs) / len(ttfbs)
+
+            shared_pool = app.YoutubeDLPool()
+
+            def fresh():
+                return app.YoutubeDLPool()
+
+            def pooled():
+                return shared_pool
+
+            print(f"引擎池 ({items} 个本地短视频，平均首字节耗时)")
+            print(f"  每个任务新建 YoutubeDL          {run(fresh) * 1000:8.1f} ms")
+            print(f"  复用 YoutubeDLPool              {run(pooled) * 1000:8.1f} ms")
+            shared_pool.close()
+        finally:
+            server.shutdown()
+    return 0
+
+
+# 模拟外部 yt-dlp：分批输出 --newline 进度记录，批次之间短暂停顿
+MOCK_YTDLP_CODE = (
+    "import sys, time\n"
+    "records = {records!r}\n"
+    "for i in range({lines}):\n"
+    "    sys.stdout.write(records[i % len(records)] + '\\n')\n"
+    "    if i % 50 == 49:\n"
+    "        sys.stdout.flush()\n"
+    "        time.sleep(0.02)\n"
+)
+
+
+def bench_reactor(args):
+    """50 个并发模拟 yt-dlp 进程：每进程一个阻塞读取线程（旧）与单线程 ProcessReactor 的对比"""
+    app = load_app()
+    processes = 50
+    lines = 4000
+    cmd = [sys.executable, "-c", MOCK_YTDLP_CODE.format(records=SAMPLE_PROGRESS_RECORDS, lines=lines)]
+
+    def run_threads():
+        parsed = []
+
+        def read(process):
+            count = 0
+            for line in process.stdout:
+                if app.parse_progress_record(line.strip()) is not None:
+                    count += 1
+            process.wait()
+            parsed.append(count)
+
+        threads = []
+        for _ in range(processes):
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+            thread = threading.Thread(target=read, args=(process,))
+            thread.start()
+            threads.append(thread)
+        peak = threading.active_count()
+        for thread in threads:
+            thread.join()
+        return sum(parsed), peak
+
+    def run_reactor():
+        reactor = app.ProcessReactor()
+        parsed = []
+        done = threading.Semaphore(0)
+
+        def on_line(line, counter):
+            if app.parse_progress_record(line.strip()) is not None:
+                counter[0] += 1
+
+        def on_exit(returncode, error, counter):
+            parsed.append(counter[0])
+            done.release()
+
+        for _ in range(processes):
+            counter = [0]
+            reactor.spawn(cmd, functools.partial(on_line, counter=counter),
+                          functools.partial(on_exit, counter=counter))
+        time.sleep(0.5)
+        peak = threading.active_count()
+        for _ in range(processes):
+            done.acquire()
+        reactor.close()
+        return sum(parsed), peak
+
+    print(f"外部进程输出 ({processes} 个并发模拟进程 x {lines} 行进度记录)")
+    for name, func in (("每进程一个读取线程（旧）", run_threads), ("ProcessReactor", run_reactor)):
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        parsed, peak = func()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        if parsed != processes * lines:
+            print(f"  {name}: 只解析了 {parsed} / {processes * lines} 行")
+            return 1
+        print(f"  {name:<22} 耗时 {wall:6.2f} s   本进程 CPU {cpu:6.2f} s   线程数 {peak:4d}")
+    return 0
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class SyntheticMediaHandler(http.server.BaseHTTPRequestHandler):
+    """合成媒体站点：/media/<n>.mp4 返回固定大小的伪随机数据（支持 Range 和 HEAD），
+    /watch/<n> 返回通用解析器能识别的 HTML5 视频页面
+
+    服务器对象上的 size（字节）、latency（秒，每个请求的响应延迟）和 throttle（字节/秒，每个连接，0 不限）控制行为；
+    单个地址可用查询参数 ?delay=秒 和 ?rate=字节每秒 覆盖，页面上的媒体地址带上同样的 rate
+    """
+
+    protocol_version = 'HTTP/1.1'
+    WATCH_PAGE = (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>clip {n}</title>'
+        '<meta property="og:title" content="clip {n}"></head><body>'
+        '<video controls><source src="/media/{n}.mp4{query}" type="video/mp4"></video></body></html>'
+    )
+    WATCH_RE = re.compile(r'^/watch/(\d+)$')
+    MEDIA_RE = re.compile(r'^/media/(\d+)\.mp4$')
+    RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond(head=False)
+
+    def respond(self, head):
+        server = self.server
+        path, _, query = self.path.partition('?')
+        params = dict(param.partition('=')[::2] for param in query.split('&') if param)
+        delay = float(params.get('delay', server.latency))
+        throttle = float(params.get('rate', server.throttle))
+        if delay:
+            time.sleep(delay)
+
+        if self.WATCH_RE.match(path):
+            media_query = f"?rate={params['rate']}" if 'rate' in params else ''
+            body = self.WATCH_PAGE.format(n=self.WATCH_RE.match(path).group(1), query=media_query).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if not head:
+                self.wfile.write(body)
+            return
+        if not self.MEDIA_RE.match(path):
+            self.send_error(404)
+            return
+
+        size = server.size
+        start, end = 0, size - 1
+        match = self.RANGE_RE.match(self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start >= size or start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if head:
+            return
+
+        block = server.block
+        sent = 0
+        remaining = end - start + 1
+        started = time.monotonic()
+        while remaining > 0:
+            offset = (start + sent) % len(block)
+            chunk = block[offset:offset + min(remaining, len(block) - offset)]
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            remaining -= len(chunk)
+            if throttle:
+                # 按每个连接的速率上限补足时间
+                delay = sent / throttle - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+
+def start_synthetic_server(size, latency=0.0, throttle=0):
+    """在本机随机端口启动合成媒体站点，返回 (server, base_url)"""
+    class QuietServer(http.server.ThreadingHTTPServer):
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            pass
+
+    server = QuietServer(("127.0.0.1", 0), SyntheticMediaHandler)
+    server.size = size
+    server.latency = latency
+    server.throttle = throttle
+    server.block = os.urandom(64 * 1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# 模拟外部 yt-dlp：真正从合成站点下载，按 --newline 格式逐块输出进度，
+# 传入 --progress-template 时按模板输出记录行。环境变量 FAKE_YTDLP_LEGACY=1 模拟不支持该参数的旧版本；
+# FAKE_YTDLP_POSTPROCESS=秒 下载后像合并格式时那样启动一个运行这么久的子进程（代替 FFmpeg），
+# 子进程的 PID 写入 FAKE_YTDLP_CHILD_PIDFILE
+FAKE_YTDLP_CODE = r'''
+import os, re, subprocess, sys, time, urllib.request
+
+argv = sys.argv[1:]
+if '--version' in argv:
+    print('2099.01.01')
+    sys.exit(0)
+if os.environ.get('FAKE_YTDLP_LEGACY') and '--progress-template' in argv:
+    print('Usage: yt-dlp [OPTIONS] URL [URL...]\n\nyt-dlp: error: no such option: --progress-template', flush=True)
+    sys.exit(2)
+
+VALUE_OPTIONS = {'-o', '-f', '-N', '--download-archive', '--progress-template', '--limit-rate',
+                 '--load-info-json', '--downloader', '--downloader-args', '--audio-format'}
+options, urls = {}, []
+i = 0
+while i < len(argv):
+    if argv[i] in VALUE_OPTIONS:
+        options[argv[i]] = argv[i + 1]
+        i += 2
+    else:
+        if not argv[i].startswith('-'):
+            urls.append(argv[i])
+        i += 1
+
+def size_text(n):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if n < 1024 or unit == 'GiB':
+            return f'{n:.2f}{unit}'
+        n /= 1024
+
+def clock(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 60:02d}:{seconds % 60:02d}'
+
+template = options.get('--progress-template', '')
+if template.startswith('download:'):
+    template = template[len('download:'):]
+limit = float(options.get('--limit-rate', 0) or 0)
+
+for url in urls:
+    video_id = url.split('?', 1)[0].rstrip('/').rsplit('/', 1)[-1]
+    print(f'[generic] Extracting URL: {url}', flush=True)
+    print(f'[generic] {video_id}: Downloading webpage', flush=True)
+    page = urllib.request.urlopen(url).read().decode('utf-8')
+    media = urllib.parse.urljoin(url, re.search(r'src="([^"]+)"', page).group(1))
+    title = re.search(r'<title>([^<]*)</title>', page).group(1)
+    print(f'[info] {video_id}: Downloading 1 format(s): 0', flush=True)
+
+    path = options.get('-o', '%(title)s [%(id)s].%(ext)s')
+    path = path.replace('%(title)s', title).replace('%(id)s', video_id).replace('%(ext)s', 'mp4')
+    print(f'[download] Destination: {path}', flush=True)
+    response = urllib.request.urlopen(media)
+    total = int(response.headers['Content-Length'])
+    downloaded = 0
+    started = time.monotonic()
+    with open(path + '.part', 'wb') as f:
+        while True:
+            chunk = response.read(64 * 1024)
+            if not chunk:
+                break
+            f.write(chunk)
+            downloaded += len(chunk)
+            elapsed = max(time.monotonic() - started, 1e-6)
+            if limit and downloaded / limit > elapsed:
+                time.sleep(downloaded / limit - elapsed)
+                elapsed = downloaded / limit
+            speed = downloaded / elapsed
+            eta = (total - downloaded) / speed
+            status = 'finished' if downloaded >= total else 'downloading'
+            if template:
+                fields = {'status': status, 'downloaded_bytes': downloaded, 'total_bytes': total,
+                          'total_bytes_estimate': 'NA', 'speed': speed, 'eta': 'NA' if status == 'finished' else eta}
+                line = re.sub(r'%\(progress\.(\w+)\)s', lambda m: str(fields.get(m.group(1), 'NA')), template)
+            elif status == 'finished':
+                line = f'[download] 100% of {size_text(total):>10} in {clock(elapsed)} at {size_text(speed)}/s'
+            else:
+                line = (f'[download] {downloaded / total * 100:5.1f}% of {size_text(total):>10}'
+                        f' at {size_text(speed):>10}/s ETA {clock(eta)}')
+            print(line, flush=True)
+    if os.environ.get('FAKE_YTDLP_POSTPROCESS'):
+        print(f'[Merger] Merging formats into "{path}"', flush=True)
+        child = subprocess.Popen([sys.executable, '-c',
+                                  f"import time; time.sleep({float(os.environ['FAKE_YTDLP_POSTPROCESS'])})"])
+        pidfile = os.environ.get('FAKE_YTDLP_CHILD_PIDFILE')
+        if pidfile:
+            # 先写临时文件再改名，读取方不会读到写了一半的文件
+            with open(pidfile + '.tmp', 'w') as f:
+                f.write(str(child.pid))
+            os.replace(pidfile + '.tmp', pidfile)
+        child.wait()
+    os.replace(path + '.part', path)
+sys.exit(0)
+'''
+
+
+def make_fake_ytdlp(directory):
+    """在 directory 中写入模拟的 yt-dlp 可执行文件，返回路径"""
+    path = os.path.join(directory, "yt-dlp")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"#!{sys.executable}\n" + FAKE_YTDLP_CODE)
+    os.chmod(path, 0o755)
+    return path
+
+
+# 端到端模式：内置模块（线程）、外部 yt-dlp（结构化进度 / 旧版文本进度）、内置模块（子进程）
+E2E_MODES = ('module', 'external', 'external-text', 'processes')
+E2E_TICK = 0.02  # 秒，模拟前端的事件处理间隔
+
+
+class E2EFrontend:
+    """最小的引擎前端：和无界面模式一样驱动 DownloadEngine，同时记录每个任务的时间点"""
+
+    def __init__(self, app, jobs, processes=0):
+        self.signal = app.DownloadSignal(self)
+        self.engine = app.DownloadEngine(self.signal, jobs, 0)
+        if processes:
+            self.engine.set_process_workers(processes)
+        self.queued = {}
+        self.started = {}
+        self.finished = {}
+        self.errors = {}
+        self.progress_events = 0
+        self.tick_times = []
+
+    def download_interrupted(self, download_id):
+        self.engine.worker_done(download_id)
+
+    def download_postprocessing(self, download_id):
+        self.engine.release_slot(download_id)
+
+    def run(self, urls, out_dir, ytdlp_path=''):
+        for i, url in enumerate(urls):
+            download_id = f"job_{i}"
+            self.queued[download_id] = time.perf_counter()
+            self.engine.scheduler.submit(download_id, url)
+        jobs = dict(zip(self.queued, urls))
+
+        try:
+            while len(self.finished) < len(urls):
+                for download_id in self.engine.scheduler.pop_ready():
+                    self.started[download_id] = time.perf_counter()
+                    self.engine.start_worker(download_id, jobs[download_id], "最佳画质", out_dir, ytdlp_path,
+                                             use_archive=False)
+                time.sleep(E2E_TICK)
+
+                tick = time.perf_counter()
+                progress, logs, finished, calls = self.signal.drain()
+                self.progress_events += len(progress)
+                for download_id, (success, message) in finished:
+                    self.engine.worker_done(download_id, success)
+                    self.finished[download_id] = time.perf_counter()
+                    if not success:
+                        self.errors[download_id] = message
+                for func, args in calls:
+                    func(*args)
+                self.tick_times.append(time.perf_counter() - tick)
+        finally:
+            self.engine.close()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+
+def import_app(directory):
+    """以 ytdlp_gui 模块名导入（子进程下载需要按模块名找到 run_download_process）"""
+    link = os.path.join(directory, "ytdlp_gui.py")
+    os.symlink(APP_PATH, link)
+    sys.path.insert(0, directory)
+    return importlib.import_module("ytdlp_gui")
+
+
+def run_e2e_child(args):
+    """在独立进程中运行一种模式，CPU 和内存只统计这一种模式；结果以一行 JSON 输出"""
+    import resource
+
+    mode = args.e2e_child
+    with tempfile.TemporaryDirectory() as work_dir:
+        app = import_app(work_dir)
+        out_dir = os.path.join(work_dir, "out")
+        os.mkdir(out_dir)
+        if mode == 'external-text':
+            os.environ['FAKE_YTDLP_LEGACY'] = '1'
+        urls = [f"{args.e2e_server}/watch/{i}" for i in range(args.items)]
+        frontend = E2EFrontend(app, args.jobs, args.jobs if mode == 'processes' else 0)
+
+        wall = time.perf_counter()
+        frontend.run(urls, out_dir, args.e2e_fake if mode.startswith('external') else '')
+        wall = time.perf_counter() - wall
+        # 等下载子进程退出，CPU 时间才会计入 RUSAGE_CHILDREN
+        for process in multiprocessing.active_children():
+            process.join()
+
+        downloaded = sum(os.path.getsize(os.path.join(out_dir, name)) for name in os.listdir(out_dir)
+                         if name.endswith('.mp4'))
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        latencies = [frontend.finished[i] - frontend.started[i] for i in frontend.finished if i in frontend.started]
+        result = {
+            'mode': mode,
+            'items': args.items,
+            'failed': len(frontend.errors),
+            'error': next(iter(frontend.errors.values()), None),
+            'wall': wall,
+            'bytes': downloaded,
+            'latency_mean': sum(latencies) / len(latencies) if latencies else 0,
+            'latency_p50': percentile(latencies, 0.5),
+            'latency_p95': percentile(latencies, 0.95),
+            'ttfb': frontend.engine.metrics.mean('ttfb') or 0,
+            'progress_events': frontend.progress_events,
+            'tick_mean': sum(frontend.tick_times) / len(frontend.tick_times) if frontend.tick_times else 0,
+            'tick_max': max(frontend.tick_times, default=0),
+            'cpu_self': own.ru_utime + own.ru_stime,
+            'cpu_children': children.ru_utime + children.ru_stime,
+            'rss_mb': max(own.ru_maxrss, children.ru_maxrss) / 1024,  # Linux 下单位是 KB
+        }
+    print(json.dumps(result))
+    return 1 if result['failed'] else 0
+
+
+E2E_COMPARED = (('wall', "总耗时"), ('latency_p95', "p95 延迟"), ('cpu_self', "本进程 CPU"),
+                ('cpu_children', "子进程 CPU"), ('rss_mb', "峰值内存"))
+
+
+def bench_e2e(args):
+    """端到端：本地合成站点 + 模拟 yt-dlp，分别通过各下载路径驱动 DownloadEngine，统计吞吐量、延迟、CPU 和内存
+
+    每种模式在独立进程中运行；--save 保存结果，--baseline 与之前保存的结果（例如另一个提交）对比
+    """
+    if sys.platform == "win32":
+        print("端到端: 模拟 yt-dlp 和资源统计只支持 Linux/macOS，跳过")
+        return 0
+    modes = [mode for mode in args.modes.split(',') if mode]
+    unknown = [mode for mode in modes if mode not in E2E_MODES]
+    if unknown:
+        print(f"端到端: 未知模式 {', '.join(unknown)}（可选 {', '.join(E2E_MODES)}）")
+        return 1
+    if importlib.util.find_spec("yt_dlp") is None:
+        modes = [mode for mode in modes if mode.startswith('external')]
+        print("端到端: 未安装 yt_dlp，只运行外部 yt-dlp 模式")
+
+    size = args.size * 1024
+    server, base_url = start_synthetic_server(size, args.latency / 1000, args.throttle * 1024)
+    results = []
+    status = 0
+    try:
+        with tempfile.TemporaryDirectory() as tool_dir:
+            fake = make_fake_ytdlp(tool_dir)
+            throttle = f"{args.throttle} KB/s" if args.throttle else "不限"
+            print(f"端到端 ({args.items} 项 x {format_bytes(size)}，请求延迟 {args.latency} ms，"
+                  f"单连接限速 {throttle}，并发 {args.jobs})")
+            for mode in modes:
+                cmd = [sys.executable, os.path.abspath(__file__), 'e2e', '--e2e-child', mode,
+                       '--e2e-server', base_url, '--e2e-fake', fake,
+                       '--items', str(args.items), '--jobs', str(args.jobs)]
+                completed = subprocess.run(cmd, capture_output=True, text=True)
+                try:
+                    result = json.loads(completed.stdout.strip().splitlines()[-1])
+                except (IndexError, ValueError):
+                    print(f"  {mode:<14}运行失败: {completed.stderr.strip().splitlines()[-1:]}")
+                    status = 1
+                    continue
+                results.append(result)
+                if result['failed']:
+                    print(f"  {mode:<14}{result['failed']} 项失败: {result['error']}")
+                    status = 1
+                    continue
+                ttfb = f"{result['ttfb'] * 1000:6.0f} ms" if result['ttfb'] else "     -   "
+                print(f"  {mode:<14}耗时 {result['wall']:6.2f} s   吞吐 {format_bytes(result['bytes'] / result['wall'])}/s"
+                      f" ({result['items'] / result['wall']:.1f} 项/s)   延迟 平均 {result['latency_mean'] * 1000:.0f} ms"
+                      f" / p95 {result['latency_p95'] * 1000:.0f} ms   首字节 {ttfb}")
+                print(f"  {'':<14}CPU 本进程 {result['cpu_self']:.2f} s / 子进程 {result['cpu_children']:.2f} s"
+                      f"   峰值内存 {result['rss_mb']:.0f} MB   进度事件 {result['progress_events']}"
+                      f"   前端每次处理 {result['tick_mean'] * 1e6:.0f} us (最长 {result['tick_max'] * 1e6:.0f} us)")
+    finally:
+        server.shutdown()
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = {result['mode']: result for result in json.load(f)['results']}
+        print(f"  与 {args.baseline} 对比（负数表示更快/更少）")
+        for result in results:
+            old = baseline.get(result['mode'])
+            if old is None or result['failed'] or old['failed']:
+                continue
+            changes = [f"{label} {(result[key] - old[key]) / old[key] * 100:+.1f}%"
+                       for key, label in E2E_COMPARED if old[key]]
+            print(f"  {result['mode']:<14}{'   '.join(changes)}")
+    if args.save:
+        config = {key: getattr(args, key) for key in ('items', 'size', 'latency', 'throttle', 'jobs')}
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"  结果已保存到 {args.save}")
+    return status
+
+
+def bench_tracing(args):
+    """Tracer 对进度回调热路径的开销：未启用（默认）与启用时的单次 handle_progress 耗时"""
+    app = load_app()
+    tracer = app.Tracer()
+    signal = app.DownloadSignal(None)
+    worker = app.DownloadWorker("http://127.0.0.1/clip.mp4", tempfile.gettempdir(), "最佳画质", signal, "job_0",
+                                "", "", tracer=tracer)
+    worker.started_at = time.monotonic()
+    worker.ttfb = 0.1
+    progress = {'status': 'downloading', 'downloaded_bytes': 1024 * 1024, 'total_bytes': 64 * 1024 * 1024,
+                'speed': 2.5 * 1024 * 1024}
+
+    def run_traced():
+        # 与下载线程的进度回调一致：按 tracer.enabled 选择是否经过追踪包装
+        for _ in range(100):
+            if tracer.enabled:
+                worker.handle_progress(progress)
+            else:
+                worker._handle_progress(progress, True)
+        while not signal.events.empty():
+            signal.events.get_nowait()
+
+    def run_untraced():
+        # 基线：直接调用没有 span 包装的处理函数
+        for _ in range(100):
+            worker._handle_progress(progress, True)
+        while not signal.events.empty():
+            signal.events.get_nowait()
+
+    count = 100 * args.number
+    print(f"追踪开销 (handle_progress x {count})")
+    baseline = min(timeit.repeat(run_untraced, number=args.number, repeat=args.repeat))
+    disabled = min(timeit.repeat(run_traced, number=args.number, repeat=args.repeat))
+    tracer.start()
+    enabled = min(timeit.repeat(run_traced, number=args.number, repeat=args.repeat))
+    tracer.stop()
+    for name, seconds in (("无追踪代码", baseline), ("Tracer 未启用", disabled), ("Tracer 启用", enabled)):
+        print(f"  {name:<16} {seconds * 1e6 / count:8.3f} us/次   相对基线 {(seconds - baseline) / baseline * 100:+6.1f}%")
+    return 0
+
+
+def process_alive(pid):
+    """进程是否还在运行（已退出但未被回收的僵尸进程不算）"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except OSError:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+
+# 取消场景：(下载路径, 阶段)。解析阶段页面响应延迟 60 秒，传输阶段限速到 256 KB/s，
+# 后处理阶段模拟 yt-dlp 启动一个运行 60 秒的子进程（代替 FFmpeg 合并）
+CANCEL_SCENARIOS = (('module', 'extract'), ('module', 'transfer'), ('processes', 'extract'),
+                    ('processes', 'transfer'), ('external', 'extract'), ('external', 'transfer'),
+                    ('external', 'postprocess'))
+CANCEL_DEADLINE = 5.0  # 秒，超过即判定为失败
+
+
+def bench_cancel(args):
+    """停止任务的延迟：各下载路径在解析（阻塞在网络读取）、传输、后处理阶段被停止到线程/进程结束的耗时，
+    并检查临时文件按“删除”策略清理、子进程（FFmpeg）没有遗留"""
+    if sys.platform == "win32":
+        print("取消: 模拟 yt-dlp 只支持 Linux/macOS，跳过")
+        return 0
+    scenarios = CANCEL_SCENARIOS
+    if importlib.util.find_spec("yt_dlp") is None:
+        scenarios = [scenario for scenario in scenarios if scenario[0] == 'external']
+        print("取消: 未安装 yt_dlp，只测试外部 yt-dlp")
+
+    server, base_url = start_synthetic_server(32 * 1024 * 1024)
+    status = 0
+    with tempfile.TemporaryDirectory() as work_dir:
+        app = import_app(work_dir)
+        fake = make_fake_ytdlp(work_dir)
+        pidfile = os.path.join(work_dir, "child.pid")
+        os.environ['FAKE_YTDLP_CHILD_PIDFILE'] = pidfile
+        frontends = {}
+        print(f"取消延迟（停止到任务结束，上限 {CANCEL_DEADLINE:.0f} 秒）")
+        try:
+            for number, (mode, stage) in enumerate(scenarios):
+                if mode not in frontends:
+                    frontends[mode] = E2EFrontend(app, 4, 2 if mode == 'processes' else 0)
+                frontend = frontends[mode]
+                out_dir = os.path.join(work_dir, f"out{number}")
+                os.mkdir(out_dir)
+                query = {'extract': "?delay=60", 'transfer': "?rate=262144", 'postprocess': ""}[stage]
+                if stage == 'postprocess':
+                    os.environ['FAKE_YTDLP_POSTPROCESS'] = "60"
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(pidfile)
+
+                download_id = f"cancel_{number}"
+                worker = frontend.engine.start_worker(download_id, f"{base_url}/watch/{number}{query}", "最佳画质",
+                                                      out_dir, fake if mode == 'external' else '', use_archive=False)
+                # 等到任务进入要测试的阶段
+                deadline = time.monotonic() + 30
+                while time.monotonic() < deadline:
+                    if stage == 'extract' and time.monotonic() > deadline - 28:
+                        break
+                    if stage == 'transfer' and any(name.endswith('.part') for name in os.listdir(out_dir)):
+                        time.sleep(0.5)
+                        break
+                    if stage == 'postprocess' and os.path.exists(pidfile):
+                        break
+                    time.sleep(0.05)
+                os.environ.pop('FAKE_YTDLP_POSTPROCESS', None)
+
+                started = time.perf_counter()
+                worker.stop('delete')
+                finished = worker.done.wait(CANCEL_DEADLINE)
+                latency = time.perf_counter() - started
+                if mode == 'external':
+                    # 进程组在 SIGTERM 后留出的宽限时间内结束，再检查是否有子进程遗留
+                    time.sleep(app.ProcessReactor.KILL_GRACE + 0.5)
+                frontend.signal.drain()
+                frontend.engine.worker_done(download_id)
+
+                leftovers = sorted(os.listdir(out_dir))
+                orphan = None
+                if os.path.exists(pidfile):
+                    with open(pidfile) as f:
+                        pid = int(f.read())
+                    orphan = pid if process_alive(pid) else None
+                problems = []
+                if not finished:
+                    problems.append("未在期限内结束")
+                if leftovers:
+                    problems.append(f"遗留文件 {leftovers}")
+                if orphan:
+                    problems.append(f"子进程 {orphan} 仍在运行")
+                    with contextlib.suppress(OSError):
+                        os.kill(orphan, 9)
+                status |= 1 if problems else 0
+                print(f"  {mode:<10}{stage:<12}{latency * 1000:8.0f} ms   {'；'.join(problems) or '正常'}")
+        finally:
+            for frontend in frontends.values():
+                frontend.engine.close()
+            for process in multiprocessing.active_children():
+                process.join()
+            server.shutdown()
+    return status
+
+
+BENCHMARKS = {
+    'parser': bench_parser,
+    'protocol': bench_protocol,
+    'startup': bench_startup,
+    'engine': bench_engine,
+    'reactor': bench_reactor,
+    'tracing': bench_tracing,
+    'e2e': bench_e2e,
+    'cancel': bench_cancel,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ytdlp-gui 性能基准测试")
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help=f"要运行的基准测试: {', '.join(BENCHMARKS)}（默认全部）")
+    parser.add_argument('--number', type=int, default=2000, help="每轮循环次数")
+    parser.add_argument('--repeat', type=int, default=5, help="重复轮数（取最快一轮）")
+    e2e = parser.add_argument_group("端到端 (e2e)")
+    e2e.add_argument('--items', type=int, default=20, help="任务数")
+    e2e.add_argument('--size', type=int, default=2048, help="每个文件大小 KB")
+    e2e.add_argument('--latency', type=int, default=20, help="每个请求的响应延迟 ms")
+    e2e.add_argument('--throttle', type=int, default=0, help="单连接限速 KB/s，0 表示不限")
+    e2e.add_argument('--jobs', type=int, default=4, help="同时下载数")
+    e2e.add_argument('--modes', default=','.join(E2E_MODES), help="逗号分隔的下载路径")
+    e2e.add_argument('--save', help="把结果保存为 JSON 文件")
+    e2e.add_argument('--baseline', help="与之前 --save 保存的结果对比")
+    # 父进程调用子进程运行单个模式时使用
+    e2e.add_argument('--e2e-child', help=argparse.SUPPRESS)
+    e2e.add_argument('--e2e-server', help=argparse.SUPPRESS)
+    e2e.add_argument('--e2e-fake', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.e2e_child:
+        return run_e2e_child(args)
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知的基准测试: {', '.join(unknown)}")
+
+    status = 0
+    for name in args.benchmarks or list(BENCHMARKS):
+        status |= BENCHMARKS[name](args) or 0
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
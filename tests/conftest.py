@@ -0,0 +1,32 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ytdlp-gui.py")
+
+
+@pytest.fixture(scope="session")
+def app():
+    """加载 ytdlp-gui.py（文件名带连字符，无法直接 import）"""
+    spec = importlib.util.spec_from_file_location("ytdlp_gui", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def fake_ytdlp(tmp_path):
+    """生成一个可执行的假 yt-dlp 脚本（Python 源码），返回其路径"""
+    if os.name == 'nt':
+        pytest.skip("假 yt-dlp 脚本依赖 shebang")
+
+    def make(source, name="yt-dlp"):
+        path = tmp_path / name
+        path.write_text(f"#!{sys.executable}\n{source}", encoding='utf-8')
+        path.chmod(0o755)
+        return str(path)
+
+    return make
@@ -0,0 +1,78 @@
+import os
+import socket
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+
+DEADLINE = 5.0  # 秒
+
+
+def make_signal(app):
+    return app.DownloadSignal(types.SimpleNamespace(download_interrupted=None, download_postprocessing=None))
+
+
+def wait_for(predicate, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="模拟 yt-dlp 只支持 Linux/macOS")
+def test_stop_external_ytdlp(app, tmp_path, monkeypatch):
+    benchmark = pytest.importorskip('benchmark')
+    server, base_url = benchmark.start_synthetic_server(32 * 1024 * 1024)
+    fake = benchmark.make_fake_ytdlp(str(tmp_path))
+    pidfile = tmp_path / "child.pid"
+    monkeypatch.setenv('FAKE_YTDLP_CHILD_PIDFILE', str(pidfile))
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    reactor = app.ProcessReactor()
+    worker = app.DownloadWorker(f"{base_url}/watch/0?rate=262144", str(out_dir), "最佳画质", make_signal(app),
+                                "job_0", fake, "", reactor=reactor)
+    try:
+        worker.start()
+        assert wait_for(lambda: any(name.endswith('.part') for name in os.listdir(out_dir)))
+
+        started = time.monotonic()
+        worker.stop('delete')
+        assert worker.done.wait(DEADLINE)
+        assert time.monotonic() - started < DEADLINE
+        # SIGTERM 后的宽限时间过后进程组已经结束，临时文件已删除
+        time.sleep(app.ProcessReactor.KILL_GRACE + 0.5)
+        assert os.listdir(out_dir) == []
+        assert reactor.active == 0
+    finally:
+        reactor.close()
+        server.shutdown()
+
+
+def test_stop_module_blocked_in_extraction(app, tmp_path):
+    pytest.importorskip('yt_dlp')
+    # 接受连接后不返回任何数据，解析阶段阻塞在读取响应头
+    listener = socket.create_server(("127.0.0.1", 0))
+    accepted = []
+    threading.Thread(target=lambda: accepted.append(listener.accept()), daemon=True).start()
+    pool = app.YoutubeDLPool()
+    worker = app.DownloadWorker(f"http://127.0.0.1:{listener.getsockname()[1]}/watch", str(tmp_path), "最佳画质",
+                                make_signal(app), "job_0", "", "", engine_pool=pool)
+    try:
+        worker.start()
+        assert wait_for(lambda: accepted)
+
+        started = time.monotonic()
+        worker.stop()
+        assert worker.done.wait(DEADLINE)
+        assert time.monotonic() - started < DEADLINE
+        assert worker.cancel_token.cancelled
+    finally:
+        pool.close()
+        listener.close()
+        for connection, _ in accepted:
+            connection.close()
@@ -0,0 +1,81 @@
+import http.client
+import json
+
+import pytest
+
+
+@pytest.fixture
+def server(app):
+    submitted = []
+
+    def submit(payload):
+        submitted.append(payload)
+        return {'added': len(payload['urls'])}
+
+    server = app.ControlServer(lambda func: func(), submit, lambda download_id, action: 0, port=0, token="secret")
+    server.submitted = submitted
+    server.start()
+    yield server
+    server.stop()
+
+
+def request(server, method, path, body=None, host=None, headers=None):
+    connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=10)
+    try:
+        connection.putrequest(method, path, skip_host=True)
+        connection.putheader('Host', host or f'127.0.0.1:{server.port}')
+        for name, value in (headers or {}).items():
+            connection.putheader(name, value)
+        if body is not None:
+            connection.putheader('Content-Length', str(len(body)))
+        connection.endheaders(body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b'null')
+    finally:
+        connection.close()
+
+
+AUTH = {'Authorization': 'Bearer secret'}
+JSON = {'Authorization': 'Bearer secret', 'Content-Type': 'application/json'}
+
+
+def test_requires_token(server):
+    assert request(server, 'GET', '/jobs')[0] == 401
+    assert request(server, 'GET', '/jobs', headers={'Authorization': 'Bearer wrong'})[0] == 401
+    assert request(server, 'GET', '/jobs', headers={'X-Api-Token': 'secret'}) == (200, {'jobs': []})
+
+
+@pytest.mark.parametrize("host, allowed", [
+    ('localhost:{port}', True),
+    ('[::1]:{port}', True),
+    ('127.0.0.1', True),
+    ('127.0.0.1:1', False),
+    ('[::1]:1', False),
+    ('evil.example:{port}', False),
+    ('127.0.0.1.evil.example:{port}', False),
+])
+def test_host_check(server, host, allowed):
+    status = request(server, 'GET', '/jobs', host=host.format(port=server.port), headers=AUTH)[0]
+    assert status == (200 if allowed else 403)
+
+
+def test_foreign_origin_rejected(server):
+    headers = dict(AUTH, Origin='http://evil.example')
+    assert request(server, 'GET', '/jobs', headers=headers)[0] == 403
+    headers = dict(AUTH, Origin=f'http://localhost:{server.port}')
+    assert request(server, 'GET', '/jobs', headers=headers)[0] == 200
+
+
+def test_submit_requires_json(server):
+    body = json.dumps({'urls': ['https://example.com/a']}).encode()
+    assert request(server, 'POST', '/jobs', body, headers=dict(AUTH, **{'Content-Type': 'text/plain'}))[0] == 415
+    assert request(server, 'POST', '/jobs', body, headers=JSON) == (200, {'added': 1})
+    assert server.submitted == [{'urls': ['https://example.com/a']}]
+
+
+def test_body_limit(server, app):
+    body = json.dumps({'urls': ['https://example.com/' + 'a' * app.ControlServer.MAX_BODY]}).encode()
+    # 未通过校验的请求不读取请求体
+    assert request(server, 'POST', '/jobs', body, headers={'Content-Type': 'application/json'})[0] == 401
+    assert request(server, 'POST', '/jobs', body, headers=JSON)[0] == 413
+    assert server.submitted == []
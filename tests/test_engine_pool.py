@@ -0,0 +1,33 @@
+import pytest
+
+
+def test_profile_key_ignores_option_order(app):
+    a = app.YoutubeDLPool.profile_key({'format': 'best', 'quiet': True, 'postprocessors': [{'key': 'FFmpegExtractAudio'}]}, 1)
+    b = app.YoutubeDLPool.profile_key({'postprocessors': [{'key': 'FFmpegExtractAudio'}], 'quiet': True, 'format': 'best'}, 1)
+    assert a == b
+    assert a != app.YoutubeDLPool.profile_key({'format': 'best', 'quiet': True}, 1)
+    assert a != app.YoutubeDLPool.profile_key({'format': 'best', 'quiet': True, 'postprocessors': [{'key': 'FFmpegExtractAudio'}]}, 4)
+
+
+def test_profile_key_rejects_unlisted_options(app):
+    with pytest.raises(ValueError):
+        app.YoutubeDLPool.profile_key({'format': 'best', 'progress_hooks': [print]}, 1)
+    with pytest.raises(ValueError):
+        app.YoutubeDLPool.profile_key({'match_filter': lambda info: None}, 1)
+
+
+def test_lease_reuses_engine_without_patching_instance(app, tmp_path):
+    pytest.importorskip('yt_dlp')
+    pool = app.YoutubeDLPool()
+    opts = {'outtmpl': str(tmp_path / '%(title)s.%(ext)s'), 'quiet': True, 'no_warnings': True}
+    try:
+        with pool.lease(opts, None) as (first, reused):
+            assert not reused
+        with pool.lease(dict(opts), None) as (second, reused):
+            assert reused
+            assert second is first
+        # 推迟后处理和存档通过子类方法实现，实例上没有替换过的绑定方法
+        assert 'post_process' not in vars(first)
+        assert 'record_download_archive' not in vars(first)
+    finally:
+        pool.close()
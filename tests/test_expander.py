@@ -0,0 +1,58 @@
+import os
+import time
+
+import pytest
+
+
+ENTRIES = [{'url': f'https://example.com/watch?v={i}', 'title': f'clip {i}', 'id': str(i)} for i in range(3)]
+
+
+def test_external_flat_playlist(app, fake_ytdlp):
+    script = fake_ytdlp("import json, sys\n"
+                        f"for entry in {ENTRIES!r}:\n"
+                        "    print(json.dumps(entry))\n"
+                        "print('[youtube:tab] Downloading page 2')\n")
+    expander = app.PlaylistExpander(app.DownloadSignal(None))
+    try:
+        assert list(expander._iter_external('https://example.com/list', script)) == ENTRIES
+    finally:
+        expander.shutdown()
+        expander.reactor.close()
+
+
+def test_external_error_line_raises(app, fake_ytdlp):
+    script = fake_ytdlp("print('ERROR: [generic] Unsupported URL')\n")
+    expander = app.PlaylistExpander(app.DownloadSignal(None))
+    try:
+        with pytest.raises(Exception, match=r"^\[generic\] Unsupported URL$"):
+            list(expander._iter_external('https://example.com/list', script))
+    finally:
+        expander.shutdown()
+        expander.reactor.close()
+
+
+def test_closing_iterator_terminates_process(app, fake_ytdlp, tmp_path):
+    pidfile = tmp_path / "pid"
+    script = fake_ytdlp("import json, os, time\n"
+                        f"open({str(pidfile)!r} + '.tmp', 'w').write(str(os.getpid()))\n"
+                        f"os.replace({str(pidfile)!r} + '.tmp', {str(pidfile)!r})\n"
+                        f"print(json.dumps({ENTRIES[0]!r}), flush=True)\n"
+                        "time.sleep(60)\n")
+    expander = app.PlaylistExpander(app.DownloadSignal(None))
+    try:
+        entries = expander._iter_external('https://example.com/list', script)
+        assert next(entries) == ENTRIES[0]
+        pid = int(pidfile.read_text())
+        entries.close()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                break
+            time.sleep(0.05)
+        else:
+            raise AssertionError("外部 yt-dlp 进程没有结束")
+    finally:
+        expander.shutdown()
+        expander.reactor.close()
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+
+def test_replay_after_compact(app, tmp_path):
+    path = str(tmp_path / "queue.jsonl")
+    items = {'a': {'url': 'https://example.com/a', 'quality': '720p', 'status': 'queued', 'progress': 0}}
+    journal = app.QueueJournal(path)
+    journal.open(lambda: items)
+    journal.add('b', {'url': 'https://example.com/b', 'quality': '最佳画质', 'status': 'queued', 'progress': 0})
+    items['b'] = {'url': 'https://example.com/b', 'quality': '最佳画质', 'status': 'paused', 'progress': 40}
+    journal.update('b', status='paused', progress=40)
+    journal.remove('a')
+    del items['a']
+    journal.compact()
+    journal.update('b', progress=41)
+    journal.close()
+
+    assert not os.path.exists(path + ".tmp")
+    assert app.QueueJournal(path).load() == {
+        'b': {'url': 'https://example.com/b', 'quality': '最佳画质', 'status': 'paused', 'progress': 41},
+    }
+
+
+def test_truncated_last_record_is_ignored(app, tmp_path):
+    path = str(tmp_path / "queue.jsonl")
+    journal = app.QueueJournal(path)
+    journal.open(dict)
+    journal.add('a', {'url': 'https://example.com/a', 'status': 'queued'})
+    journal.close()
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"op": "update", "id": "a", "sta')
+
+    assert app.QueueJournal(path).load() == {'a': {'url': 'https://example.com/a', 'status': 'queued'}}
+
+
+def test_download_item_keeps_none_fields(app):
+    item = app.DownloadItem('https://example.com/a', '720p')
+    assert 'title' not in item
+    assert item.get('title', 'x') == 'x'
+    with pytest.raises(KeyError):
+        item['title']
+    item['title'] = None
+    assert 'title' in item
+    assert item['title'] is None
+    assert item.get('title', 'x') is None
+    assert item.pop('title', 'x') is None
+    assert 'title' not in item
+    assert item.pop('title', 'x') == 'x'
+    with pytest.raises(KeyError):
+        item.pop('title')
+
+
+def test_journal_records_none_fields(app, tmp_path):
+    path = str(tmp_path / "queue.jsonl")
+    item = app.DownloadItem('https://example.com/a', '720p', status='queued')
+    item['message'] = None
+    journal = app.QueueJournal(path)
+    journal.open(lambda: {'a': item})
+    journal.add('a', item)
+    assert app.QueueJournal(path).load()['a']['message'] is None
+    journal.compact()
+    journal.close()
+
+    record = app.QueueJournal(path).load()['a']
+    assert record['message'] is None
+    assert 'title' not in record
@@ -0,0 +1,31 @@
+import re
+
+
+def test_escape_label(app):
+    assert app.DownloadMetrics.escape_label('a\\b"c\nd') == 'a\\\\b\\"c\\nd'
+    assert app.DownloadMetrics.escape_label(42) == '42'
+
+
+def test_render_prometheus_escapes_labels(app):
+    metrics = app.DownloadMetrics()
+    metrics.job_started('job"1\n')
+    metrics.set_extractor('job"1\n', 'Weird\\"Site')
+    metrics.job_finished('done', 'completed', 'Generic"\nx')
+
+    text = metrics.render_prometheus()
+    assert 'ytdlp_gui_job_speed_bytes{id="job\\"1\\n",extractor="Weird\\\\\\"Site"} 0.0' in text
+    assert 'ytdlp_gui_completed_total{extractor="generic\\"\\nx"} 1' in text
+    # 每个样本占一行：标签值中的换行已转义
+    sample = re.compile(r'^[a-z_]+(\{([a-z]+="(\\.|[^"\\])*",?)*\})? \S+$')
+    for line in text.splitlines():
+        assert line.startswith('# ') or sample.match(line), line
+
+
+def test_every_family_has_help_and_type(app):
+    text = app.DownloadMetrics().render_prometheus()
+    helped = set(re.findall(r'^# HELP (\S+) ', text, re.M))
+    typed = set(re.findall(r'^# TYPE (\S+) ', text, re.M))
+    assert typed
+    assert helped == typed
+    for name in ('completed', 'failed', 'retries'):
+        assert f'ytdlp_gui_{name}_total' in typed
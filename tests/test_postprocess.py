@@ -0,0 +1,42 @@
+import os
+import sys
+import types
+
+import pytest
+
+
+def test_deferred_postprocessing_runs_on_fresh_instance(app, tmp_path):
+    pytest.importorskip('yt_dlp')
+    benchmark = pytest.importorskip('benchmark')
+    media = tmp_path / "media"
+    media.mkdir()
+    (media / "clip.mp4").write_bytes(os.urandom(64 * 1024))
+    marker = tmp_path / "marker"
+    archive = tmp_path / "archive.txt"
+    server, base_url = benchmark.start_media_server(str(media))
+    pool = app.YoutubeDLPool()
+    opts = {
+        'outtmpl': str(tmp_path / "%(title)s.%(ext)s"), 'quiet': True, 'no_warnings': True,
+        'download_archive': str(archive),
+        'postprocessors': [{'key': 'Exec', 'when': 'after_move',
+                            'exec_cmd': [f'"{sys.executable}" -c "import sys; open(sys.argv[2], \'w\').write(sys.argv[1])" '
+                                         f'{{}} "{marker}"']}],
+    }
+    try:
+        worker = app.DownloadWorker(base_url + "/clip.mp4", str(tmp_path), "最佳画质", app.DownloadSignal(types.SimpleNamespace(download_postprocessing=None)),
+                                    "job_0", "", "", postprocess_stage=app.PostprocessStage(1))
+        jobs = []
+        with pool.lease(opts, None, postprocess_hook=worker.defer_postprocess(jobs)) as (ydl, _):
+            ydl.download([base_url + "/clip.mp4"])
+        # 下载实例只收集后处理任务，不执行后处理也不写存档
+        assert len(jobs) == 1
+        assert not marker.exists()
+        assert not archive.exists()
+
+        worker._is_running = True
+        worker.run_postprocessing(opts, jobs)
+        assert marker.read_text() == str(tmp_path / "clip.mp4")
+        assert archive.read_text().split() == ['generic', 'clip']
+    finally:
+        pool.close()
+        server.shutdown()
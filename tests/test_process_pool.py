@@ -0,0 +1,64 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+
+class FakeExecutor:
+    def __init__(self, error=None):
+        self.error = error
+        self.submitted = []
+        self.shut_down = False
+
+    def submit(self, *args):
+        if self.error is not None:
+            raise self.error
+        self.submitted.append(args)
+        return Future()
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+@pytest.fixture
+def pool(app):
+    pool = app.DownloadProcessPool(max_workers=1)
+    yield pool
+    pool.close()
+
+
+def submit(pool):
+    return pool.submit('https://example.com/a', {}, 1, None, lambda kind, payload: None)
+
+
+@pytest.mark.parametrize("error", [TypeError("cannot pickle"), RuntimeError("cannot schedule new futures")])
+def test_failed_submit_releases_slot(pool, error):
+    pool._executor = FakeExecutor(error)
+    with pytest.raises(type(error)):
+        submit(pool)
+    assert pool._handlers == {}
+    assert pool._slots == {}
+    assert len(pool._free) == pool.SLOTS
+
+
+def test_broken_pool_is_replaced_under_lock(pool, monkeypatch):
+    broken = pool._executor = FakeExecutor(BrokenProcessPool())
+    replacement = FakeExecutor()
+    monkeypatch.setattr(pool, '_create_executor', lambda: replacement)
+
+    handle, future = submit(pool)
+    assert pool._executor is replacement
+    assert broken.shut_down
+    assert len(replacement.submitted) == 1
+    assert pool._slots == {handle[0]: handle[1]}
+    pool.release(handle)
+    assert len(pool._free) == pool.SLOTS
+
+
+def test_failed_retry_releases_slot(pool, monkeypatch):
+    pool._executor = FakeExecutor(BrokenProcessPool())
+    monkeypatch.setattr(pool, '_create_executor', lambda: FakeExecutor(BrokenProcessPool()))
+    with pytest.raises(BrokenProcessPool):
+        submit(pool)
+    assert pool._handlers == {}
+    assert len(pool._free) == pool.SLOTS
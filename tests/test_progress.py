@@ -0,0 +1,60 @@
+import pytest
+
+
+MIB = 1024 ** 2
+GIB = 1024 ** 3
+
+# 真实 yt-dlp --newline 输出中的 [download] 行 -> (percent, downloaded, total, speed, eta)
+PROGRESS_LINES = [
+    ("[download] Destination: /home/user/Downloads/Big Buck Bunny 60fps 4K - Official Blender Foundation Short Film.f401.mp4",
+     (0, None, None, 0, None)),
+    ("[download]   0.0% of  642.13MiB at  Unknown B/s ETA Unknown",
+     (0.0, 0.0, 642.13 * MIB, 0, None)),
+    ("[download]   0.0% of  642.13MiB at  345.67KiB/s ETA 31:41",
+     (0.0, 0.0, 642.13 * MIB, 345.67 * 1024, "31:41")),
+    ("[download]   0.1% of  642.13MiB at    2.37MiB/s ETA 04:30",
+     (0.1, 642.13 * MIB * 0.001, 642.13 * MIB, 2.37 * MIB, "04:30")),
+    ("[download]  12.4% of  642.13MiB at    9.81MiB/s ETA 00:57",
+     (12.4, 642.13 * MIB * 0.124, 642.13 * MIB, 9.81 * MIB, "00:57")),
+    ("[download]  65.3% of ~ 100.00MiB at    2.50MiB/s ETA 00:12 (frag 13/20)",
+     (65.3, 65.3 * MIB, 100 * MIB, 2.5 * MIB, "00:12")),
+    ("[download]  99.9% of  642.13MiB at   10.02MiB/s ETA 00:00",
+     (99.9, 642.13 * MIB * 0.999, 642.13 * MIB, 10.02 * MIB, "00:00")),
+    ("[download] 100% of  642.13MiB in 00:01:04 at 9.98MiB/s",
+     (100.0, 642.13 * MIB, 642.13 * MIB, 9.98 * MIB, None)),
+    ("[download] 100.0% of   3.21GiB in 00:05:31 at 9.93MiB/s",
+     (100.0, 3.21 * GIB, 3.21 * GIB, 9.93 * MIB, None)),
+    ("[download]  45.7MiB/100.0MiB",
+     (45.7, 45.7 * MIB, 100 * MIB, 0, None)),
+    ("[download] /home/user/Downloads/clip.mp4 has already been downloaded",
+     (0, None, None, 0, None)),
+]
+
+
+@pytest.mark.parametrize("line, expected", PROGRESS_LINES)
+def test_parse_progress_line(app, line, expected):
+    percent, downloaded, total, speed, eta = app.parse_progress_line(line)
+    assert percent == pytest.approx(expected[0])
+    assert downloaded == (None if expected[1] is None else pytest.approx(expected[1]))
+    assert total == (None if expected[2] is None else pytest.approx(expected[2]))
+    assert speed == pytest.approx(expected[3])
+    assert eta == expected[4]
+
+
+@pytest.mark.parametrize("line", [
+    "[download] 100% of  642.13MiB in 00:01:04 at 9.98MiB/s",
+    "[download] 12.34MiB/12.34MiB in 00:01:04",
+    "[download] Downloading item 3 of 10 in 00:01:04",
+])
+def test_elapsed_time_is_not_eta(app, line):
+    """完成行中 in 后面是已用时间，快速路径和通用扫描都不能当作剩余时间"""
+    assert app.parse_progress_line(line)[4] is None
+
+
+def test_eta_without_fast_path(app):
+    """快速路径不匹配的行（如分片进度）仍从 ETA 后面取剩余时间"""
+    percent, downloaded, total, speed, eta = app.parse_progress_line(
+        "[download]  45.7MiB/100.0MiB at 1.50MiB/s ETA 00:36 (frag 5/10)")
+    assert percent == pytest.approx(45.7)
+    assert speed == pytest.approx(1.5 * MIB)
+    assert eta == "00:36"
@@ -1,31 +1,1731 @@
-import tkinter as tk
-from tkinter import ttk, scrolledtext, filedialog, messagebox
 import threading
 import os
 import subprocess
 from datetime import datetime
-import yt_dlp
 import sys
+import types
 import glob
+import importlib.util
 import re
+import shutil
+import socket
+import contextlib
+import copy
+import tempfile
+import heapq
+import bisect
+import itertools
+import time
+import random
+import queue
+import json
+import locale
+import logging
+import logging.handlers
+import argparse
+import asyncio
+import hmac
+import secrets
+import weakref
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from urllib.parse import urlparse, urlsplit, parse_qsl, urlencode
+
+
+def import_tkinter():
+    """导入 tkinter（只有界面模式需要，无界面模式和服务器上不加载）"""
+    global tk, ttk, scrolledtext, filedialog, messagebox, simpledialog, tkfont
+    import tkinter as tk
+    from tkinter import ttk, scrolledtext, filedialog, messagebox, simpledialog
+    import tkinter.font as tkfont
+
+
+def get_app_data_dir():
+    """返回程序数据目录（日志、缓存等），不存在时自动创建"""
+    if sys.platform == "win32":
+        base = os.environ.get("APPDATA") or os.path.expanduser("~")
+        path = os.path.join(base, "ytdlp-gui")
+    else:
+        path = os.path.join(os.path.expanduser("~"), ".ytdlp-gui")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def run_hidden_process(cmd, timeout=10):
+    """运行隐藏窗口的进程"""
+    startupinfo = None
+    creationflags = 0
+    if sys.platform == "win32":
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = 0
+        creationflags = subprocess.CREATE_NO_WINDOW
+
+    return subprocess.run(cmd,
+                          capture_output=True,
+                          text=True,
+                          timeout=timeout,
+                          startupinfo=startupinfo,
+                          creationflags=creationflags)
+
+
+class ToolDiscovery:
+    """查找 FFmpeg / yt-dlp 可执行文件，结果按路径和修改时间缓存到磁盘
+
+    缓存有效时（文件未变化，或上次未找到且 PATH 与程序目录都未变化）不再
+    遍历目录和运行 -version 探测
+    """
+
+    TOOLS = {
+        'ffmpeg': {
+            'names': ["ffmpeg.exe"],
+            # 常见安装目录
+            'extra': ["C:\\ffmpeg\\bin\\ffmpeg.exe",
+                      "C:\\Program Files\\ffmpeg\\bin\\ffmpeg.exe",
+                      "C:\\Program Files (x86)\\ffmpeg\\bin\\ffmpeg.exe",
+                      "~\\ffmpeg\\bin\\ffmpeg.exe"],
+            'args': ['-version'],
+            'expect': "ffmpeg version",
+        },
+        'yt-dlp': {
+            'names': ["yt-dlp.exe", "yt-dlp"],
+            'extra': ["C:\\yt-dlp\\yt-dlp.exe",
+                      "~\\yt-dlp\\yt-dlp.exe"],
+            'args': ['--version'],
+            'expect': None,
+        },
+    }
+
+    def __init__(self, cache_path, program_dir, tools=None):
+        self.cache_path = cache_path
+        self.program_dir = program_dir
+        self.tools = tools or self.TOOLS
+        self._lock = threading.Lock()
+        try:
+            with open(cache_path, encoding='utf-8') as f:
+                self._cache = json.load(f)
+        except (OSError, ValueError):
+            self._cache = {}
+
+    def _file_signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return [stat.st_mtime, stat.st_size]
+
+    def _search_signature(self):
+        """未找到时的缓存键：PATH 和程序目录没有变化就不必重新查找"""
+        return [os.environ.get("PATH", ""), self._file_signature(self.program_dir)]
+
+    def cached(self, name):
+        """返回 (缓存是否有效, 路径)"""
+        entry = self._cache.get(name)
+        if not entry:
+            return False, None
+        path = entry.get('path')
+        if path:
+            return self._file_signature(path) == entry.get('signature'), path
+        return entry.get('search') == self._search_signature(), None
+
+    def candidates(self, name):
+        tool = self.tools[name]
+        names = tool['names']
+        # 当前目录、程序所在目录
+        yield from names
+        for tool_name in names:
+            yield os.path.join(self.program_dir, tool_name)
+        # PATH环境变量
+        path_dirs = [path for path in os.environ.get("PATH", "").split(os.pathsep) if path]
+        for tool_name in names:
+            for path_dir in path_dirs:
+                yield os.path.join(path_dir, tool_name)
+        # 常见安装目录
+        for path in tool['extra']:
+            yield os.path.expanduser(path)
+        # 递归搜索程序目录和子目录（最慢，放在最后）
+        for root, dirs, files in os.walk(self.program_dir):
+            for tool_name in names:
+                if tool_name in files:
+                    yield os.path.join(root, tool_name)
+
+    def discover(self, name):
+        """逐个探测候选路径，返回找到的路径或 None，并更新缓存"""
+        tool = self.tools[name]
+        found = None
+        for path in self.candidates(name):
+            if not os.path.isfile(path):
+                continue
+            try:
+                # 验证是否是有效的可执行文件
+                result = run_hidden_process([path] + tool['args'], timeout=5)
+            except (subprocess.SubprocessError, OSError):
+                continue
+            if result.returncode == 0 and (tool['expect'] is None or tool['expect'] in result.stdout):
+                found = path
+                break
+
+        with self._lock:
+            if found:
+                self._cache[name] = {'path': found, 'signature': self._file_signature(found)}
+            else:
+                self._cache[name] = {'path': None, 'search': self._search_signature()}
+            try:
+                with open(self.cache_path, 'w', encoding='utf-8') as f:
+                    json.dump(self._cache, f, ensure_ascii=False)
+            except OSError:
+                pass
+        return found
+
+
+# 大小/速度单位换算表（与 yt-dlp 输出一致，KB 与 KiB 均按 1024 计算）
+SIZE_UNITS = {
+    'B': 1,
+    'KB': 1024, 'KIB': 1024,
+    'MB': 1024 ** 2, 'MIB': 1024 ** 2,
+    'GB': 1024 ** 3, 'GIB': 1024 ** 3,
+    'TB': 1024 ** 4, 'TIB': 1024 ** 4,
+}
+
+# 进度行的所有字段合并为一个预编译正则，一次扫描完成解析，例如:
+# [download]  65.3% of ~ 100.00MiB at    2.50MiB/s ETA 00:12 (frag 3/20)
+# [download] 100% of   12.34MiB in 00:00:10 at 1.20MiB/s
+# [download]  45.7MiB/100.0MiB
+_NUM = r'\d+(?:\.\d+)?'
+_UNIT = r'[KMGT]?i?B'
+PROGRESS_LINE_RE = re.compile(
+    rf'''
+      (?P<percent>{_NUM})%
+    | (?P<done>{_NUM})\s*(?P<done_unit>{_UNIT})\s*/\s*(?P<pair_total>{_NUM})\s*(?P<pair_total_unit>{_UNIT})
+    | (?P<speed>{_NUM})\s*(?P<speed_unit>{_UNIT})/s
+    | \bof\s+~?\s*(?P<total>{_NUM})\s*(?P<total_unit>{_UNIT})
+    | \bETA\s+(?P<eta>\d+:\d+(?::\d+)?)
+    ''',
+    re.VERBOSE | re.IGNORECASE
+)
+
+
+# 标准进度行的快速路径（绝大多数输出行），不匹配时再走通用扫描
+PROGRESS_FAST_RE = re.compile(
+    rf'''\[download\]\s+(?P<percent>{_NUM})%\s+of\s+~?\s*(?P<total>{_NUM})\s*(?P<total_unit>{_UNIT})
+    (?:\s+in\s+\d+:\d+(?::\d+)?)?
+    (?:\s+at\s+(?:(?P<speed>{_NUM})\s*(?P<speed_unit>{_UNIT})/s|Unknown\s+B/s))?
+    (?:\s+ETA\s+(?P<eta>\d+:\d+(?::\d+)?))?
+    ''',
+    re.VERBOSE | re.IGNORECASE
+)
+
+
+def to_bytes(value, unit):
+    """按单位换算表把数值转换为字节数"""
+    return float(value) * SIZE_UNITS.get(unit.upper(), 1)
+
+
+def parse_progress_line(line):
+    """单次扫描解析 yt-dlp 进度行
+
+    返回 (percent, downloaded, total, speed, eta)，无法解析的字段为 0 或 None。
+    eta 只取 ETA 后面的剩余时间，完成行 "in 00:01:04" 是已用时间，不当作 eta
+    """
+    match = PROGRESS_FAST_RE.match(line)
+    if match:
+        percent = float(match.group('percent'))
+        total = to_bytes(match.group('total'), match.group('total_unit'))
+        speed = to_bytes(match.group('speed'), match.group('speed_unit')) if match.group('speed') else 0
+        return percent, total * percent / 100, total, speed, match.group('eta')
+
+    percent = None
+    downloaded = total = None
+    speed = None
+    eta = None
+
+    for match in PROGRESS_LINE_RE.finditer(line):
+        group = match.lastgroup
+        if group == 'percent':
+            if percent is None:
+                percent = float(match.group('percent'))
+        elif group == 'pair_total_unit':
+            if downloaded is None:
+                downloaded = to_bytes(match.group('done'), match.group('done_unit'))
+                total = to_bytes(match.group('pair_total'), match.group('pair_total_unit'))
+        elif group == 'speed_unit':
+            if speed is None:
+                speed = to_bytes(match.group('speed'), match.group('speed_unit'))
+        elif group == 'total_unit':
+            if total is None:
+                total = to_bytes(match.group('total'), match.group('total_unit'))
+        elif group == 'eta':
+            if eta is None:
+                eta = match.group('eta')
+
+    if percent is None:
+        percent = downloaded / total * 100 if downloaded is not None and total else 0
+    elif downloaded is None and total is not None:
+        downloaded = total * percent / 100
+
+    return percent, downloaded, total, speed or 0, eta
+
+
+# 外部 yt-dlp 的机器可读进度协议：通过 --progress-template 输出固定字段的记录行
+# 字段: 状态 已下载字节 总字节 估计总字节 速度(字节/秒) 剩余秒数，缺失值为 NA
+PROGRESS_RECORD_PREFIX = "__YTDLP_GUI_PROGRESS__"
+PROGRESS_TEMPLATE = (
+    "download:" + PROGRESS_RECORD_PREFIX +
+    " %(progress.status)s %(progress.downloaded_bytes)s %(progress.total_bytes)s"
+    " %(progress.total_bytes_estimate)s %(progress.speed)s %(progress.eta)s"
+)
+
+
+def _record_number(value):
+    if value == 'NA' or value == 'None':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_progress_record(line):
+    """解析 PROGRESS_TEMPLATE 输出的进度记录行
+
+    返回 (status, percent, downloaded, total, speed, eta)，不是记录行时返回 None
+    """
+    parts = line.split()
+    if len(parts) != 7 or parts[0] != PROGRESS_RECORD_PREFIX:
+        return None
+
+    status = parts[1]
+    downloaded = _record_number(parts[2])
+    total = _record_number(parts[3]) or _record_number(parts[4])
+    speed = _record_number(parts[5]) or 0
+    eta = _record_number(parts[6])
+
+    if status == 'finished':
+        percent = 100
+    elif downloaded is not None and total:
+        percent = downloaded / total * 100
+    else:
+        percent = 0
+    return status, percent, downloaded, total, speed, format_eta(eta)
+
+
+def format_eta(seconds):
+    """把剩余秒数格式化为 MM:SS 或 HH:MM:SS"""
+    if seconds is None:
+        return None
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def format_speed(speed_bytes):
+    """格式化下载速度显示"""
+    if not speed_bytes:
+        return "0 B/s"
+    elif speed_bytes >= 1024 * 1024 * 1024:
+        return f"{speed_bytes / (1024 * 1024 * 1024):.2f} GB/s"
+    elif speed_bytes >= 1024 * 1024:
+        return f"{speed_bytes / (1024 * 1024):.2f} MB/s"
+    elif speed_bytes >= 1024:
+        return f"{speed_bytes / 1024:.2f} KB/s"
+    else:
+        return f"{speed_bytes:.0f} B/s"
+
+
+def format_size(size_bytes):
+    """格式化文件大小显示"""
+    if not size_bytes:
+        return ""
+    for unit, factor in (("GB", 1024 ** 3), ("MB", 1024 ** 2), ("KB", 1024)):
+        if size_bytes >= factor:
+            return f"{size_bytes / factor:.1f} {unit}"
+    return f"{size_bytes:.0f} B"
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒字节数（0 表示不限速），允许欠账，欠多少就要等多久
+
+    速率可以随时修改，正在等待的线程按新速率计算剩余等待时间
+    """
+
+    BURST_SECONDS = 1.0
+
+    def __init__(self, rate=0):
+        self.rate = max(0, rate)
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.rate * self.BURST_SECONDS)
+        self._updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = max(0, rate)
+            if not self.rate:
+                self._tokens = 0.0
+
+    def take(self, nbytes):
+        with self._lock:
+            if self.rate:
+                self._refill()
+                self._tokens -= nbytes
+
+    def wait_time(self):
+        """还清欠账需要等待的秒数"""
+        with self._lock:
+            if not self.rate:
+                return 0
+            self._refill()
+            return max(0.0, -self._tokens / self.rate)
+
+
+class BandwidthLimiter:
+    """全局限速加单任务限速：所有下载线程共享全局令牌桶，每个任务另有自己的令牌桶
+
+    调整限速时各线程在下一次申请带宽时按新速率分配，不需要重启下载
+    """
+
+    WAIT_SLICE = 0.1  # 秒，等待期间检查暂停/停止的间隔
+
+    def __init__(self, global_rate=0):
+        self.global_bucket = TokenBucket(global_rate)
+        self._jobs = {}  # download_id -> TokenBucket
+        self._lock = threading.Lock()
+
+    def set_global_rate(self, rate):
+        self.global_bucket.set_rate(rate)
+
+    def register(self, download_id, rate=0):
+        with self._lock:
+            self._jobs[download_id] = TokenBucket(rate)
+
+    def unregister(self, download_id):
+        with self._lock:
+            self._jobs.pop(download_id, None)
+
+    def set_job_rate(self, download_id, rate):
+        with self._lock:
+            bucket = self._jobs.get(download_id)
+        if bucket is not None:
+            bucket.set_rate(rate)
+
+    def consume(self, download_id, nbytes, is_running=None, wait=True):
+        """申请 nbytes 字节的带宽，超出限速时阻塞；is_running() 返回 False 时提前返回"""
+        with self._lock:
+            buckets = [self.global_bucket, self._jobs.get(download_id)]
+        buckets = [bucket for bucket in buckets if bucket is not None]
+        for bucket in buckets:
+            bucket.take(nbytes)
+        while wait:
+            delay = max(bucket.wait_time() for bucket in buckets)
+            if delay <= 0 or (is_running is not None and not is_running()):
+                return
+            time.sleep(min(delay, self.WAIT_SLICE))
+
+    def share(self, download_id):
+        """不能逐块申请带宽的下载（外部 yt-dlp 的 --limit-rate、下载进程）的限速：
+        单任务限速和全局限速平均分配后的较小值"""
+        with self._lock:
+            bucket = self._jobs.get(download_id)
+            active = max(1, len(self._jobs))
+        rates = [bucket.rate if bucket is not None else 0, self.global_bucket.rate / active]
+        rates = [rate for rate in rates if rate]
+        return int(min(rates)) if rates else 0
+
+
+class LatencyHistogram:
+    """耗时分布：Prometheus 风格的累计分桶，另保留最近一段时间的样本用于滚动平均"""
+
+    BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, window=300):
+        self.window = window
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque()  # (时间, 秒)
+
+    def observe(self, value, now):
+        self.counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+        self.recent.append((now, value))
+        while self.recent and self.recent[0][0] < now - self.window:
+            self.recent.popleft()
+
+    def average(self, window, now):
+        values = [value for t, value in self.recent if t >= now - window]
+        return sum(values) / len(values) if values else None
+
+
+class DownloadMetrics:
+    """下载指标：工作线程在进度回调中记录，界面统计面板和 /metrics 读取
+
+    - 吞吐：按秒汇总的字节数，计算最近 5 秒/1 分钟/5 分钟的平均速度
+    - 耗时：首字节、解析、后处理（FFmpeg）
+    - 按提取器统计完成、失败和重试次数
+    """
+
+    WINDOWS = (5, 60, 300)  # 秒
+    LATENCIES = ('ttfb', 'extraction', 'postprocess')
+    # Prometheus 指标说明（# HELP）
+    COUNTER_HELP = {
+        'completed': "按提取器统计的完成任务数",
+        'failed': "按提取器统计的失败任务数",
+        'retries': "按提取器统计的重试次数",
+    }
+    LATENCY_HELP = {
+        'ttfb': "开始下载到收到第一个字节的耗时",
+        'extraction': "解析视频信息的耗时",
+        'postprocess': "后处理（FFmpeg）的耗时",
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bytes_total = 0
+        self._per_second = deque()  # [秒, 字节数]
+        self.latencies = {name: LatencyHistogram(max(self.WINDOWS)) for name in self.LATENCIES}
+        self.counters = {}  # (指标名, 提取器) -> 次数
+        self.active = {}  # download_id -> {'speed', 'extractor'}
+
+    def add_bytes(self, download_id, nbytes, speed=None):
+        now = time.monotonic()
+        second = int(now)
+        with self._lock:
+            self.bytes_total += nbytes
+            if self._per_second and self._per_second[-1][0] == second:
+                self._per_second[-1][1] += nbytes
+            else:
+                self._per_second.append([second, nbytes])
+                while self._per_second[0][0] <= second - max(self.WINDOWS):
+                    self._per_second.popleft()
+            if speed is not None and download_id in self.active:
+                self.active[download_id]['speed'] = speed
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.latencies[name].observe(seconds, time.monotonic())
+
+    def count(self, name, extractor=None):
+        key = (name, (extractor or 'unknown').lower())
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def job_started(self, download_id):
+        with self._lock:
+            self.active[download_id] = {'speed': 0, 'extractor': None}
+
+    def set_extractor(self, download_id, extractor):
+        with self._lock:
+            if download_id in self.active:
+                self.active[download_id]['extractor'] = extractor
+
+    def job_finished(self, download_id, result=None, extractor=None):
+        """result 为 completed/failed，暂停或停止时为 None（只移出活动任务）"""
+        with self._lock:
+            self.active.pop(download_id, None)
+        if result:
+            self.count(result, extractor)
+
+    def mean(self, name):
+        """全部样本的平均耗时"""
+        with self._lock:
+            histogram = self.latencies[name]
+            return histogram.total / histogram.count if histogram.count else None
+
+    def rate(self, window):
+        """最近 window 秒的平均速度（字节/秒），不含当前未满的一秒"""
+        current = int(time.monotonic())
+        with self._lock:
+            total = sum(nbytes for second, nbytes in self._per_second if current - window <= second < current)
+        return total / window
+
+    def snapshot(self):
+        """界面统计面板和无界面模式汇总使用的数据"""
+        now = time.monotonic()
+        with self._lock:
+            latencies = {name: histogram.average(60, now) for name, histogram in self.latencies.items()}
+            counters = dict(self.counters)
+            active = len(self.active)
+        return {
+            'bytes_total': self.bytes_total,
+            'rates': {window: self.rate(window) for window in self.WINDOWS},
+            'latencies': latencies,
+            'counters': counters,
+            'active': active,
+        }
+
+    @staticmethod
+    def escape_label(value):
+        """Prometheus 标签值转义：反斜杠、双引号和换行"""
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def render_prometheus(self):
+        """Prometheus 文本格式"""
+        label = self.escape_label
+        lines = [
+            "# HELP ytdlp_gui_downloaded_bytes_total 已下载的字节数",
+            "# TYPE ytdlp_gui_downloaded_bytes_total counter",
+            f"ytdlp_gui_downloaded_bytes_total {self.bytes_total}",
+            "# HELP ytdlp_gui_download_rate_bytes 最近一段时间的平均下载速度（字节/秒）",
+            "# TYPE ytdlp_gui_download_rate_bytes gauge",
+        ]
+        for window in self.WINDOWS:
+            lines.append(f'ytdlp_gui_download_rate_bytes{{window="{window}s"}} {self.rate(window):.1f}')
+
+        with self._lock:
+            active = {download_id: dict(job) for download_id, job in self.active.items()}
+            counters = sorted(self.counters.items())
+            histograms = [(name, list(h.counts), h.total, h.count) for name, h in self.latencies.items()]
+
+        lines += [
+            "# HELP ytdlp_gui_active_downloads 正在下载的任务数",
+            "# TYPE ytdlp_gui_active_downloads gauge",
+            f"ytdlp_gui_active_downloads {len(active)}",
+            "# HELP ytdlp_gui_job_speed_bytes 各任务当前速度（字节/秒）",
+            "# TYPE ytdlp_gui_job_speed_bytes gauge",
+        ]
+        for download_id, job in active.items():
+            lines.append(f'ytdlp_gui_job_speed_bytes{{id="{label(download_id)}",'
+                         f'extractor="{label(job["extractor"] or "unknown")}"}} {job["speed"] or 0:.1f}')
+
+        for name, help_text in self.COUNTER_HELP.items():
+            lines.append(f"# HELP ytdlp_gui_{name}_total {help_text}")
+            lines.append(f"# TYPE ytdlp_gui_{name}_total counter")
+            for (counter, extractor), value in counters:
+                if counter == name:
+                    lines.append(f'ytdlp_gui_{name}_total{{extractor="{label(extractor)}"}} {value}')
+
+        for name, counts, total, count in histograms:
+            metric = f"ytdlp_gui_{name}_seconds"
+            lines.append(f"# HELP {metric} {self.LATENCY_HELP[name]}（秒）")
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket in zip(LatencyHistogram.BUCKETS + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"{metric}_sum {total:.3f}")
+            lines.append(f"{metric}_count {count}")
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """按阶段记录耗时区间（解析、传输、后处理、进度回调、界面刷新），导出为 Chrome trace-event JSON 或 CSV
+
+    未启用时 span() 返回共享的空上下文、record() 直接返回，热路径上只多一次属性判断
+    """
+
+    CAPACITY = 200000  # 最多保留的区间数，超出后丢弃最早的
+
+    def __init__(self):
+        self.enabled = False
+        self._events = deque(maxlen=self.CAPACITY)  # (名称, 开始, 结束, 线程ID, 任务ID)
+        self._thread_names = {}
+        self._origin = time.perf_counter()
+
+    def start(self):
+        self._events.clear()
+        self._thread_names.clear()
+        self._origin = time.perf_counter()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+        return len(self._events)
+
+    def span(self, name, download_id=None):
+        """with tracer.span('阶段'): ... 记录代码块耗时"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, download_id)
+
+    def record(self, name, duration, download_id=None):
+        """记录刚结束、已知耗时（秒）的区间，用于跨回调计时的阶段"""
+        if self.enabled:
+            end = time.perf_counter()
+            self._add(name, end - duration, end, download_id)
+
+    def _add(self, name, start, end, download_id):
+        thread = threading.current_thread()
+        self._thread_names[thread.ident] = thread.name
+        self._events.append((name, start, end, thread.ident, download_id))
+
+    def export(self, path):
+        """按扩展名导出：.csv 为平铺表格，其余为 Chrome trace-event JSON（chrome://tracing、Perfetto 可打开）"""
+        events = sorted(self._events, key=lambda event: event[1])
+        if path.lower().endswith('.csv'):
+            import csv
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['name', 'category', 'start_ms', 'duration_ms', 'thread', 'download_id'])
+                for name, start, end, tid, download_id in events:
+                    writer.writerow([name, name.split('.', 1)[0], f"{(start - self._origin) * 1000:.3f}",
+                                     f"{(end - start) * 1000:.3f}", self._thread_names.get(tid, tid), download_id or ''])
+            return len(events)
+
+        pid = os.getpid()
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                 for tid, name in self._thread_names.items()]
+        for name, start, end, tid, download_id in events:
+            event = {'name': name, 'cat': name.split('.', 1)[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': round((start - self._origin) * 1e6, 1), 'dur': round((end - start) * 1e6, 1)}
+            if download_id is not None:
+                event['args'] = {'id': download_id}
+            trace.append(event)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+        return len(events)
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'download_id', 'start')
+
+    def __init__(self, tracer, name, download_id):
+        self.tracer = tracer
+        self.name = name
+        self.download_id = download_id
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer._add(self.name, self.start, time.perf_counter(), self.download_id)
+        return False
+
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class SamplingProfiler:
+    """采样分析：后台线程定时抓取所有线程的调用栈并计数，覆盖下载线程、reactor 线程和界面线程
+
+    cProfile 只能分析调用它的线程，这里用采样代替。支持线程 CPU 时钟的系统上只统计两次采样之间
+    占用了 CPU 的线程（跳过等待网络、锁和 sleep 的线程）。结果导出为折叠栈格式（flamegraph.pl、speedscope 可打开）
+    """
+
+    INTERVAL = 0.005  # 秒
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = {}  # 折叠栈 -> 次数
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        self.samples = 0
+        self._stacks = {}
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.samples
+
+    @staticmethod
+    def _thread_cpu_time(tid):
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(tid))
+        except (AttributeError, OSError):
+            return None
+
+    def _run(self):
+        own = threading.get_ident()
+        cpu_times = {}
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                cpu_time = self._thread_cpu_time(tid)
+                if cpu_time is not None:
+                    last, cpu_times[tid] = cpu_times.get(tid), cpu_time
+                    if cpu_time == last:
+                        continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(tid, str(tid)))
+                key = ';'.join(reversed(stack))
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def hotspots(self, count=5):
+        """按自身采样数排序的函数，返回 [(函数, 占比)]"""
+        leaves = {}
+        total = 0
+        for key, samples in self._stacks.items():
+            leaf = key.rsplit(';', 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + samples
+            total += samples
+        return [(leaf, samples / total) for leaf, samples in sorted(leaves.items(), key=lambda item: -item[1])[:count]]
+
+    def export(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for key, samples in sorted(self._stacks.items(), key=lambda item: -item[1]):
+                f.write(f"{key} {samples}\n")
+        return len(self._stacks)
 
 
 class DownloadSignal:
+    """工作线程到前端的事件通道：工作线程只负责入队，由前端主线程（Tk 界面或无界面模式）定时批量处理"""
+
     def __init__(self, gui):
         self.gui = gui
+        self.events = queue.SimpleQueue()
 
     def progress(self, download_id, percent, speed, eta=None):
-        self.gui.update_progress(download_id, percent, speed, eta)
+        self.events.put(('progress', download_id, (percent, speed, eta)))
 
     def finished(self, download_id, success, message):
-        self.gui.download_finished(download_id, success, message)
+        self.events.put(('finished', download_id, (success, message)))
 
     def log(self, download_id, message):
-        self.gui.add_log(download_id, message)
+        self.events.put(('log', download_id, (message, datetime.now())))
+
+    def interrupted(self, download_id):
+        """工作线程因用户暂停/停止而退出"""
+        self.call(self.gui.download_interrupted, download_id)
+
+    def postprocessing(self, download_id):
+        """下载阶段结束，进入后处理阶段（下载槽位可以让给下一个任务）"""
+        self.call(self.gui.download_postprocessing, download_id)
+
+    def call(self, func, *args):
+        """请求在主线程中调用 func(*args)"""
+        self.events.put(('call', None, (func, args)))
+
+    def drain(self, max_events=10000):
+        """取出当前积压的事件，进度事件按 download_id 合并只保留最新一条"""
+        progress = {}
+        logs = []
+        finished = []
+        calls = []
+        for _ in range(max_events):
+            try:
+                kind, download_id, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                progress[download_id] = payload
+            elif kind == 'log':
+                logs.append((download_id, payload[0], payload[1]))
+            elif kind == 'finished':
+                finished.append((download_id, payload))
+            elif kind == 'call':
+                calls.append(payload)
+        return progress, logs, finished, calls
+
+
+class LogRingBuffer:
+    """固定容量的日志环形缓冲区，超出容量时淘汰最旧的日志"""
+
+    def __init__(self, capacity=5000):
+        self.capacity = capacity
+        self.entries = deque(maxlen=capacity)  # (download_id, line)
+
+    def extend(self, entries):
+        """追加日志，返回本次被淘汰的条数"""
+        overflow = max(0, len(self.entries) + len(entries) - self.capacity)
+        self.entries.extend(entries)
+        return overflow
+
+    def view(self, download_id=None):
+        """返回按 download_id 过滤后的日志行（None 表示全部）"""
+        if download_id is None:
+            return self.entries
+        return [line for entry_id, line in self.entries if entry_id == download_id]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SegmentedDownload:
+    """分段下载：把一个文件按字节范围切成多段，用多个连接并行下载到同一文件的对应位置
+
+    open_range(start, end) 返回可 read() 的响应对象；进度通过
+    on_progress(downloaded, total, speed, eta) 汇总为一个整体进度，on_progress 抛出异常时
+    中止下载（暂停/停止），阻塞期间各连接暂停读取（限速）。各段的完成情况保存在
+    <文件>.segments 中，暂停后可以接着下载。cancel_token 已取消时出错的段不再重试
+    """
+
+    MIN_SEGMENT_SIZE = 1024 * 1024
+    CHUNK_SIZE = 64 * 1024
+    RETRIES = 3
+    PROGRESS_INTERVAL = 0.5  # 秒
+
+    def __init__(self, open_range, path, total, connections, on_progress, cancel_token=None):
+        self.open_range = open_range
+        self.path = path
+        self.state_path = path + ".segments"
+        self.total = total
+        self.connections = max(1, connections)
+        self.on_progress = on_progress
+        self.segments = []
+        self._stop = threading.Event()
+        self._flowing = threading.Event()
+        self._flowing.set()
+        self._errors = []
+        self.cancel_token = cancel_token
+
+    def split(self):
+        count = max(1, min(self.connections, self.total // self.MIN_SEGMENT_SIZE))
+        size = self.total // count
+        bounds = [i * size for i in range(count)] + [self.total]
+        return [{'start': bounds[i], 'end': bounds[i + 1] - 1, 'done': 0} for i in range(count)]
+
+    def load_state(self):
+        """读取上次未完成的分段状态（文件大小一致时才继续）"""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get('total') != self.total:
+            return None
+        return state['segments']
+
+    def save_state(self):
+        try:
+            with open(self.state_path, 'w', encoding='utf-8') as f:
+                json.dump({'total': self.total, 'segments': self.segments}, f)
+        except OSError:
+            pass
+
+    def run(self):
+        self.segments = self.load_state() or self.split()
+
+        # 预分配文件，各段直接写到自己的偏移位置
+        with open(self.path, 'r+b' if os.path.exists(self.path) else 'w+b') as f:
+            f.truncate(self.total)
+
+        threads = [threading.Thread(target=self._fetch_segment, args=(segment,), daemon=True)
+                   for segment in self.segments if segment['start'] + segment['done'] <= segment['end']]
+
+        # 先报告已有的进度（继续下载时），限速从这里开始计算
+        started = time.monotonic()
+        initial = sum(segment['done'] for segment in self.segments)
+        self.on_progress(initial, self.total, 0, None)
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(self.PROGRESS_INTERVAL / len(threads))
+                if self._errors:
+                    raise self._errors[0]
+
+                downloaded = sum(segment['done'] for segment in self.segments)
+                elapsed = time.monotonic() - started
+                speed = (downloaded - initial) / elapsed if elapsed > 0 else 0
+                eta = (self.total - downloaded) / speed if speed > 0 else None
+                self._flowing.clear()
+                try:
+                    self.on_progress(downloaded, self.total, speed, eta)
+                finally:
+                    self._flowing.set()
+                self.save_state()
+
+            if self._errors:
+                raise self._errors[0]
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self.save_state()
+
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+
+    def _fetch_segment(self, segment):
+        attempts = 0
+        while not self._stop.is_set():
+            position = segment['start'] + segment['done']
+            if position > segment['end']:
+                return
+            try:
+                response = self.open_range(position, segment['end'])
+                with open(self.path, 'r+b') as f:
+                    f.seek(position)
+                    while not self._stop.is_set():
+                        remaining = segment['end'] + 1 - (segment['start'] + segment['done'])
+                        if remaining <= 0:
+                            break
+                        self._flowing.wait()
+                        data = response.read(min(self.CHUNK_SIZE, remaining))
+                        if not data:
+                            break
+                        f.write(data)
+                        segment['done'] += len(data)
+                        attempts = 0
+                response.close()
+            except Exception as e:
+                attempts += 1
+                if attempts > self.RETRIES or (self.cancel_token is not None and self.cancel_token.cancelled):
+                    self._errors.append(e)
+                    return
+                time.sleep(attempts)
+
+
+def make_segmented_ydl_class(connections):
+    """创建在 http/https 直链格式上使用分段下载的 YoutubeDL 子类"""
+    import yt_dlp
+    from yt_dlp.downloader.common import FileDownloader
+    from yt_dlp.downloader.http import HttpFD
+    from yt_dlp.networking import Request
+
+    class SegmentedFD(FileDownloader):
+        FD_NAME = 'segmented'
+
+        def real_download(self, filename, info_dict):
+            url = info_dict['url']
+            headers = info_dict.get('http_headers') or {}
+
+            def open_range(start, end):
+                return self.ydl.urlopen(Request(url, headers={**headers, 'Range': f'bytes={start}-{end}'}))
+
+            # 探测服务器是否支持 Range 请求以及文件大小
+            total = None
+            try:
+                probe = open_range(0, 0)
+                content_range = probe.headers.get('Content-Range') or ''
+                if probe.status == 206 and '/' in content_range:
+                    total = int(content_range.rsplit('/', 1)[1])
+                probe.close()
+            except Exception:
+                total = None
+
+            if not total or total < 2 * SegmentedDownload.MIN_SEGMENT_SIZE:
+                # 不支持分段，使用 yt-dlp 默认的单连接下载
+                fd = HttpFD(self.ydl, self.params)
+                for hook in self._progress_hooks:
+                    fd.add_progress_hook(hook)
+                return fd.real_download(filename, info_dict)
+
+            tmpfilename = self.temp_name(filename)
+            self.report_destination(filename)
+            started = time.time()
+
+            def on_progress(downloaded, total_bytes, speed, eta):
+                self._hook_progress({
+                    'status': 'downloading',
+                    'downloaded_bytes': downloaded,
+                    'total_bytes': total_bytes,
+                    'speed': speed,
+                    'eta': eta,
+                    'elapsed': time.time() - started,
+                    'filename': filename,
+                    'tmpfilename': tmpfilename,
+                }, info_dict)
+
+            # 各段的连接经 ydl.urlopen 打开，同样登记到下载任务的取消句柄
+            SegmentedDownload(open_range, tmpfilename, total, connections, on_progress,
+                              getattr(self.ydl, 'cancel_token', None)).run()
+
+            self.try_rename(tmpfilename, filename)
+            self._hook_progress({
+                'status': 'finished',
+                'downloaded_bytes': total,
+                'total_bytes': total,
+                'elapsed': time.time() - started,
+                'filename': filename,
+            }, info_dict)
+            return True
+
+    class SegmentedYoutubeDL(yt_dlp.YoutubeDL):
+        def dl(self, name, info, subtitle=False, test=False):
+            if subtitle or test or name == '-' or info.get('protocol') not in ('http', 'https'):
+                return super().dl(name, info, subtitle, test)
+
+            fd = SegmentedFD(self, self.params)
+            for hook in self._progress_hooks:
+                fd.add_progress_hook(hook)
+            new_info = dict(info)
+            new_info.setdefault('http_headers', info.get('http_headers') or {})
+            return fd.download(name, new_info, subtitle)
+
+    return SegmentedYoutubeDL
+
+
+def make_tracked_urllib_rh_class(engine):
+    """创建 yt-dlp 的 urllib 请求处理器子类：建立的连接登记到 engine 当前租用任务的 CancelToken"""
+    import urllib.request
+    from yt_dlp.networking._urllib import HTTPHandler, UrllibRH
+
+    class TrackedHTTPHandler(HTTPHandler):
+        def _make_conn_class(self, base, req):
+            conn_class = super()._make_conn_class(base, req)
+
+            class TrackedConnection(conn_class):
+                def connect(self):
+                    token = engine.cancel_token
+                    if token is not None:
+                        token.check()
+                    super().connect()
+                    if token is not None:
+                        # https 连接在这里已经是包装后的 SSL 套接字
+                        token.add_socket(self.sock)
+
+            return TrackedConnection
+
+    class TrackedUrllibRH(UrllibRH):
+        RH_KEY = 'Urllib'  # 取代默认的 urllib 处理器
+
+        def _create_instance(self, proxies, cookiejar, legacy_ssl_support=None):
+            # 与 UrllibRH 相同的处理器链，只把 HTTPHandler 换成登记连接的子类
+            tracked = TrackedHTTPHandler(
+                debuglevel=int(bool(self.verbose)),
+                context=self._make_sslcontext(legacy_ssl_support=legacy_ssl_support),
+                source_address=self.source_address)
+            opener = urllib.request.OpenerDirector()
+            for handler in super()._create_instance(proxies, cookiejar, legacy_ssl_support).handlers:
+                opener.add_handler(tracked if isinstance(handler, HTTPHandler) else handler)
+            opener.addheaders = []
+            return opener
+
+    return TrackedUrllibRH
+
+
+def make_pooled_ydl_class(base):
+    """创建引擎池使用的 YoutubeDL 子类：有后处理时交给租用线程的后处理阶段，下载存档随之推迟；
+    网络连接登记到租用任务的 CancelToken"""
+
+    class PooledYoutubeDL(base):
+        def __init__(self, params, pool_engine):
+            self.pool_engine = pool_engine
+            super().__init__(params)
+
+        @property
+        def cancel_token(self):
+            return self.pool_engine.cancel_token
+
+        def build_request_director(self, handlers, preferences=None):
+            # requests 等其他处理器的连接无法登记，http(s) 请求优先交给 urllib（同 prefer-legacy-http-handler）
+            tracked = make_tracked_urllib_rh_class(self.pool_engine)
+            handlers = [tracked if handler.RH_KEY == 'Urllib' else handler for handler in handlers]
+            director = super().build_request_director(handlers, preferences)
+            director.preferences.add(lambda handler, request: 500 if isinstance(handler, tracked) else 0)
+            return director
+
+        def post_process(self, filename, info, files_to_move=None):
+            engine = self.pool_engine
+            if engine.postprocess_hook is None or not (info.get('__postprocessors') or self.params.get('postprocessors')):
+                return super().post_process(filename, info, files_to_move)
+            # info 在返回后会被 yt-dlp 修改，保存一份浅拷贝；后处理器由后处理阶段按选项重新创建
+            engine.postprocess_hook(filename, dict(info), dict(files_to_move or {}))
+            engine.deferred = True
+            info['filepath'] = filename
+            return info
+
+        def record_download_archive(self, info_dict):
+            # 后处理推迟时 yt-dlp 会在后处理之前写入存档，改由后处理阶段成功后写入
+            if not self.pool_engine.deferred:
+                super().record_download_archive(info_dict)
+
+    return PooledYoutubeDL
+
+
+class YoutubeDLPool:
+    """长期复用的 YoutubeDL 实例池，按选项配置分组，租借给下载线程独占使用
+
+    复用的实例保留已初始化的提取器（包括 YouTube 播放器 JS 和签名函数缓存）、
+    Cookie 和 HTTP 连接，批量下载短视频时省去每个任务重新初始化的开销
+    """
+
+    MAX_IDLE_PER_PROFILE = 4
+    # 决定实例配置的选项，值都是可以比较的普通数据；回调、logger 等对象由引擎池自己设置
+    PROFILE_OPTIONS = ('outtmpl', 'noplaylist', 'continuedl', 'quiet', 'no_warnings', 'noprogress', 'skip_download',
+                       'format', 'postprocessors', 'download_archive', 'concurrent_fragment_downloads',
+                       'external_downloader_args', 'ffmpeg_location')
+
+    def __init__(self):
+        self._idle = {}  # 配置键 -> [engine]
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    @classmethod
+    def profile_key(cls, ydl_opts, connections):
+        """按 PROFILE_OPTIONS 生成配置键；其他选项无法判断两个实例是否等价，直接拒绝"""
+        unknown = set(ydl_opts) - set(cls.PROFILE_OPTIONS)
+        if unknown:
+            raise ValueError(f"引擎池不支持的 yt-dlp 选项: {', '.join(sorted(unknown))}")
+        return json.dumps([ydl_opts, connections], sort_keys=True)
+
+    class DispatchLogger:
+        """yt-dlp 的 logger：警告和错误转发给当前租用实例的下载线程，其余输出丢弃"""
+
+        def __init__(self, engine):
+            self.engine = engine
+
+        def debug(self, message):
+            pass
+
+        def info(self, message):
+            pass
+
+        def warning(self, message):
+            if self.engine.log_hook is not None:
+                self.engine.log_hook('warning', message)
+
+        def error(self, message):
+            if self.engine.log_hook is not None:
+                self.engine.log_hook('error', message)
+
+    def _create(self, ydl_opts, connections):
+        import yt_dlp
+
+        base = make_segmented_ydl_class(connections) if connections > 1 else yt_dlp.YoutubeDL
+        engine = types.SimpleNamespace(progress_hook=None, postprocessor_hook=None, log_hook=None,
+                                       postprocess_hook=None, deferred=False, cancel_token=None)
+
+        def dispatch_progress(d):
+            # 进度事件转发给当前租用该实例的下载线程
+            if engine.progress_hook is not None:
+                engine.progress_hook(d)
+
+        def dispatch_postprocessor(d):
+            if engine.postprocessor_hook is not None:
+                engine.postprocessor_hook(d)
+
+        opts = dict(ydl_opts, progress_hooks=[dispatch_progress], postprocessor_hooks=[dispatch_postprocessor],
+                    logger=self.DispatchLogger(engine))
+        engine.ydl = make_pooled_ydl_class(base)(opts, engine)
+        return engine
+
+    @contextlib.contextmanager
+    def lease(self, ydl_opts, progress_hook, connections=1, postprocessor_hook=None, log_hook=None,
+              postprocess_hook=None, cancel_token=None):
+        """租用一个与 ydl_opts 配置一致的实例，用完归还；出错的实例直接关闭不再复用
+
+        给出 postprocess_hook 时后处理不在下载中执行，而是以 (filename, info, files_to_move) 交给它，
+        下载存档也不再写入，由后处理成功后补写。给出 cancel_token 时租用期间实例建立的网络连接登记到它
+        """
+        key = self.profile_key(ydl_opts, connections)
+        with self._lock:
+            idle = self._idle.get(key)
+            engine = idle.pop() if idle else None
+            if engine is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        reused = engine is not None
+        if engine is None:
+            engine = self._create(ydl_opts, connections)
+
+        engine.progress_hook = progress_hook
+        engine.postprocessor_hook = postprocessor_hook
+        engine.log_hook = log_hook
+        engine.postprocess_hook = postprocess_hook
+        engine.cancel_token = cancel_token
+        engine.deferred = False
+        healthy = False
+        try:
+            yield engine.ydl, reused
+            healthy = True
+        finally:
+            engine.progress_hook = engine.postprocessor_hook = engine.log_hook = engine.postprocess_hook = None
+            engine.cancel_token = None
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if healthy and len(idle) < self.MAX_IDLE_PER_PROFILE:
+                    idle.append(engine)
+                    engine = None
+            if engine is not None:
+                engine.ydl.close()
+
+    def close(self):
+        with self._lock:
+            engines = [engine for idle in self._idle.values() for engine in idle]
+            self._idle.clear()
+        for engine in engines:
+            engine.ydl.close()
+
+
+class PostprocessStage:
+    """后处理阶段：FFmpeg 合并、转码等与下载分开，同时进行的数量单独限制（默认 CPU 核数）
+
+    下载线程下载完成后先让出下载槽位，再在这里排队等待后处理槽位，网络下载和
+    CPU 密集的转码互不占用对方的并发数。FFmpeg 在子进程中运行，线程只负责等待
+    """
+
+    def __init__(self, max_workers=0):
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def set_max_workers(self, max_workers):
+        with self._cond:
+            self.max_workers = max(1, max_workers)
+            self._cond.notify_all()
+
+    def run(self, func, is_running):
+        """等到有空闲槽位后调用 func()；等待期间任务被停止则不执行，返回 False"""
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.active >= self.max_workers and is_running():
+                    self._cond.wait(0.5)
+                if not is_running():
+                    return False
+                self.active += 1
+            finally:
+                self.waiting -= 1
+        try:
+            func()
+            return True
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify()
+
+
+class DownloadCancelled(OSError):
+    """任务已取消后，该任务再发起网络连接"""
+
+
+class CancelToken:
+    """下载任务的取消句柄：cancel() 时关闭任务登记的网络连接，之后再连接直接失败
+
+    内置 yt-dlp 模块在等待网络数据或解析网页时不会回调进度，只设停止标志要等到下一次回调才能停下。
+    句柄在租用引擎池实例时显式交给实例（YoutubeDLPool.lease），实例的 urllib 请求处理器把建立的
+    连接登记到这里（分段下载和分片并发下载的连接同样经过它）。取消时关闭连接，阻塞的读取立即出错。
+    yt-dlp 启动的 FFmpeg 不在这里结束，停止时等当前这一步完成；外部 yt-dlp 由 ProcessReactor 连同
+    进程组一起结束
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._sockets = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def check(self):
+        if self.cancelled:
+            raise DownloadCancelled("下载已取消")
+
+    def add_socket(self, sock):
+        with self._lock:
+            self._sockets.add(sock)
+        if self.cancelled:
+            # 连接建立过程中被取消
+            self._shutdown(sock)
+
+    @staticmethod
+    def _shutdown(sock):
+        # 只关闭读写两端，套接字由持有它的响应对象自己关闭
+        with contextlib.suppress(OSError):
+            sock.shutdown(socket.SHUT_RDWR)
+
+    def cancel(self):
+        """关闭登记的连接，阻塞在读取上的线程立即出错，可在任意线程调用"""
+        self.cancelled = True
+        with self._lock:
+            sockets = list(self._sockets)
+        for sock in sockets:
+            self._shutdown(sock)
+
+
+class ProcessReactor:
+    """在一个事件循环线程中管理全部外部 yt-dlp 进程
+
+    loop.subprocess_exec 按块交付输出，在协议中增量切分成行，解析和进程退出都在同一个线程中回调，
+    不再为每个进程占用一个阻塞读取的线程。on_line(line) 和
+    on_exit(returncode, error) 都在事件循环线程中调用，不能阻塞。进程在独立的进程组中启动，
+    结束时连同它启动的 FFmpeg 等子进程一起结束。子进程退出由 asyncio 默认的方式等待
+    （3.12 起 Linux 上为 pidfd），这里不修改全局的 child watcher
+    """
+
+    KILL_GRACE = 2.0  # 秒，先发 SIGTERM，到时进程组仍在则 SIGKILL
+
+    def __init__(self):
+        self.loop = None
+        self.active = 0  # 运行中的进程数（只在事件循环线程中修改）
+        self.encoding = locale.getpreferredencoding(False)
+        self._lock = threading.Lock()
+
+    def _get_loop(self):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name="process-reactor", daemon=True).start()
+            return self.loop
+
+    def spawn(self, cmd, on_line, on_exit):
+        """启动进程，返回用于 terminate() 的句柄；cmd[0] 应已解析为可执行文件路径，事件循环线程中不查找"""
+        handle = types.SimpleNamespace(process=None, terminated=False)
+        asyncio.run_coroutine_threadsafe(self._run(cmd, handle, on_line, on_exit), self._get_loop())
+        return handle
+
+    def terminate(self, handle):
+        """结束进程及其子进程（可在任意线程调用，进程还没启动时启动后立即结束）"""
+        def terminate():
+            if not handle.terminated:
+                handle.terminated = True
+                if handle.process is not None:
+                    self._terminate_group(handle.process)
+
+        self._get_loop().call_soon_threadsafe(terminate)
+
+    def _terminate_group(self, process):
+        """在事件循环线程中调用：先礼貌结束整个进程组，KILL_GRACE 秒后强制结束剩下的"""
+        self._kill_group(process, force=False)
+        asyncio.get_running_loop().call_later(self.KILL_GRACE, self._kill_group, process, True)
+
+    @staticmethod
+    def _kill_group(process, force):
+        """process 为 loop.subprocess_exec 返回的 transport"""
+        if sys.platform == "win32":
+            # 没有进程组信号，用 taskkill /T 结束整个进程树（父进程退出后就找不到子进程，所以直接强制）
+            if not force and process.get_returncode() is None:
+                with contextlib.suppress(OSError, subprocess.SubprocessError):
+                    run_hidden_process(['taskkill', '/F', '/T', '/PID', str(process.get_pid())])
+            return
+        import signal
+        # 进程以新会话启动，进程组ID即其PID；yt-dlp 已退出时仍能结束留下的 FFmpeg
+        with contextlib.suppress(ProcessLookupError, PermissionError):
+            os.killpg(process.get_pid(), signal.SIGKILL if force else signal.SIGTERM)
+
+    class LineProtocol(asyncio.SubprocessProtocol):
+        """把 stdout 按块增量切分成行交给 on_line，输出管道和进程都结束后 done 完成"""
+
+        def __init__(self, reactor, on_line):
+            self.reactor = reactor
+            self.on_line = on_line
+            self.pending = b''
+            self.error = None
+            self.transport = None
+            self.done = asyncio.get_running_loop().create_future()
+
+        def connection_made(self, transport):
+            self.transport = transport
+
+        def pipe_data_received(self, fd, data):
+            if self.error is not None:
+                return
+            # 完整的行整块解码再切分，不完整的最后一行留到下一块
+            data = self.pending + data
+            end = max(data.rfind(b'\n'), data.rfind(b'\r')) + 1
+            self.pending = data[end:]
+            try:
+                for line in data[:end].decode(self.reactor.encoding, 'replace').splitlines():
+                    if line:
+                        self.on_line(line)
+            except Exception as e:
+                # 回调出错时结束进程，按失败报告
+                self.error = e
+                self.reactor._kill_group(self.transport, force=True)
+
+        def connection_lost(self, exc):
+            if self.pending and self.error is None:
+                try:
+                    self.on_line(self.pending.decode(self.reactor.encoding, 'replace'))
+                except Exception as e:
+                    self.error = e
+            if not self.done.done():
+                self.done.set_result(None)
+
+    async def _run(self, cmd, handle, on_line, on_exit):
+        if sys.platform == "win32":
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            startupinfo.wShowWindow = 0  # SW_HIDE
+            kwargs = {'startupinfo': startupinfo,
+                      'creationflags': subprocess.CREATE_NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            kwargs = {'start_new_session': True}
+
+        loop = asyncio.get_running_loop()
+        try:
+            process, protocol = await loop.subprocess_exec(
+                lambda: self.LineProtocol(self, on_line), *cmd,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs)
+        except OSError as e:
+            on_exit(None, e)
+            return
+
+        handle.process = process
+        if handle.terminated:
+            self._terminate_group(process)
+        self.active += 1
+        try:
+            await protocol.done
+        finally:
+            self.active -= 1
+            process.close()
+        on_exit(process.get_returncode(), protocol.error)
+
+    def close(self):
+        with self._lock:
+            loop, self.loop = self.loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+
+
+# 下载进程发回主进程的进度字段（只保留用到的，减少序列化开销）
+PROCESS_PROGRESS_FIELDS = ('status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'speed', 'eta',
+                           'filename', '_percent_str', '_speed_str', '_eta_str')
+PROCESS_PROGRESS_INTERVAL = 0.1  # 秒，下载中的进度事件最多每隔这么久发送一次
+
+PROCESS_CANCEL_POLL = 0.05  # 秒，下载进程检查停止标志的间隔
+
+# 下载进程中的全局状态（由 init_download_process 设置）
+_process_events = None
+_process_cancel_flags = None
+_process_rates = None
+_process_engine_pool = None
+_process_current = None  # 正在执行的 (slot, CancelToken)
+
+
+def init_download_process(events, cancel_flags, rates):
+    """下载进程池子进程的初始化"""
+    global _process_events, _process_cancel_flags, _process_rates, _process_engine_pool
+    _process_events = events
+    _process_cancel_flags = cancel_flags
+    _process_rates = rates
+    # 子进程内同样复用 YoutubeDL 实例
+    _process_engine_pool = YoutubeDLPool()
+    threading.Thread(target=watch_process_cancel, name="cancel-watcher", daemon=True).start()
+
+
+def watch_process_cancel():
+    """下载进程中轮询停止标志：任务阻塞在网络读取中、没有回调时也能及时中断"""
+    while True:
+        time.sleep(PROCESS_CANCEL_POLL)
+        current = _process_current
+        if current is not None and _process_cancel_flags[current[0]] and not current[1].cancelled:
+            current[1].cancel()
+
+
+def run_download_process(slot, job, url, ydl_opts, connections, info):
+    """在下载进程中执行内置 yt-dlp 下载，进度、后处理和日志事件通过队列发回主进程"""
+    global _process_current
+    token = CancelToken()
+    _process_current = (slot, token)
+    try:
+        return _run_download_process(slot, job, url, ydl_opts, connections, info, token)
+    finally:
+        _process_current = None
+
+
+def _run_download_process(slot, job, url, ydl_opts, connections, info, token):
+    last_progress = [0.0]
+    info_stale = False
+
+    def send(kind, payload):
+        _process_events.put((job, kind, payload))
+
+    def check_cancelled():
+        if _process_cancel_flags[slot]:
+            raise Exception("下载被用户停止")
+
+    leased = []
+
+    def apply_rate():
+        # 主进程按分到的带宽更新共享内存中的限速；yt-dlp 每读一块数据都会重新读取 params['ratelimit']
+        rate = _process_rates[slot] or None
+        if leased and leased[0].params.get('ratelimit') != rate:
+            leased[0].params['ratelimit'] = rate
+
+    def progress_hook(d):
+        check_cancelled()
+        apply_rate()
+        now = time.monotonic()
+        if d['status'] == 'downloading' and now - last_progress[0] < PROCESS_PROGRESS_INTERVAL:
+            return
+        last_progress[0] = now
+        event = {key: d.get(key) for key in PROCESS_PROGRESS_FIELDS}
+        event['info_dict'] = {'extractor_key': (d.get('info_dict') or {}).get('extractor_key')}
+        send('progress', event)
+
+    def postprocessor_hook(d):
+        check_cancelled()
+        send('postprocessor', {'status': d['status'], 'postprocessor': d.get('postprocessor')})
+
+    def log_hook(level, message):
+        send('log', (level, message))
+
+    try:
+        with _process_engine_pool.lease(ydl_opts, progress_hook, connections, postprocessor_hook, log_hook,
+                                        cancel_token=token) as (ydl, reused):
+            # 限速不属于实例配置，租用期间设置，归还前清除
+            leased.append(ydl)
+            apply_rate()
+            try:
+                if info is None:
+                    ydl.download([url])
+                else:
+                    try:
+                        ydl.process_ie_result(info, download=True)
+                    except Exception as e:
+                        if _process_cancel_flags[slot]:
+                            raise
+                        info_stale = True
+                        send('message', f"已解析的视频信息下载失败，重新解析: {e}")
+                        ydl.download([url])
+            finally:
+                ydl.params.pop('ratelimit', None)
+    except Exception as e:
+        # yt-dlp 的异常不一定能序列化，只把消息传回主进程
+        raise RuntimeError(str(e)) from None
+    return {'info_stale': info_stale}
+
+
+class DownloadProcessPool:
+    """内置 yt-dlp 的多进程下载
+
+    解析网页、签名 JS、格式排序等 CPU 密集的 Python 代码在子进程中运行，不再与界面线程和
+    其他下载争用 GIL。子进程以 spawn 方式启动，所有任务的事件经同一个队列发回，由转发线程
+    交给对应的下载线程；停止标志和限速放在共享内存中，子进程在进度/后处理回调中检查
+    """
+
+    SLOTS = 256  # 同时提交的任务数上限（停止标志的个数）
+
+    def __init__(self, max_workers=0):
+        import multiprocessing
+
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self._context = multiprocessing.get_context('spawn')
+        self._events = self._context.Queue()
+        self._cancel_flags = self._context.Array('b', self.SLOTS, lock=False)
+        self._rates = self._context.Array('q', self.SLOTS, lock=False)  # 字节/秒，0 表示不限速
+        self._executor = self._create_executor()
+        self._handlers = {}  # job -> on_event
+        self._slots = {}  # slot -> 正在使用该位置的 job
+        self._free = list(range(self.SLOTS))
+        self._jobs = itertools.count()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._relay_events, name="download-process-events", daemon=True).start()
+
+    def _create_executor(self):
+        from concurrent.futures import ProcessPoolExecutor
+
+        return ProcessPoolExecutor(self.max_workers, mp_context=self._context, initializer=init_download_process,
+                                   initargs=(self._events, self._cancel_flags, self._rates))
+
+    def submit(self, url, ydl_opts, connections, info, on_event, rate=0):
+        """提交下载，返回 (句柄, future)；结束后调用 release(句柄)。rate 为初始限速，之后用 set_rate() 调整
+
+        提交失败时位置和回调立即归还，异常交给调用方
+        """
+        with self._lock:
+            if not self._free:
+                raise RuntimeError("下载进程池的任务数已满")
+            slot = self._free.pop()
+            job = next(self._jobs)
+            self._handlers[job] = on_event
+            self._slots[slot] = job
+        handle = (slot, job)
+        self._cancel_flags[slot] = 0
+        self._rates[slot] = rate
+        try:
+            future = self._submit(run_download_process, slot, job, url, ydl_opts, connections, info)
+        except BaseException:
+            self.release(handle)
+            raise
+        return handle, future
+
+    def _submit(self, *args):
+        from concurrent.futures.process import BrokenProcessPool
+
+        with self._lock:
+            executor = self._executor
+        try:
+            return executor.submit(*args)
+        except BrokenProcessPool:
+            # 子进程异常退出后进程池不能再用，换一个新的；几个线程同时发现时只换一次
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = self._create_executor()
+                else:
+                    executor = None
+                replacement = self._executor
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+            return replacement.submit(*args)
+
+    def cancel(self, handle):
+        slot, job = handle
+        with self._lock:
+            if self._slots.get(slot) == job:
+                self._cancel_flags[slot] = 1
+
+    def set_rate(self, handle, rate):
+        """调整运行中任务的限速，子进程在下一次进度回调时生效"""
+        slot, job = handle
+        with self._lock:
+            if self._slots.get(slot) == job:
+                self._rates[slot] = rate
+
+    def release(self, handle):
+        slot, job = handle
+        with self._lock:
+            # 回调按任务编号登记，之后才到的旧事件不会转给复用同一位置的新任务
+            self._handlers.pop(job, None)
+            if self._slots.pop(slot, None) == job:
+                self._free.append(slot)
+
+    def _relay_events(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            job, kind, payload = event
+            with self._lock:
+                handler = self._handlers.get(job)
+            if handler is not None:
+                handler(kind, payload)
+
+    def close(self):
+        with self._lock:
+            executor = self._executor
+        executor.shutdown(wait=False, cancel_futures=True)
+        self._events.put(None)
+
+
+# 停止（不是暂停）任务时 .part/.ytdl/分片等临时文件的处理方式
+CANCEL_CLEANUP_POLICIES = {'keep': "保留", 'delete': "删除", 'park': "移到 .cancelled"}
+CANCELLED_DIR = ".cancelled"
+# yt-dlp 合并前单独下载的各格式文件，如 name.f137.mp4、name.fhls-1080p.mp4
+FORMAT_FILE_RE = re.compile(r'\.f(?:\d|hls-|dash-|http-)[\w.=-]*\.\w+$')
+
+
+def find_temp_files(filename):
+    """下载 filename 时留下的临时文件：.part、.ytdl、分片、分段下载状态和等待合并的单独格式文件"""
+    pattern = glob.escape(filename)
+    paths = glob.glob(pattern + '.part*') + glob.glob(pattern + '.ytdl') + glob.glob(pattern + '-Frag*')
+    if FORMAT_FILE_RE.search(filename) and os.path.isfile(filename):
+        paths.append(filename)
+    return paths
 
 
 class DownloadWorker(threading.Thread):
-    def __init__(self, url, download_dir, quality, signal, download_id, ytdlp_path, ffmpeg_path):
+    def __init__(self, url, download_dir, quality, signal, download_id, ytdlp_path, ffmpeg_path,
+                 archive_path=None, connections=1, engine_pool=None, info=None, limiter=None, metrics=None,
+                 postprocess_stage=None, reactor=None, process_pool=None, tracer=None):
         super().__init__()
         self.url = url
         self.download_dir = download_dir
@@ -34,130 +1734,119 @@ class DownloadWorker(threading.Thread):
         self.download_id = download_id
         self.ytdlp_path = ytdlp_path
         self.ffmpeg_path = ffmpeg_path
+        self.archive_path = archive_path
+        self.connections = connections
+        self.engine_pool = engine_pool
+        self.info = info  # 解析阶段得到的视频信息，有则跳过重新解析
+        self.info_path = None
+        self.info_stale = False  # 缓存的视频信息已失效（如媒体地址过期）
+        self.limiter = limiter
+        self.metrics = metrics
+        self.postprocess_stage = postprocess_stage
+        self.reactor = reactor or ProcessReactor()
+        self.process = None  # 外部 yt-dlp 进程（reactor 句柄）
+        self.aria2c_found = False
+        self.process_pool = process_pool
+        self.process_job = None  # 在下载进程池中运行时的任务句柄
+        self.tracer = tracer or Tracer()
+        self.cancel_token = CancelToken()  # 停止时中断内置模块阻塞的网络连接
+        self.cleanup_policy = 'keep'  # 停止后临时文件的处理方式，见 CANCEL_CLEANUP_POLICIES
+        self.output_files = set()  # 下载过程中出现的目标文件名，用于停止后清理临时文件
+        self._transfer_started = None  # 当前文件开始传输的时间（perf_counter）
+        self._extract_traced = False
+        self.done = threading.Event()  # 已报告结果；外部进程下载时线程先于进程结束
+        self.extractor = info.get('extractor_key') if info else None
+        self._counted_bytes = None
+        self._counted_lock = threading.Lock()
+        self._postprocess_started = {}
+        self._postprocessing = False
+        self.started_at = None
+        self.ttfb = None
         self._is_running = True
-
-    def create_subprocess(self, cmd):
-        """创建隐藏窗口的子进程"""
-        startupinfo = None
-        creationflags = 0
-
-        if sys.platform == "win32":
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = 0  # SW_HIDE
-            creationflags = subprocess.CREATE_NO_WINDOW
-
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True,
-            startupinfo=startupinfo,
-            creationflags=creationflags
-        )
-        return process
+        self._paused = False
 
     def parse_ytdlp_progress(self, line):
         """解析 yt-dlp 命令行输出的进度信息"""
-        try:
-            percent = 0
-            speed = 0
-            eta = None
-
-            # 匹配进度百分比：例如 [download]  65.3% of ... 或 65.3%
-            percent_match = re.search(r'(\d+\.\d+|\d+)%', line)
-            if percent_match:
-                percent = float(percent_match.group(1))
-
-            # 匹配下载速度：支持多种格式
-            # 2.50MiB/s, 1.2MB/s, 500KiB/s, 123.4kB/s
-            speed_match = re.search(r'(\d+\.\d+|\d+)\s*([KM]?i?B)/s', line, re.IGNORECASE)
-            if speed_match:
-                speed_value = float(speed_match.group(1))
-                speed_unit = speed_match.group(2).upper()
-
-                # 转换为字节/秒
-                if speed_unit == 'B/S':
-                    speed = speed_value
-                elif speed_unit == 'KB/S' or speed_unit == 'KIB/S':
-                    speed = speed_value * 1024
-                elif speed_unit == 'MB/S' or speed_unit == 'MIB/S':
-                    speed = speed_value * 1024 * 1024
-                elif speed_unit == 'GB/S' or speed_unit == 'GIB/S':
-                    speed = speed_value * 1024 * 1024 * 1024
-
-            # 更精确的速度匹配（处理没有空格的情况）
-            if speed == 0:
-                speed_match2 = re.search(r'(\d+\.\d+|\d+)([KM]?i?B/s)', line, re.IGNORECASE)
-                if speed_match2:
-                    speed_value = float(speed_match2.group(1))
-                    speed_unit = speed_match2.group(2).upper()
-
-                    # 转换为字节/秒
-                    if speed_unit == 'B/S':
-                        speed = speed_value
-                    elif speed_unit == 'KB/S' or speed_unit == 'KIB/S':
-                        speed = speed_value * 1024
-                    elif speed_unit == 'MB/S' or speed_unit == 'MIB/S':
-                        speed = speed_value * 1024 * 1024
-                    elif speed_unit == 'GB/S' or speed_unit == 'GIB/S':
-                        speed = speed_value * 1024 * 1024 * 1024
-
-            # 匹配ETA：例如 ETA 00:12 或 in 00:12 或 00:12
-            eta_match = re.search(r'(ETA|in)\s+(\d+:\d+(:\d+)?)', line)
-            if eta_match:
-                eta = eta_match.group(2)
-            else:
-                # 尝试匹配简单的 00:12 格式
-                eta_match_simple = re.search(r'(?<!\d)(\d+:\d+(:\d+)?)(?!\d)', line)
-                if eta_match_simple and 'download' in line.lower():
-                    eta = eta_match_simple.group(1)
-
-            # 匹配文件大小和已下载大小：例如 45.7MiB/100.0MiB
-            size_match = re.search(r'(\d+\.\d+|\d+)([KM]?i?B)\s*/\s*(\d+\.\d+|\d+)([KM]?i?B)', line, re.IGNORECASE)
-            if size_match and percent == 0:
-                # 如果百分比为0但能解析到大小，计算百分比
-                downloaded = float(size_match.group(1))
-                total = float(size_match.group(3))
-                downloaded_unit = size_match.group(2).upper()
-                total_unit = size_match.group(4).upper()
-
-                # 转换为字节
-                def convert_to_bytes(value, unit):
-                    unit = unit.upper()
-                    if unit == 'B':
-                        return value
-                    elif unit == 'KB' or unit == 'KIB':
-                        return value * 1024
-                    elif unit == 'MB' or unit == 'MIB':
-                        return value * 1024 * 1024
-                    elif unit == 'GB' or unit == 'GIB':
-                        return value * 1024 * 1024 * 1024
-                    else:
-                        return value
-
-                downloaded_bytes = convert_to_bytes(downloaded, downloaded_unit)
-                total_bytes = convert_to_bytes(total, total_unit)
-
-                if total_bytes > 0:
-                    percent = (downloaded_bytes / total_bytes) * 100
-
-            return percent, speed, eta
-
-        except Exception as e:
-            # 如果解析出错，返回默认值
-            return 0, 0, None
+        percent, downloaded, total, speed, eta = parse_progress_line(line)
+        return percent, speed, eta
+
+    def report_first_byte(self, downloaded):
+        """记录首字节耗时（从线程开始到收到第一批数据）"""
+        if self.ttfb is None and downloaded:
+            self.ttfb = time.monotonic() - self.started_at
+            self.signal.log(self.download_id, f"首字节耗时: {self.ttfb:.2f} 秒")
+            if self.metrics is not None:
+                self.metrics.observe('ttfb', self.ttfb)
+
+    def set_extractor(self, extractor):
+        if extractor and self.extractor is None:
+            self.extractor = extractor
+            if self.metrics is not None:
+                self.metrics.set_extractor(self.download_id, extractor)
+
+    def account_progress(self, downloaded, speed=None, wait=True):
+        """按已下载字节数的增量记录流量指标，并向限速器申请带宽（超出限速时在这里阻塞下载）"""
+        if downloaded is None:
+            return
+        with self._counted_lock:
+            last, self._counted_bytes = self._counted_bytes, downloaded
+        # 第一次回调（可能是从 .part 继续）或开始下载下一个文件时只记录起点
+        if last is None or downloaded <= last:
+            return
+        if self.metrics is not None:
+            self.metrics.add_bytes(self.download_id, downloaded - last, speed)
+        if self.limiter is not None:
+            self.limiter.consume(self.download_id, downloaded - last, lambda: self._is_running, wait)
+
+    def postprocessor_hook(self, d):
+        """记录后处理（FFmpeg 合并、转码等）耗时"""
+        name = d.get('postprocessor')
+        if name == 'MoveFiles':
+            # 只是把文件移到最终位置，不计入后处理
+            return
+        if d['status'] == 'started':
+            self._postprocess_started[name] = time.monotonic()
+        elif d['status'] == 'finished' and name in self._postprocess_started:
+            elapsed = time.monotonic() - self._postprocess_started.pop(name)
+            self.tracer.record(f'postprocess.{name}', elapsed, self.download_id)
+            self.signal.log(self.download_id, f"后处理 {name} 耗时: {elapsed:.2f} 秒")
+            if self.metrics is not None:
+                self.metrics.observe('postprocess', elapsed)
+
+    def log_hook(self, level, message):
+        """yt-dlp 的警告写入任务日志，并统计重试次数"""
+        with self.tracer.span('hook.log', self.download_id):
+            self._log_hook(level, message)
+
+    def _log_hook(self, level, message):
+        if level == 'warning':
+            self.signal.log(self.download_id, message)
+            if 'Retrying' in message and self.metrics is not None:
+                self.metrics.count('retries', self.extractor)
 
     def run(self):
+        self.started_at = time.monotonic()
+        if self.metrics is not None:
+            self.metrics.job_started(self.download_id)
+            self.metrics.set_extractor(self.download_id, self.extractor)
         try:
             # 配置 yt-dlp 选项
             ydl_opts = {
-                'outtmpl': os.path.join(self.download_dir, '%(title)s.%(ext)s'),
+                'outtmpl': os.path.join(self.download_dir, OUTPUT_TEMPLATE),
                 'noplaylist': True,
+                'continuedl': True,  # 从已有的 .part 文件继续下载
+                'quiet': True,  # 进度和日志通过回调发送给前端，不输出到控制台
+                'noprogress': True,
             }
 
+            # 下载存档：已下载过的视频直接跳过
+            if self.archive_path:
+                ydl_opts['download_archive'] = self.archive_path
+
+            # 分段下载：DASH/HLS 分片并发下载，直链文件按字节范围多连接下载
+            if self.connections > 1:
+                ydl_opts['concurrent_fragment_downloads'] = self.connections
+
             # 添加隐藏窗口的配置（Windows）
             if sys.platform == "win32":
                 ydl_opts['external_downloader_args'] = ['--no-progress']
@@ -168,164 +1857,1569 @@ class DownloadWorker(threading.Thread):
                 self.signal.log(self.download_id, f"使用 FFmpeg 路径: {self.ffmpeg_path}")
 
             # 根据选择的画质设置
-            if self.quality == "最佳画质":
-                ydl_opts['format'] = 'best'
-            elif self.quality == "仅音频":
-                ydl_opts['format'] = 'bestaudio/best'
+            ydl_opts['format'] = get_format_selector(self.quality)
+            if self.quality == "仅音频":
                 ydl_opts['postprocessors'] = [{
                     'key': 'FFmpegExtractAudio',
                     'preferredcodec': 'mp3',
                     'preferredquality': '192',
                 }]
-            else:
-                # 自定义画质 - 使用更灵活的格式选择
-                # 对于 720p, 360p 等，使用更智能的格式选择
-                if self.quality in ["2160p", "1440p", "1080p", "720p", "480p", "360p"]:
-                    # 使用格式选择器来选择指定分辨率的视频
-                    resolution = self.quality.replace('p', '')
-                    ydl_opts['format'] = f'best[height<={resolution}]/best'
-                else:
-                    # 用户自定义格式
-                    ydl_opts['format'] = self.quality
 
             # 进度回调函数（用于Python模块方式）
             def progress_hook(d):
                 if not self._is_running:
-                    raise Exception("下载被用户停止")
-
-                if d['status'] == 'downloading':
-                    if 'total_bytes' in d and d['total_bytes']:
-                        percent = int(d['downloaded_bytes'] / d['total_bytes'] * 100)
-                        self.signal.progress(self.download_id, percent, d.get('speed', 0))
-                    elif 'total_bytes_estimate' in d and d['total_bytes_estimate']:
-                        percent = int(d['downloaded_bytes'] / d['total_bytes_estimate'] * 100)
-                        self.signal.progress(self.download_id, percent, d.get('speed', 0))
-                    else:
-                        self.signal.progress(self.download_id, 0, d.get('speed', 0))
-
-                    # 记录日志
-                    if 'eta' in d and d['eta']:
-                        log_msg = f"下载中: {d.get('_percent_str', 'N/A')} - 速度: {d.get('_speed_str', 'N/A')} - ETA: {d.get('_eta_str', 'N/A')}"
-                        self.signal.log(self.download_id, log_msg)
-
-                elif d['status'] == 'finished':
-                    self.signal.progress(self.download_id, 100, 0)
-                    self.signal.log(self.download_id, f"下载完成: {d['filename']}")
-
-            ydl_opts['progress_hooks'] = [progress_hook]
+                    raise Exception("下载被用户暂停" if self._paused else "下载被用户停止")
+                # 未启用追踪时直接处理，热路径上不经过 span 和 trace_transfer
+                if self.tracer.enabled:
+                    self.handle_progress(d)
+                else:
+                    self._handle_progress(d, True)
 
             # 如果指定了自定义 yt-dlp 路径，使用子进程调用
             if self.ytdlp_path and os.path.exists(self.ytdlp_path):
                 self.signal.log(self.download_id, f"使用自定义 yt-dlp 路径: {self.ytdlp_path}")
-                self.run_with_external_ytdlp(ydl_opts)
+                if self.info is not None:
+                    self.info_path = self.write_info_file()
+                # 在下载线程中查找，改用文本解析重新启动时（reactor 线程）不再访问文件系统
+                self.aria2c_found = self.connections > 1 and shutil.which('aria2c') is not None
+                # 进程输出由 reactor 线程读取，下载线程到此结束，进程退出时报告结果
+                self.start_external_ytdlp()
+                return
+            elif self.process_pool is not None:
+                self.run_in_process_pool(ydl_opts)
             else:
                 # 使用 Python 模块
                 self.signal.log(self.download_id, "使用内置 yt-dlp 模块")
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    self.signal.log(self.download_id, f"开始下载: {self.url}")
-                    ydl.download([self.url])
+                if self.connections > 1:
+                    self.signal.log(self.download_id, f"分段下载: {self.connections} 个连接")
+                pool = self.engine_pool or YoutubeDLPool()
+                deferred = []
+                with pool.lease(ydl_opts, progress_hook, self.connections, self.postprocessor_hook,
+                                self.log_hook, self.defer_postprocess(deferred), self.cancel_token) as (ydl, reused):
+                    self.signal.log(self.download_id, f"开始下载: {self.url}" + (" (复用引擎)" if reused else ""))
+                    if self.info is not None:
+                        self.download_with_info(ydl)
+                    else:
+                        ydl.download([self.url])
+                if self.engine_pool is None:
+                    pool.close()
+                if deferred and self._is_running:
+                    self.run_postprocessing(ydl_opts, deferred)
 
-            if self._is_running:
-                self.signal.finished(self.download_id, True, "下载完成")
+            self.finish()
 
         except Exception as e:
-            if self._is_running:  # 只有非用户停止的错误才报告
-                error_msg = str(e)
-                self.signal.log(self.download_id, f"错误: {error_msg}")
-                self.signal.finished(self.download_id, False, error_msg)
+            self.finish(e)
+
+    def trace_transfer(self, status):
+        """按进度状态记录解析（开始到第一次进度）和传输（每个文件第一次进度到完成）区间"""
+        if not self.tracer.enabled:
+            return
+        now = time.perf_counter()
+        if status == 'downloading' and self._transfer_started is None:
+            if not self._extract_traced:
+                self._extract_traced = True
+                self.tracer.record('worker.extract', time.monotonic() - self.started_at, self.download_id)
+            self._transfer_started = now
+        elif status == 'finished' and self._transfer_started is not None:
+            self.tracer.record('worker.transfer', now - self._transfer_started, self.download_id)
+            self._transfer_started = None
+
+    def handle_progress(self, d, wait=True):
+        """处理 yt-dlp 的进度回调并记录追踪区间（调用方在未启用追踪时直接调用 _handle_progress）"""
+        with self.tracer.span('hook.progress', self.download_id):
+            self.trace_transfer(d['status'])
+            self._handle_progress(d, wait)
+
+    def _handle_progress(self, d, wait):
+        if d.get('filename') and d['filename'] not in self.output_files:
+            self.output_files.add(d['filename'])
+        if d['status'] == 'downloading':
+            self.set_extractor((d.get('info_dict') or {}).get('extractor_key'))
+            self.report_first_byte(d.get('downloaded_bytes'))
+            self.account_progress(d.get('downloaded_bytes'), d.get('speed'), wait)
+            if 'total_bytes' in d and d['total_bytes']:
+                percent = int(d['downloaded_bytes'] / d['total_bytes'] * 100)
+                self.signal.progress(self.download_id, percent, d.get('speed', 0))
+            elif 'total_bytes_estimate' in d and d['total_bytes_estimate']:
+                percent = int(d['downloaded_bytes'] / d['total_bytes_estimate'] * 100)
+                self.signal.progress(self.download_id, percent, d.get('speed', 0))
+            else:
+                self.signal.progress(self.download_id, 0, d.get('speed', 0))
+
+            # 记录日志
+            if 'eta' in d and d['eta']:
+                log_msg = f"下载中: {d.get('_percent_str', 'N/A')} - 速度: {d.get('_speed_str', 'N/A')} - ETA: {d.get('_eta_str', 'N/A')}"
+                self.signal.log(self.download_id, log_msg)
+
+        elif d['status'] == 'finished':
+            self.signal.progress(self.download_id, 100, 0)
+            self.signal.log(self.download_id, f"下载完成: {d['filename']}")
+
+    def run_in_process_pool(self, ydl_opts):
+        """在下载进程池中执行内置 yt-dlp 下载，本线程只等待结果"""
+        self.signal.log(self.download_id, "使用内置 yt-dlp 模块（下载进程）")
+        # 子进程中无法向限速器申请带宽，按分到的带宽限速；限速调整后由进度事件转发给子进程
+        rate = self.limiter.share(self.download_id) if self.limiter is not None else 0
+        if rate:
+            self.signal.log(self.download_id, f"限速: {format_speed(rate)}")
+
+        self.process_job, future = self.process_pool.submit(self.url, ydl_opts, self.connections, self.info,
+                                                            self.handle_process_event, rate)
+        try:
+            if not self._is_running:
+                self.process_pool.cancel(self.process_job)
+            result = future.result()
+        finally:
+            self.process_pool.release(self.process_job)
+        self.info_stale = result['info_stale']
+
+    def handle_process_event(self, kind, payload):
+        """下载进程发回的事件（进程池的事件转发线程）"""
+        if kind == 'progress':
+            # 流量已由子进程自己限速，这里只记录，不阻塞转发线程；总限速/单任务限速或下载数变化后更新子进程的限速
+            if self.limiter is not None and self.process_job is not None:
+                self.process_pool.set_rate(self.process_job, self.limiter.share(self.download_id))
+            if self.tracer.enabled:
+                self.handle_progress(payload, wait=False)
+            else:
+                self._handle_progress(payload, False)
+        elif kind == 'postprocessor':
+            if payload['status'] == 'started' and not self._postprocessing and self.postprocess_stage is not None:
+                # 子进程中直接执行后处理，网络部分已经结束，先让出下载槽位
+                self._postprocessing = True
+                self.signal.postprocessing(self.download_id)
+            self.postprocessor_hook(payload)
+        elif kind == 'log':
+            self.log_hook(*payload)
+        elif kind == 'message':
+            self.signal.log(self.download_id, payload)
+
+    def finish(self, error=None):
+        """报告下载结果（下载线程结束时，或外部进程退出时在 reactor 线程中调用）"""
+        self.tracer.record('worker.job', time.monotonic() - self.started_at, self.download_id)
+        if self.info_path:
+            with contextlib.suppress(OSError):
+                os.remove(self.info_path)
+            self.info_path = None
+
+        if not self._is_running:  # 只有非用户停止的错误才报告
+            if not self._paused and self.cleanup_policy != 'keep':
+                self.cleanup_temp_files()
+            self.record_result(None)
+            self.signal.interrupted(self.download_id)
+        elif error is None:
+            self.record_result('completed')
+            self.signal.finished(self.download_id, True, "下载完成")
+        else:
+            error_msg = str(error)
+            if self.info is not None and 'HTTP Error 403' in error_msg:
+                # 缓存的媒体地址多半已过期，重试时重新解析
+                self.info_stale = True
+            self.record_result('failed')
+            self.signal.log(self.download_id, f"错误: {error_msg}")
+            self.signal.finished(self.download_id, False, error_msg)
+        self.done.set()
+
+    def cleanup_temp_files(self):
+        """停止后按 cleanup_policy 删除临时文件或移到下载目录的 .cancelled 文件夹（下载已经结束时调用）"""
+        paths = [path for filename in self.output_files for path in find_temp_files(filename)]
+        handled = 0
+        for path in paths:
+            try:
+                if self.cleanup_policy == 'park':
+                    directory = os.path.join(os.path.dirname(path), CANCELLED_DIR)
+                    os.makedirs(directory, exist_ok=True)
+                    os.replace(path, os.path.join(directory, os.path.basename(path)))
+                else:
+                    os.remove(path)
+                handled += 1
+            except OSError as e:
+                self.signal.log(self.download_id, f"处理临时文件失败: {e}")
+        if handled:
+            self.signal.log(self.download_id, f"已{CANCEL_CLEANUP_POLICIES[self.cleanup_policy]} {handled} 个临时文件")
+
+    def defer_postprocess(self, deferred):
+        """有后处理阶段时返回收集后处理任务的回调，否则返回 None（在下载中直接执行）"""
+        if self.postprocess_stage is None:
+            return None
+        return lambda filename, info, files_to_move: deferred.append((filename, info, files_to_move))
+
+    def run_postprocessing(self, ydl_opts, jobs):
+        """让出下载槽位，在后处理阶段执行下载时收集的 FFmpeg 合并/转码，成功后写入下载存档"""
+        import yt_dlp
 
-    def run_with_external_ytdlp(self, ydl_opts):
-        """使用外部 yt-dlp 可执行文件进行下载"""
+        self.signal.postprocessing(self.download_id)
+        self.signal.log(self.download_id, "下载完成，等待后处理")
+
+        def process():
+            # 独立的实例：配置的后处理器由 postprocessors 选项重新创建，进度通过 postprocessor_hooks 回报，
+            # 池中继续复用的下载实例不受影响
+            logger = YoutubeDLPool.DispatchLogger(types.SimpleNamespace(log_hook=self.log_hook))
+            opts = dict(ydl_opts, postprocessor_hooks=[self.postprocessor_hook], logger=logger)
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                for filename, info, files_to_move in jobs:
+                    # 合并、修复等随视频附加的后处理器，yt-dlp 创建时只传入下载实例，这里绑定到新实例重建
+                    info['__postprocessors'] = [type(pp)(ydl) for pp in info.get('__postprocessors') or []]
+                    ydl.post_process(filename, info, files_to_move)
+                # 多个格式分别下载时同一个视频只记录一次
+                archived = {}
+                for _, info, _ in jobs:
+                    archived.setdefault(get_archive_key(None, info.get('extractor_key'), info.get('id')), info)
+                for info in archived.values():
+                    ydl.record_download_archive(info)
+
+        with self.tracer.span('worker.postprocess', self.download_id):
+            self.postprocess_stage.run(process, lambda: self._is_running)
+
+    def record_result(self, result):
+        if self.metrics is not None:
+            self.metrics.job_finished(self.download_id, result, self.extractor)
+
+    def download_with_info(self, ydl):
+        """使用解析阶段缓存的视频信息直接下载；信息失效时按 URL 重新解析下载"""
+        self.signal.log(self.download_id, "使用已解析的视频信息")
+        try:
+            ydl.process_ie_result(copy.deepcopy(self.info), download=True)
+        except Exception as e:
+            if not self._is_running:
+                raise
+            # 媒体地址过期等情况，与 yt-dlp --load-info-json 的处理方式一致
+            self.info_stale = True
+            self.signal.log(self.download_id, f"已解析的视频信息下载失败，重新解析: {e}")
+            ydl.download([self.url])
+
+    def write_info_file(self):
+        """把视频信息写入临时文件，供外部 yt-dlp 的 --load-info-json 使用"""
+        fd, path = tempfile.mkstemp(prefix="ytdlp-gui-", suffix=".info.json")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.info, f, ensure_ascii=False, default=str)
+        return path
+
+    def start_external_ytdlp(self, use_progress_template=True):
+        """使用外部 yt-dlp 可执行文件进行下载，进程交给 reactor 管理"""
         # 构建命令行参数
         cmd = [self.ytdlp_path]
 
         # 输出模板
-        cmd.extend(['-o', os.path.join(self.download_dir, '%(title)s.%(ext)s')])
+        cmd.extend(['-o', os.path.join(self.download_dir, OUTPUT_TEMPLATE)])
+        if self.archive_path:
+            cmd.extend(['--download-archive', self.archive_path])
 
         # 添加进度显示参数
+        cmd.extend(['--continue', '--part'])  # 保留 .part 文件，暂停后可继续
         cmd.extend(['--newline'])  # 强制每行输出
         cmd.extend(['--progress'])  # 显示进度条
         cmd.extend(['--console-title'])  # 在控制台标题显示进度
+        if use_progress_template:
+            # 机器可读的进度记录，取代解析控制台文本
+            cmd.extend(['--progress-template', PROGRESS_TEMPLATE])
+
+        # 限速：按启动时分到的带宽，运行中无法调整外部进程的速率
+        if self.limiter is not None:
+            rate = self.limiter.share(self.download_id)
+            if rate:
+                cmd.extend(['--limit-rate', str(rate)])
+                if use_progress_template:
+                    self.signal.log(self.download_id, f"限速: {format_speed(rate)}")
+
+        # 分段下载：分片并发；有 aria2c 时直链文件也用多连接下载
+        if self.connections > 1:
+            cmd.extend(['-N', str(self.connections)])
+            if self.aria2c_found:
+                cmd.extend(['--downloader', 'http,https:aria2c',
+                            '--downloader-args', f'aria2c:-x {self.connections} -s {self.connections} -k 1M'])
+            else:
+                self.signal.log(self.download_id, "未找到 aria2c，直链文件仍使用单连接下载")
 
-        # 画质设置
-        if self.quality == "最佳画质":
-            cmd.extend(['-f', 'best'])
-        elif self.quality == "仅音频":
-            cmd.extend(['-f', 'bestaudio', '--extract-audio', '--audio-format', 'mp3'])
+        # 画质设置：与内置模块和解析阶段使用同一个格式选择器
+        cmd.extend(['-f', get_format_selector(self.quality)])
+        if self.quality == "仅音频":
+            cmd.extend(['--extract-audio', '--audio-format', 'mp3'])
+
+        # 添加 URL（已解析过则直接加载视频信息，失效时 yt-dlp 会自动按原地址重新解析）
+        if self.info_path:
+            cmd.extend(['--load-info-json', self.info_path])
         else:
-            # 自定义画质 - 使用更灵活的格式选择
-            if self.quality in ["2160p", "1440p", "1080p", "720p", "480p", "360p"]:
-                # 使用格式选择器来选择指定分辨率的视频
-                resolution = self.quality.replace('p', '')
-                cmd.extend(['-f', f'best[height<={resolution}]'])
-            else:
-                # 用户自定义格式
-                cmd.extend(['-f', self.quality])
+            cmd.append(self.url)
+
+        state = types.SimpleNamespace(use_progress_template=use_progress_template, last_progress_update=0,
+                                      last_error=None, postprocess_started=None, template_unsupported=False)
+        self.process = self.reactor.spawn(cmd, lambda line: self.handle_external_line(line, state),
+                                          lambda returncode, error: self.external_exited(state, returncode, error))
+        if not self._is_running:
+            self.reactor.terminate(self.process)
+
+    def handle_external_line(self, line, state):
+        """解析外部 yt-dlp 的一行输出（reactor 线程）"""
+        if not self._is_running:
+            return
+        if not self.tracer.enabled:
+            self._handle_external_line(line, state)
+            return
+        with self.tracer.span('hook.external_line', self.download_id):
+            self._handle_external_line(line, state)
 
-        # 添加 URL
-        cmd.append(self.url)
+    def _handle_external_line(self, line, state):
 
-        # 使用隐藏窗口的方式启动进程
-        process = self.create_subprocess(cmd)
+        line = line.strip()
+        if not line:
+            return
 
-        # 读取输出并解析进度
-        last_progress_update = 0
-        for line in process.stdout:
-            if not self._is_running:
-                process.terminate()
-                break
+        record = parse_progress_record(line)
+        if record is not None:
+            # 结构化进度记录
+            status, percent, downloaded, total, speed, eta = record
+            self.trace_transfer(status)
+            self.report_first_byte(downloaded)
+            # 外部进程的流量计入全局令牌桶（不阻塞），内置模块的下载相应让出带宽
+            self.account_progress(downloaded, speed, wait=False)
+            self.signal.progress(self.download_id, int(percent), speed, eta)
+
+            current_time = datetime.now().timestamp()
+            if status == 'finished':
+                self.signal.log(self.download_id, "下载完成")
+            elif current_time - state.last_progress_update >= 2:  # 每2秒记录一次进度
+                state.last_progress_update = current_time
+                self.signal.log(self.download_id,
+                                f"下载中: {percent:.1f}% - 速度: {format_speed(speed)} - ETA: {eta or 'N/A'}")
+            return
 
-            line = line.strip()
-            if line:
-                # 记录所有输出到日志（但过滤掉频繁的进度更新以减少日志量）
-                should_log = True
-                if '[download]' in line and any(x in line for x in ['%', 'ETA']):
-                    # 进度行，减少日志频率
-                    current_time = datetime.now().timestamp()
-                    if current_time - last_progress_update < 2:  # 每2秒记录一次进度
-                        should_log = False
-                    else:
-                        last_progress_update = current_time
+        if line.startswith('[download]') and not state.use_progress_template:
+            # 回退：旧版 yt-dlp 不支持 --progress-template 时解析控制台文本
+            percent, speed, eta = self.parse_ytdlp_progress(line)
+            if percent > 0:
+                self.trace_transfer('finished' if percent >= 100 else 'downloading')
+                self.signal.progress(self.download_id, int(percent), speed, eta)
+                current_time = datetime.now().timestamp()
+                if current_time - state.last_progress_update < 2:
+                    return
+                state.last_progress_update = current_time
+
+        # 非进度输出照常记录日志
+        self.signal.log(self.download_id, line)
+
+        destination = EXTERNAL_DESTINATION_RE.match(line)
+        if destination:
+            self.output_files.add(destination.group(1) or destination.group(2))
+
+        tag = OUTPUT_TAG_RE.match(line)
+        if tag and (tag.group(1) in POSTPROCESSOR_TAGS or tag.group(1).startswith('Fixup')):
+            # 后处理从第一行输出开始计时，到进程退出为止
+            if state.postprocess_started is None:
+                state.postprocess_started = time.monotonic()
+                if self.postprocess_stage is not None:
+                    # 外部进程自己执行后处理，网络部分已经结束，先让出下载槽位
+                    self.signal.postprocessing(self.download_id)
+        elif tag and tag.group(1) not in ('download', 'info', 'debug'):
+            self.set_extractor(tag.group(1))
+
+        if line.startswith('ERROR:'):
+            state.last_error = line[len('ERROR:'):].strip()
+        elif line.startswith('WARNING:') and 'Retrying' in line and self.metrics is not None:
+            self.metrics.count('retries', self.extractor)
+        elif 'no such option: --progress-template' in line:
+            state.template_unsupported = True
+        elif 'The info failed to download' in line:
+            self.info_stale = True
+
+    def external_exited(self, state, returncode, error):
+        """外部 yt-dlp 进程退出（reactor 线程）"""
+        try:
+            if error is not None:
+                raise error
+
+            if state.postprocess_started is not None:
+                elapsed = time.monotonic() - state.postprocess_started
+                self.signal.log(self.download_id, f"后处理耗时: {elapsed:.2f} 秒")
+                self.tracer.record('postprocess.external', elapsed, self.download_id)
+                if self.metrics is not None:
+                    self.metrics.observe('postprocess', elapsed)
+
+            if state.template_unsupported and self._is_running:
+                self.signal.log(self.download_id, "当前 yt-dlp 不支持 --progress-template，改用文本解析")
+                self.start_external_ytdlp(use_progress_template=False)
+                return
+
+            # 检查进程退出状态
+            if returncode == 0:
+                self.signal.log(self.download_id, "外部 yt-dlp 进程正常退出")
+            else:
+                self.signal.log(self.download_id, f"外部 yt-dlp 进程异常退出，代码: {returncode}")
+                if self._is_running:
+                    raise Exception(state.last_error or f"yt-dlp 退出代码 {returncode}")
+        except Exception as e:
+            self.finish(e)
+        else:
+            self.finish()
 
-                if should_log:
-                    self.signal.log(self.download_id, line)
+    def stop(self, cleanup='keep'):
+        """停止：外部进程连同子进程一起结束，内置模块阻塞的网络连接立即中断；
+        结束后按 cleanup（见 CANCEL_CLEANUP_POLICIES）处理临时文件"""
+        self._is_running = False
+        self.cleanup_policy = cleanup
+        self.cancel_token.cancel()
+        if self.process is not None:
+            self.reactor.terminate(self.process)
+        if self.process_job is not None:
+            self.process_pool.cancel(self.process_job)
+
+    def pause(self):
+        """暂停：停止下载但保留 .part 文件，之后可以继续"""
+        self._paused = True
+        self.stop()
+
+
+class DownloadScheduler:
+    """下载调度器：限制全局并发数和单站点并发数，按优先级/FIFO 顺序派发任务
+
+    延迟提交的任务（自动重试）到时间后才进入就绪队列；冷却中的站点暂停派发新任务
+    """
+
+    def __init__(self, max_concurrent=3, per_host_limit=2):
+        self.max_concurrent = max_concurrent
+        self.per_host_limit = per_host_limit
+        self._ready = []  # (priority, seq, download_id, host)
+        self._delayed = []  # (ready_at, seq, priority, download_id, host)
+        self._cooldowns = {}  # host -> 冷却结束时间
+        self._queued = set()
+        self._running = {}  # download_id -> host
+        self._host_counts = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_host(url):
+        """提取URL的主机名，作为单站点并发限制的键"""
+        try:
+            host = (urlparse(url).hostname or "").lower()
+        except ValueError:
+            host = ""
+        if host.startswith("www."):
+            host = host[4:]
+        return host
+
+    def submit(self, download_id, url, priority=0, delay=0):
+        """加入就绪队列，priority 越小越先派发，相同优先级按加入顺序；delay 秒后才可以派发"""
+        with self._lock:
+            if download_id in self._queued or download_id in self._running:
+                return False
+            if delay > 0:
+                heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._seq), priority, download_id,
+                                               self.get_host(url)))
+            else:
+                heapq.heappush(self._ready, (priority, next(self._seq), download_id, self.get_host(url)))
+            self._queued.add(download_id)
+            return True
+
+    def cancel(self, download_id):
+        """从就绪队列中移除（已派发的任务不受影响）"""
+        with self._lock:
+            if download_id not in self._queued:
+                return False
+            self._queued.discard(download_id)
+            self._ready = [entry for entry in self._ready if entry[2] != download_id]
+            heapq.heapify(self._ready)
+            self._delayed = [entry for entry in self._delayed if entry[3] != download_id]
+            heapq.heapify(self._delayed)
+            return True
+
+    def cool_down(self, host, seconds):
+        """站点开始限流时，在 seconds 秒内不再向该站点派发新任务"""
+        with self._lock:
+            self._cooldowns[host] = max(self._cooldowns.get(host, 0), time.monotonic() + seconds)
+
+    def has_timers(self):
+        """是否有等待中的延迟任务或冷却中的站点（需要定时调用 pop_ready）"""
+        with self._lock:
+            return bool(self._delayed or self._cooldowns)
+
+    def release(self, download_id):
+        """任务结束后释放其占用的槽位"""
+        with self._lock:
+            host = self._running.pop(download_id, None)
+            if host is None:
+                return False
+            self._host_counts[host] -= 1
+            if self._host_counts[host] <= 0:
+                del self._host_counts[host]
+            return True
+
+    def pop_ready(self):
+        """取出当前可以开始的任务ID列表，并标记为运行中"""
+        started = []
+        skipped = []
+        now = time.monotonic()
+        with self._lock:
+            while self._delayed and self._delayed[0][0] <= now:
+                _, seq, priority, download_id, host = heapq.heappop(self._delayed)
+                heapq.heappush(self._ready, (priority, seq, download_id, host))
+            if self._cooldowns:
+                self._cooldowns = {host: until for host, until in self._cooldowns.items() if until > now}
+
+            while self._ready and len(self._running) < self.max_concurrent:
+                entry = heapq.heappop(self._ready)
+                download_id, host = entry[2], entry[3]
+                if host in self._cooldowns or (
+                        self.per_host_limit > 0 and self._host_counts.get(host, 0) >= self.per_host_limit):
+                    skipped.append(entry)
+                    continue
+                self._queued.discard(download_id)
+                self._running[download_id] = host
+                self._host_counts[host] = self._host_counts.get(host, 0) + 1
+                started.append(download_id)
+            for entry in skipped:
+                heapq.heappush(self._ready, entry)
+        return started
+
+    def peek(self, limit):
+        """就绪队列中最先派发的 limit 个任务 [(download_id, host)]，不改变队列"""
+        with self._lock:
+            return [(entry[2], entry[3]) for entry in heapq.nsmallest(limit, self._ready)]
+
+    def is_queued(self, download_id):
+        with self._lock:
+            return download_id in self._queued
+
+    def running_count(self):
+        with self._lock:
+            return len(self._running)
+
+    def queued_count(self):
+        with self._lock:
+            return len(self._queued)
+
+
+# 下载失败原因分类：站点限流、重试也不会成功的永久错误、可以重试的临时错误
+RATE_LIMITED_ERROR_RE = re.compile(r'HTTP Error 429|Too Many Requests|rate[- ]?limit', re.I)
+PERMANENT_ERROR_RE = re.compile(
+    r'HTTP Error (?:400|401|404|405|410|451)|Unsupported URL|Video unavailable|Private video|is not available'
+    r'|has been removed|copyright|Sign in to confirm|members[- ]only|ffmpeg not found|ffprobe and ffmpeg'
+    r'|Permission denied|No space left', re.I)
+TRANSIENT_ERROR_RE = re.compile(
+    r'HTTP Error (?:403|408|5\d\d)|timed? ?out|Connection (?:reset|refused|aborted)|reset by peer'
+    r'|Remote end closed|IncompleteRead|Temporary failure|temporarily unavailable|Unable to download'
+    r'|Unable to connect|Network is unreachable|EOF occurred|did not get any data|giving up after', re.I)
+ERROR_KIND_TEXT = {'transient': "临时错误", 'rate_limited': "站点限流", 'permanent': "永久错误"}
+
+
+def classify_error(message):
+    """返回 'rate_limited'、'permanent' 或 'transient'；无法识别的错误按永久错误处理，不自动重试"""
+    if RATE_LIMITED_ERROR_RE.search(message):
+        return 'rate_limited'
+    if PERMANENT_ERROR_RE.search(message):
+        return 'permanent'
+    if TRANSIENT_ERROR_RE.search(message):
+        return 'transient'
+    return 'permanent'
+
+
+class RetryPolicy:
+    """失败任务的自动重试间隔：指数退避加随机抖动，限流错误从更长的间隔开始"""
+
+    def __init__(self, max_retries=5, base_delay=2, rate_limited_delay=30, max_delay=600):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.rate_limited_delay = rate_limited_delay
+        self.max_delay = max_delay
+
+    def delay(self, kind, attempt):
+        """第 attempt 次重试（从 0 开始）前等待的秒数，不应重试时返回 None"""
+        if kind == 'permanent' or attempt >= self.max_retries:
+            return None
+        base = self.rate_limited_delay if kind == 'rate_limited' else self.base_delay
+        ceiling = min(self.max_delay, base * 2 ** attempt)
+        # 抖动一半的间隔，同时失败的任务不会同时重试
+        return random.uniform(ceiling / 2, ceiling)
+
+
+# 播放列表 / 频道地址（watch?v=...&list=... 仍按单个视频处理）
+COLLECTION_URL_RE = re.compile(
+    r'''(?:youtube\.com/(?:playlist\?|channel/|c/|user/|@)
+    | space\.bilibili\.com/
+    | /playlists?(?:[/?\#]|$)
+    | /(?:videos|shorts|streams)/?(?:[?\#]|$))''',
+    re.VERBOSE | re.IGNORECASE
+)
+
+
+def is_collection_url(url):
+    """判断URL是否是需要展开的播放列表或频道"""
+    return COLLECTION_URL_RE.search(url) is not None
+
+
+# 外部 yt-dlp 输出行开头的 [标签]，用于识别提取器和后处理步骤
+OUTPUT_TAG_RE = re.compile(r'\[(\w+)\]')
+POSTPROCESSOR_TAGS = {'Merger', 'ExtractAudio', 'VideoConvertor', 'VideoRemuxer', 'EmbedThumbnail',
+                      'EmbedSubtitle', 'Metadata', 'FFmpegMetadata', 'SplitChapters', 'ModifyChapters'}
+
+# 输出文件名带上视频ID，避免同名视频互相覆盖
+OUTPUT_TEMPLATE = '%(title)s [%(id)s].%(ext)s'
+EXTERNAL_DESTINATION_RE = re.compile(r'\[download\] Destination: (.+)$|\[Merger\] Merging formats into "(.+)"$')
+
+RESOLUTION_QUALITIES = ["2160p", "1440p", "1080p", "720p", "480p", "360p"]
+
+
+def get_format_selector(quality):
+    """把界面上的画质选项转换为 yt-dlp 格式选择器"""
+    if quality == "最佳画质":
+        return 'best'
+    elif quality == "仅音频":
+        return 'bestaudio/best'
+    elif quality in RESOLUTION_QUALITIES:
+        # 使用格式选择器来选择指定分辨率的视频
+        resolution = quality.replace('p', '')
+        return f'best[height<={resolution}]/best'
+    # 用户自定义格式
+    return quality
+
+
+# 各种 YouTube 地址变体（youtu.be、shorts、embed、live 等）都归一到同一个视频ID
+YOUTUBE_ID_RE = re.compile(
+    r'(?:youtu\.be/|youtube(?:-nocookie)?\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/))'
+    r'(?P<id>[0-9A-Za-z_-]{11})(?![0-9A-Za-z_-])'
+)
+# 不影响视频内容的参数（时间点、分享来源、统计参数等）
+IGNORED_URL_PARAMS = {'t', 'start', 'si', 'feature', 'pp', 'ab_channel', 'spm_id_from', 'vd_source'}
+
+
+def get_archive_key(url=None, extractor=None, video_id=None):
+    """返回与 yt-dlp download_archive 格式一致的键（"extractor id"），无法确定时返回 None"""
+    if extractor and video_id:
+        return f"{extractor.lower()} {video_id}"
+    if url:
+        match = YOUTUBE_ID_RE.search(url)
+        if match:
+            return f"youtube {match.group('id')}"
+    return None
+
+
+def normalize_url(url):
+    """URL 归一化：忽略协议、www./m. 前缀、片段和无关参数，参数排序"""
+    try:
+        parsed = urlparse(url.strip())
+    except ValueError:
+        return url.strip()
+    host = (parsed.hostname or "").lower()
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    params = sorted((key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+                    if key not in IGNORED_URL_PARAMS and not key.startswith('utm_'))
+    path = parsed.path.rstrip('/')
+    return f"{host}{path}?{urlencode(params)}" if params else f"{host}{path}"
+
+
+def get_dedup_key(url, extractor=None, video_id=None):
+    """入队去重使用的键：优先使用存档键，否则使用归一化后的URL"""
+    return get_archive_key(url, extractor, video_id) or normalize_url(url)
+
+
+class DownloadArchive:
+    """与 yt-dlp download_archive 兼容的下载存档（每行 "extractor id"）
+
+    文件由 yt-dlp 在下载完成时追加写入，这里在内存中用集合建立索引，
+    并从上次读取的位置增量读取新追加的记录
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._ids = set()
+        self._offset = 0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """读取文件中新追加的记录"""
+        with self._lock:
+            try:
+                with open(self.path, 'rb') as f:
+                    f.seek(self._offset)
+                    data = f.read()
+            except OSError:
+                return
+            # 只处理完整的行，未写完的行留到下次
+            end = data.rfind(b'\n') + 1
+            for line in data[:end].decode('utf-8', errors='replace').splitlines():
+                line = line.strip()
+                if line:
+                    self._ids.add(line)
+            self._offset += end
+
+    def __contains__(self, key):
+        return key in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class DownloadItem:
+    """队列中的一个下载项
+
+    用 __slots__ 紧凑存放，数万个任务时比字典省内存。保留字典式的读写
+    （item['status']、item.get('title')），语义与字典一致：未赋值的槽位视为没有该字段，
+    赋值为 None 的字段仍然存在
+    """
+
+    __slots__ = ('url', 'quality', 'connections', 'rate_limit', 'title', 'key', 'status', 'progress', 'message',
+                 'status_text', 'tags', 'metadata', 'filesize', 'duration', 'autostart', 'resume_pending',
+                 'awaiting_metadata', 'expanded', 'skipped', 'retries')
+
+    def __init__(self, url, quality, status='pending', progress=0, connections=1, status_text="", tags=()):
+        self.url = url
+        self.quality = quality
+        self.status = status
+        self.progress = progress
+        self.connections = connections
+        self.status_text = status_text
+        self.tags = tags
 
-                # 解析进度信息
-                if '[download]' in line or 'download' in line.lower():
-                    percent, speed, eta = self.parse_ytdlp_progress(line)
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
 
-                    # 更新进度显示
-                    if percent > 0:
-                        self.signal.progress(self.download_id, int(percent), speed, eta)
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
 
-                    # 检测下载完成
-                    if '100%' in line or 'already downloaded' in line.lower() or 'has already been downloaded' in line:
-                        self.signal.progress(self.download_id, 100, 0)
-                        self.signal.log(self.download_id, "下载完成")
+    def __contains__(self, name):
+        return hasattr(self, name)
 
-                # 检测错误
-                elif 'error' in line.lower() or 'failed' in line.lower():
-                    self.signal.log(self.download_id, f"下载错误: {line}")
+    def get(self, name, default=None):
+        return getattr(self, name, default)
 
-        process.wait()
+    def pop(self, name, *default):
+        try:
+            value = getattr(self, name)
+        except AttributeError:
+            if default:
+                return default[0]
+            raise KeyError(name) from None
+        delattr(self, name)
+        return value
+
+
+class QueueJournal:
+    """下载队列日志：每次状态变化追加一行 JSON 记录，启动时回放恢复队列
+
+    写入只追加一行，开销与队列大小无关；记录数超过存活任务数的若干倍时
+    重写为快照（摊还后仍为常数开销）。崩溃导致的半行记录在回放时忽略
+
+    持久性：每条记录写入后 flush，程序崩溃不丢记录；fsync 按 SYNC_INTERVAL 批量进行
+    （每条都 fsync 时批量暂停/继续会被磁盘同步拖慢），系统崩溃或断电时最多丢失最后
+    SYNC_INTERVAL 秒的记录。重写快照时先 fsync 临时文件再替换，并 fsync 所在目录，
+    任何时候断电都能读到完整的旧日志或新快照
+    """
+
+    COMPACT_MIN_RECORDS = 1000
+    COMPACT_RATIO = 4
+    SYNC_INTERVAL = 1.0  # 秒
+    FIELDS = ('url', 'quality', 'connections', 'rate_limit', 'title', 'key', 'status', 'progress', 'message',
+              'retries')
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._records = 0
+        self._snapshot = None
+        self._unsynced = False
+        self._synced_at = 0.0
+
+    def load(self):
+        """回放日志，返回按添加顺序排列的 {download_id: 字段}"""
+        items = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        op = record.pop('op')
+                        download_id = record.pop('id')
+                    except (ValueError, KeyError, AttributeError):
+                        continue
+                    if op == 'add':
+                        items[download_id] = record
+                    elif op == 'update' and download_id in items:
+                        items[download_id].update(record)
+                    elif op == 'remove':
+                        items.pop(download_id, None)
+        except OSError:
+            pass
+        return items
+
+    def open(self, snapshot):
+        """以当前队列快照重写日志并打开追加写入，snapshot() 返回 {download_id: 下载项}"""
+        self._snapshot = snapshot
+        self.compact()
+
+    def compact(self):
+        tmp_path = self.path + ".tmp"
+        items = self._snapshot()
+        if self._file is not None:
+            self._file.close()
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for download_id, item_info in items.items():
+                record = {key: item_info[key] for key in self.FIELDS if key in item_info}
+                f.write(json.dumps({'op': 'add', 'id': download_id, **record}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._sync_dir()
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._records = len(items)
+        self._unsynced = False
+        self._synced_at = time.monotonic()
+
+    def _sync_dir(self):
+        """fsync 日志所在目录，使 os.replace 的结果在断电后仍然有效（Windows 不支持打开目录，跳过）"""
+        if sys.platform == "win32":
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
 
-        # 检查进程退出状态
-        if process.returncode == 0:
-            self.signal.log(self.download_id, "外部 yt-dlp 进程正常退出")
+    def sync(self, force=False):
+        """把已 flush 的记录 fsync 到磁盘；不强制时距上次同步不足 SYNC_INTERVAL 秒则跳过"""
+        if self._file is None or not self._unsynced:
+            return
+        now = time.monotonic()
+        if force or now - self._synced_at >= self.SYNC_INTERVAL:
+            os.fsync(self._file.fileno())
+            self._unsynced = False
+            self._synced_at = now
+
+    def _append(self, record):
+        if self._file is None:
+            return
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._unsynced = True
+        self._records += 1
+        if self._records > self.COMPACT_MIN_RECORDS and \
+                self._records > self.COMPACT_RATIO * len(self._snapshot()):
+            self.compact()
         else:
-            self.signal.log(self.download_id, f"外部 yt-dlp 进程异常退出，代码: {process.returncode}")
+            self.sync()
+
+    def add(self, download_id, item_info):
+        record = {key: item_info[key] for key in self.FIELDS if key in item_info}
+        self._append({'op': 'add', 'id': download_id, **record})
+
+    def update(self, download_id, **fields):
+        self._append({'op': 'update', 'id': download_id, **fields})
+
+    def remove(self, download_id):
+        self._append({'op': 'remove', 'id': download_id})
+
+    def close(self):
+        if self._file is not None:
+            self.sync(force=True)
+            self._file.close()
+            self._file = None
+
+
+class PlaylistExpander:
+    """播放列表/频道展开：在线程池中用平铺提取（extract_flat）解析条目，分批回传到界面"""
+
+    BATCH_SIZE = 50
+    BATCH_INTERVAL = 0.5  # 秒
+
+    def __init__(self, signal, max_workers=4, reactor=None):
+        self.signal = signal
+        self.reactor = reactor or ProcessReactor()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="expander")
+        self._jobs = {}  # parent_id -> {'pending', 'count', 'seen', 'cancelled', 'error'}
+        self._lock = threading.Lock()
+
+    def expand(self, parent_id, url, ytdlp_path, on_entries, on_done):
+        """开始展开 url，条目通过 on_entries(parent_id, entries) 分批回传，
+        全部完成后调用 on_done(parent_id, count, error)（均在主线程执行）"""
+        with self._lock:
+            self._jobs[parent_id] = {'pending': 0, 'count': 0, 'seen': set(), 'cancelled': False,
+                                     'error': None, 'callbacks': (on_entries, on_done)}
+        self._submit(parent_id, url, ytdlp_path)
+
+    def cancel(self, parent_id):
+        with self._lock:
+            if parent_id in self._jobs:
+                self._jobs[parent_id]['cancelled'] = True
+
+    def _submit(self, parent_id, url, ytdlp_path):
+        with self._lock:
+            self._jobs[parent_id]['pending'] += 1
+        self.executor.submit(self._run, parent_id, url, ytdlp_path)
+
+    def _run(self, parent_id, url, ytdlp_path):
+        job = self._jobs[parent_id]
+        on_entries, on_done = job['callbacks']
+        batch = []
+        last_flush = time.monotonic()
+
+        def flush():
+            if batch:
+                with self._lock:
+                    job['count'] += len(batch)
+                self.signal.call(on_entries, parent_id, list(batch))
+                batch.clear()
+
+        try:
+            if ytdlp_path and os.path.exists(ytdlp_path):
+                entries = self._iter_external(url, ytdlp_path)
+            else:
+                entries = self._iter_module(url)
+
+            for entry in entries:
+                if job['cancelled']:
+                    break
+                entry_url = entry.get('url') or entry.get('webpage_url')
+                if not entry_url:
+                    continue
+
+                if entry.get('_type') == 'playlist' or (entry_url != url and is_collection_url(entry_url)):
+                    # 嵌套的播放列表（如频道的各个标签页）并行展开
+                    self._submit(parent_id, entry_url, ytdlp_path)
+                    continue
+
+                with self._lock:
+                    if entry_url in job['seen']:
+                        continue
+                    job['seen'].add(entry_url)
+                batch.append({'url': entry_url, 'title': entry.get('title'),
+                              'key': get_archive_key(entry_url, entry.get('ie_key'), entry.get('id'))})
+
+                if len(batch) >= self.BATCH_SIZE or time.monotonic() - last_flush >= self.BATCH_INTERVAL:
+                    flush()
+                    last_flush = time.monotonic()
+            flush()
+        except Exception as e:
+            flush()
+            job['error'] = str(e)
+        finally:
+            with self._lock:
+                job['pending'] -= 1
+                done = job['pending'] == 0
+                if done:
+                    del self._jobs[parent_id]
+            if done:
+                self.signal.call(on_done, parent_id, job['count'], job['error'])
+
+    def _iter_module(self, url):
+        """使用内置 yt_dlp 模块平铺提取，条目随分页逐步产出"""
+        opts = {
+            'extract_flat': 'in_playlist',
+            'lazy_playlist': True,
+            'skip_download': True,
+            'quiet': True,
+            'no_warnings': True,
+        }
+        import yt_dlp
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(url, download=False, process=False)
+            if not info:
+                return
+            if info.get('_type') in ('url', 'url_transparent') and info.get('url') != url:
+                # 重定向到其他地址（如频道主页 -> 视频标签页）
+                yield {'_type': 'playlist', 'url': info['url']}
+                return
+            for entry in info.get('entries') or []:
+                if entry:
+                    yield entry
+
+    def _iter_external(self, url, ytdlp_path):
+        """使用外部 yt-dlp 平铺提取，每个条目输出一行 JSON
+
+        进程由 reactor 启动和读取，输出行经队列交给展开线程解析；提前结束（取消或出错）时
+        结束整个进程组
+        """
+        cmd = [ytdlp_path, '--flat-playlist', '--lazy-playlist', '-j', '--no-warnings', url]
+        lines = queue.SimpleQueue()
+        # 行为 str，进程退出时放入 (returncode, error)
+        handle = self.reactor.spawn(cmd, lines.put, lambda returncode, error: lines.put((returncode, error)))
+        exited = None
+        error = None
+        try:
+            while exited is None:
+                line = lines.get()
+                if isinstance(line, tuple):
+                    exited = line
+                    continue
+                line = line.strip()
+                if line.startswith('{'):
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+                elif line.startswith('ERROR:'):
+                    error = line[len('ERROR:'):].strip()
+        finally:
+            if exited is None:
+                self.reactor.terminate(handle)
+        if exited[1] is not None:
+            raise exited[1]
+        if error:
+            raise Exception(error)
+
+    def shutdown(self):
+        with self._lock:
+            for job in self._jobs.values():
+                job['cancelled'] = True
+        self.executor.shutdown(wait=False)
+
+
+def get_info_filesize(info):
+    """从视频信息中取出所选格式的文件大小（字节），未知时返回 None"""
+    size = info.get('filesize') or info.get('filesize_approx')
+    if not size and info.get('requested_formats'):
+        sizes = [f.get('filesize') or f.get('filesize_approx') for f in info['requested_formats']]
+        if all(sizes):
+            size = sum(sizes)
+    return size
+
+
+class MetadataCache:
+    """视频信息缓存：按视频ID保存解析结果，过期后需要重新解析
+
+    解析结果中的媒体地址通常带签名和有效期，TTL 要比地址失效时间短
+    """
+
+    DEFAULT_TTL = 30 * 60  # 秒
+    CAPACITY = 2000
+
+    def __init__(self, ttl=DEFAULT_TTL, capacity=CAPACITY):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._entries = OrderedDict()  # 键 -> (过期时间, info)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, keys, info):
+        """同一个视频可能有多个键（原始地址的去重键和 extractor+id），都指向同一份信息"""
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key in keys:
+                self._entries[key] = (expires, info)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            for other in [k for k, (_, info) in self._entries.items() if info is entry[1]]:
+                del self._entries[other]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MetadataExtractor:
+    """解析阶段：在独立线程池中提前解析视频信息（标题、大小、时长、格式地址）
+
+    解析结果写入 MetadataCache，下载阶段直接使用，缓慢的解析请求不再占用下载槽位。
+    只解析即将派发的任务，并按站点统计进行中的解析数，由调用方套用单站点并发限制
+    """
+
+    def __init__(self, signal, cache, engine_pool, max_workers=8, metrics=None, tracer=None):
+        self.signal = signal
+        self.cache = cache
+        self.engine_pool = engine_pool
+        self.metrics = metrics
+        self.tracer = tracer or Tracer()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="extractor")
+        self._pending = set()
+        self._hosts = {}  # download_id -> 站点，排队或解析中的任务
+        self._lock = threading.Lock()
+
+    def extract(self, download_id, url, key, quality, ytdlp_path, on_done):
+        """解析 url，完成后在主线程调用 on_done(download_id, info, error)"""
+        with self._lock:
+            self._pending.add(download_id)
+            self._hosts[download_id] = DownloadScheduler.get_host(url)
+        self.executor.submit(self._run, download_id, url, key, quality, ytdlp_path, on_done)
+
+    def cancel(self, download_id):
+        with self._lock:
+            if download_id in self._pending:
+                self._pending.discard(download_id)
+                self._hosts.pop(download_id, None)
+
+    def active_on(self, host):
+        """该站点排队或进行中的解析数"""
+        with self._lock:
+            return sum(1 for other in self._hosts.values() if other == host)
+
+    def _run(self, download_id, url, key, quality, ytdlp_path, on_done):
+        with self._lock:
+            if download_id not in self._pending:
+                return
+            self._pending.discard(download_id)
+        try:
+            self._extract(download_id, url, key, quality, ytdlp_path, on_done)
+        finally:
+            with self._lock:
+                self._hosts.pop(download_id, None)
+
+    def _extract(self, download_id, url, key, quality, ytdlp_path, on_done):
+        info = self.cache.get(key)
+        error = None
+        if info is None:
+            try:
+                started = time.monotonic()
+                if ytdlp_path and os.path.exists(ytdlp_path):
+                    info = self._extract_external(url, quality, ytdlp_path)
+                else:
+                    info = self._extract_module(url, quality)
+                elapsed = time.monotonic() - started
+                self.tracer.record('extract.metadata', elapsed, download_id)
+                if self.metrics is not None:
+                    self.metrics.observe('extraction', elapsed)
+                if info.get('_type', 'video') == 'video':
+                    keys = [key]
+                    archive_key = get_archive_key(None, info.get('extractor_key'), info.get('id'))
+                    if archive_key and archive_key != key:
+                        keys.append(archive_key)
+                    self.cache.put(keys, info)
+                else:
+                    # 播放列表等不缓存，下载时按原地址处理
+                    info = None
+            except Exception as e:
+                error = str(e)
+        self.signal.call(on_done, download_id, info, error)
+
+    def _extract_module(self, url, quality):
+        """使用内置 yt_dlp 模块解析（复用引擎池中的实例）"""
+        opts = {
+            'format': get_format_selector(quality),
+            'noplaylist': True,
+            'skip_download': True,
+            'quiet': True,
+            'no_warnings': True,
+        }
+        with self.engine_pool.lease(opts, None) as (ydl, reused):
+            info = ydl.extract_info(url, download=False)
+            return ydl.sanitize_info(info)
+
+    def _extract_external(self, url, quality, ytdlp_path):
+        """使用外部 yt-dlp 解析，-j 输出一行 JSON"""
+        cmd = [ytdlp_path, '-j', '--no-playlist', '--no-warnings', '-f', get_format_selector(quality), url]
+        result = run_hidden_process(cmd, timeout=120)
+        for line in result.stdout.splitlines():
+            if line.startswith('{'):
+                return json.loads(line)
+        errors = [line[len('ERROR:'):].strip() for line in result.stderr.splitlines() if line.startswith('ERROR:')]
+        raise Exception(errors[-1] if errors else f"yt-dlp 退出代码 {result.returncode}")
+
+    def shutdown(self):
+        with self._lock:
+            self._pending.clear()
+            self._hosts.clear()
+        self.executor.shutdown(wait=False)
+
+
+class DownloadEngine:
+    """下载引擎：调度器、下载线程、视频信息解析、播放列表展开、限速和下载存档，不依赖界面
+
+    前端（Tk 界面或无界面模式）通过 DownloadSignal 接收工作线程的事件，并在自己的主线程中调用引擎
+    """
+
+    def __init__(self, signal, max_concurrent=3, per_host_limit=2, global_rate=0, postprocess_workers=0):
+        self.signal = signal
+        self.scheduler = DownloadScheduler(max_concurrent, per_host_limit)
+        self.postprocess_stage = PostprocessStage(postprocess_workers)
+        self.reactor = ProcessReactor()
+        self.process_pool = None  # 启用多进程下载时的 DownloadProcessPool
+        self.engine_pool = YoutubeDLPool()
+        self.metrics = DownloadMetrics()
+        self.tracer = Tracer()
+        self.metadata_cache = MetadataCache()
+        self.metadata_extractor = MetadataExtractor(signal, self.metadata_cache, self.engine_pool,
+                                                    metrics=self.metrics, tracer=self.tracer)
+        self.expander = PlaylistExpander(signal, reactor=self.reactor)
+        self.limiter = BandwidthLimiter(global_rate)
+        self.retry_policy = RetryPolicy()
+        self.workers = {}
+        try:
+            self.archive = DownloadArchive(os.path.join(get_app_data_dir(), "archive.txt"))
+        except OSError:
+            self.archive = None
+
+    def start_worker(self, download_id, url, quality, download_dir, ytdlp_path='', ffmpeg_path='',
+                     use_archive=True, connections=1, rate_limit=0, info=None):
+        """创建并启动下载线程"""
+        worker = DownloadWorker(
+            url,
+            download_dir,
+            quality,
+            self.signal,
+            download_id,
+            ytdlp_path,
+            ffmpeg_path,
+            self.archive.path if self.archive is not None and use_archive else None,
+            connections,
+            self.engine_pool,
+            info,
+            self.limiter,
+            self.metrics,
+            self.postprocess_stage,
+            self.reactor,
+            self.process_pool,
+            self.tracer
+        )
+        self.limiter.register(download_id, rate_limit)
+        self.workers[download_id] = worker
+        worker.start()
+        return worker
+
+    def worker_done(self, download_id, success=False, key=None):
+        """下载线程结束（完成、失败或被暂停/停止）后释放槽位和限速配额，返回该线程"""
+        worker = self.workers.pop(download_id, None)
+        self.release_slot(download_id)
+        if success and self.archive is not None:
+            # 读取 yt-dlp 新写入的存档记录
+            self.archive.refresh()
+        if worker is not None and worker.info_stale and key:
+            # 缓存的媒体地址已失效，下次重新解析
+            self.metadata_cache.invalidate(key)
+        return worker
+
+    def retry_later(self, download_id, url, message, attempt, priority=0, extractor=None):
+        """按错误类型决定是否自动重试，需要时延迟加入调度队列（调用前应已释放该任务的槽位）
+
+        返回 (错误类型, 等待秒数)，不重试时等待秒数为 None。站点限流时该站点整体冷却
+        """
+        kind = classify_error(message)
+        delay = self.retry_policy.delay(kind, attempt)
+        if delay is None:
+            return kind, None
+        if kind == 'rate_limited':
+            self.scheduler.cool_down(DownloadScheduler.get_host(url), delay)
+        self.scheduler.submit(download_id, url, priority, delay)
+        self.metrics.count('retries', extractor)
+        return kind, delay
+
+    def set_process_workers(self, workers):
+        """启用（workers 为进程数，None 表示 CPU 核数）或关闭（0）多进程下载，只影响之后开始的任务"""
+        if workers == 0:
+            if self.process_pool is not None:
+                self.process_pool.close()
+                self.process_pool = None
+        elif self.process_pool is None:
+            self.process_pool = DownloadProcessPool(workers or 0)
+
+    def release_slot(self, download_id):
+        """下载阶段结束（进入后处理或线程退出）时释放下载槽位和限速配额，返回是否释放了槽位"""
+        self.limiter.unregister(download_id)
+        return self.scheduler.release(download_id)
+
+    def close(self):
+        self.expander.shutdown()
+        self.metadata_extractor.shutdown()
+        self.engine_pool.close()
+        self.reactor.close()
+        if self.process_pool is not None:
+            self.process_pool.close()
+
+
+class ControlServer:
+    """本地 HTTP/JSON 控制接口，asyncio 服务器运行在独立线程中
+
+    GET  /jobs, /jobs/<id>       查询任务（读取服务器线程内的状态镜像，不访问界面线程）
+    POST /jobs                   批量添加：{"urls": [...], "quality": "720p", "start": true}，请求体不超过 MAX_BODY
+    POST /jobs/<id>/<action>     pause / resume / cancel，<id> 为 all 时作用于全部任务
+    GET  /events                 Server-Sent Events：先推送快照，之后推送任务变化和进度
+    GET  /metrics                Prometheus 文本格式的下载指标
+
+    每个请求都要带 Authorization: Bearer <令牌> 或 X-Api-Token: <令牌>；Host 必须是本机地址，
+    带 Origin 时必须是本接口自己，POST 请求体只接受 application/json。网页无法读到令牌，
+    跨站表单和 DNS 重绑定都无法操作任务。校验通过之前不读取请求体
+
+    前端在主线程中用 publish() 记录变化，每个刷新周期 flush() 一次，批量推送给所有订阅者；
+    添加和控制请求通过 schedule(func) 交给前端主线程执行
+    """
+
+    ACTIONS = ('pause', 'resume', 'cancel')
+    MAX_BODY = 16 * 1024  # 字节，约一两百个地址；更多地址分多次提交
+    MAX_HEADERS = 64
+    SUBSCRIBER_BACKLOG = 256  # 批次数，订阅者跟不上时断开，重连后重新获取快照
+    KEEPALIVE = 15  # 秒
+    COMMAND_TIMEOUT = 60  # 秒
+    LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+    def __init__(self, schedule, submit, control, host='127.0.0.1', port=8765, metrics=None, token=None):
+        self.schedule = schedule
+        self.submit = submit  # submit(payload) -> dict
+        self.control = control  # control(download_id, action) -> 受影响的任务数
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.token = token or secrets.token_urlsafe(24)
+        self.jobs = {}  # 状态镜像，只在服务器线程中修改
+        self.subscribers = set()
+        self._pending = []
+        self.loop = None
+        self.server = None
+
+    def start(self):
+        """绑定端口（失败时抛出 OSError）并在后台线程中运行事件循环"""
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, self.host, self.port))
+        self.port = self.server.sockets[0].getsockname()[1]
+        threading.Thread(target=self.loop.run_forever, name="control-server", daemon=True).start()
 
     def stop(self):
-        self._is_running = False
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def publish(self, event, download_id, **fields):
+        """记录一条任务变化（前端主线程调用）"""
+        fields['event'] = event
+        fields['id'] = download_id
+        self._pending.append(fields)
+
+    def flush(self):
+        """把积压的变化一次性交给服务器线程（前端主线程每个刷新周期调用）"""
+        if self._pending and self.loop is not None:
+            events, self._pending = self._pending, []
+            self.loop.call_soon_threadsafe(self._broadcast, events)
+
+    @staticmethod
+    def format_event(name, data):
+        return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n".encode('utf-8')
+
+    def _broadcast(self, events):
+        for event in events:
+            download_id = event['id']
+            if event['event'] == 'removed':
+                self.jobs.pop(download_id, None)
+            else:
+                job = self.jobs.setdefault(download_id, {'id': download_id})
+                job.update((key, value) for key, value in event.items() if key not in ('event', 'id'))
+
+        # 每批只序列化一次，所有订阅者共用
+        chunk = b''.join(self.format_event(event['event'], event) for event in events)
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.put_nowait(chunk)
+            except asyncio.QueueFull:
+                # 跟不上的订阅者断开，避免积压占用内存
+                self.subscribers.discard(subscriber)
+                while not subscriber.empty():
+                    subscriber.get_nowait()
+                subscriber.put_nowait(None)
+
+    async def call_frontend(self, func, *args):
+        """在前端主线程中执行 func(*args) 并等待结果"""
+        future = Future()
+
+        def run():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args))
+                except Exception as e:
+                    future.set_exception(e)
+
+        self.schedule(run)
+        return await asyncio.wait_for(asyncio.wrap_future(future), self.COMMAND_TIMEOUT)
+
+    def check_request(self, headers):
+        """校验 Host、Origin 和令牌，通过时返回 None，否则返回 (状态码, 错误信息)"""
+        try:
+            # 按 URL 的规则解析，[::1]:8765 这样的 IPv6 地址也能正确分出端口
+            host = urlsplit('//' + headers.get('host', ''))
+            host_ok = host.hostname in self.LOCAL_HOSTS and host.port in (None, self.port)
+        except ValueError:
+            host_ok = False
+        if not host_ok:
+            return 403, "不允许的 Host"
+        origin = headers.get('origin')
+        if origin is not None:
+            try:
+                origin = urlsplit(origin)
+                origin_ok = origin.scheme == 'http' and origin.hostname in self.LOCAL_HOSTS and \
+                    (origin.port or 80) == self.port
+            except ValueError:
+                origin_ok = False
+            if not origin_ok:
+                return 403, "不允许的 Origin"
+        token = headers.get('x-api-token', '')
+        scheme, _, credentials = headers.get('authorization', '').partition(' ')
+        if scheme.lower() == 'bearer':
+            token = credentials.strip()
+        if not hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8')):
+            return 401, "缺少或错误的令牌"
+        return None
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                if len(headers) >= self.MAX_HEADERS:
+                    raise ValueError("请求头过多")
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            # 先校验来源和令牌，通过后才读取请求体，且请求体有大小上限
+            rejected = self.check_request(headers)
+            if rejected is not None:
+                await self.send_json(writer, rejected[0], {'error': rejected[1]})
+                return
+            length = int(headers.get('content-length') or 0)
+            if length < 0:
+                raise ValueError("无效的 Content-Length")
+            if length > self.MAX_BODY:
+                await self.send_json(writer, 413, {'error': f"请求体超过 {self.MAX_BODY} 字节"})
+                return
+            body = await reader.readexactly(length) if length else b''
+
+            path = urlparse(target).path.rstrip('/') or '/'
+            if method == 'GET' and path == '/events':
+                await self.stream_events(writer)
+                return
+            if method == 'GET' and path == '/metrics' and self.metrics is not None:
+                await self.send_response(writer, 200, self.metrics.render_prometheus().encode('utf-8'),
+                                         "text/plain; version=0.0.4; charset=utf-8")
+                return
+            status, payload = await self.route(method, path, headers.get('content-type', ''), body)
+            await self.send_json(writer, status, payload)
+        except (ValueError, asyncio.IncompleteReadError):
+            with contextlib.suppress(ConnectionError):
+                await self.send_json(writer, 400, {'error': "无效的请求"})
+        except asyncio.TimeoutError:
+            with contextlib.suppress(ConnectionError):
+                await self.send_json(writer, 504, {'error': "界面线程无响应"})
+        except ConnectionError:
+            pass
+        except Exception as e:
+            # 前端执行命令时出错等：总要给客户端一个响应
+            logging.getLogger("ytdlp-gui").exception("控制接口处理请求失败")
+            with contextlib.suppress(ConnectionError):
+                await self.send_json(writer, 500, {'error': f"处理请求失败: {e}"})
+        finally:
+            writer.close()
+
+    async def route(self, method, path, content_type, body):
+        parts = path.strip('/').split('/')
+        if parts[0] != 'jobs':
+            return 404, {'error': "未知的地址"}
+
+        if method == 'GET' and len(parts) == 1:
+            return 200, {'jobs': list(self.jobs.values())}
+        if method == 'GET' and len(parts) == 2:
+            job = self.jobs.get(parts[1])
+            return (200, job) if job is not None else (404, {'error': "任务不存在"})
+
+        if method == 'POST' and body and content_type.split(';')[0].strip().lower() != 'application/json':
+            # 网页不经预检就能跨站提交 text/plain 和表单，只接受 JSON
+            return 415, {'error': "请求体必须是 application/json"}
+
+        if method == 'POST' and len(parts) == 1:
+            payload = json.loads(body.decode('utf-8') or '{}')
+            urls = payload.get('urls') if isinstance(payload, dict) else None
+            if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+                return 400, {'error': "urls 必须是字符串列表"}
+            payload['urls'] = [url.strip() for url in urls if url.strip()]
+            return 200, await self.call_frontend(self.submit, payload)
+
+        if method == 'POST' and len(parts) == 3 and parts[2] in self.ACTIONS:
+            count = await self.call_frontend(self.control, parts[1], parts[2])
+            return (200, {'affected': count}) if count else (404, {'error': "任务不存在"})
+
+        return 405, {'error': "不支持的请求"}
+
+    async def send_json(self, writer, status, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        await self.send_response(writer, status, body, "application/json; charset=utf-8")
+
+    async def send_response(self, writer, status, body, content_type):
+        writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+
+    async def stream_events(self, writer):
+        subscriber = asyncio.Queue(self.SUBSCRIBER_BACKLOG)
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: text/event-stream; charset=utf-8\r\n"
+                     b"Cache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+        writer.write(self.format_event('snapshot', {'jobs': list(self.jobs.values())}))
+        self.subscribers.add(subscriber)
+        try:
+            await writer.drain()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(subscriber.get(), self.KEEPALIVE)
+                except asyncio.TimeoutError:
+                    chunk = b": keepalive\n\n"
+                if chunk is None:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            self.subscribers.discard(subscriber)
 
 
 class VideoDownloaderApp:
-    def __init__(self):
-        self.download_workers = {}
+    UI_TICK_MS = 100  # 界面批量刷新间隔
+    PREFETCH_LOOKAHEAD = 4  # 提前解析调度队列最前面的几个任务，解析结果在缓存过期前就会用到
+    LOG_CAPACITY = 5000  # 界面日志缓冲区容量，完整日志写入磁盘
+    LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+    LOG_FILE_BACKUPS = 5
+    STATS_REFRESH_MS = 1000
+    ADD_CHUNK_SIZE = 500  # 批量添加时每批的 URL 数
+    LOG_FILTER_MAX_ITEMS = 1000  # 日志筛选下拉框最多列出的任务数
+
+    def __init__(self, api_port=0, api_token=None):
+        import_tkinter()
         self.download_items = {}
+        self.paused_count = 0  # 随状态变化增减，不必每次遍历全部下载项
+        self.paused_count_shown = 0
+        self.prefetch_dirty = False
+        self.control_server = None
+        self.id_counter = itertools.count()
+        self.queued_keys = {}  # 去重键 -> download_id
+        self.download_signal = DownloadSignal(self)
+        self.engine = DownloadEngine(self.download_signal)
+        self.profiler = SamplingProfiler()
+        try:
+            self.journal = QueueJournal(os.path.join(get_app_data_dir(), "queue.jsonl"))
+        except OSError:
+            self.journal = None
+        try:
+            tools_cache = os.path.join(get_app_data_dir(), "tools.json")
+        except OSError:
+            tools_cache = os.devnull
+        self.tool_discovery = ToolDiscovery(tools_cache, os.path.dirname(os.path.abspath(__file__)))
         self.setup_gui()
-        self.auto_find_ffmpeg()
-        self.auto_find_ytdlp()
+        self.restore_queue()
+        self.start_tool_discovery()
+        if api_port:
+            self.start_control_server(api_port, api_token)
 
     def setup_gui(self):
         # 创建主窗口
@@ -402,6 +3496,73 @@ class VideoDownloaderApp:
                                foreground="gray", font=("Arial", 8))
         help_label.grid(row=1, column=1, columnspan=3, sticky=tk.W, pady=(0, 2))
 
+        # 并发设置框架
+        concurrency_frame = ttk.Frame(download_frame)
+        concurrency_frame.grid(row=2, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=2)
+
+        ttk.Label(concurrency_frame, text="最大同时下载:").pack(side=tk.LEFT)
+        self.max_concurrent = tk.IntVar(value=self.engine.scheduler.max_concurrent)
+        ttk.Spinbox(concurrency_frame, from_=1, to=64, width=5,
+                    textvariable=self.max_concurrent).pack(side=tk.LEFT, padx=(5, 15))
+
+        ttk.Label(concurrency_frame, text="单站点并发 (0=不限):").pack(side=tk.LEFT)
+        self.per_host_limit = tk.IntVar(value=self.engine.scheduler.per_host_limit)
+        ttk.Spinbox(concurrency_frame, from_=0, to=64, width=5,
+                    textvariable=self.per_host_limit).pack(side=tk.LEFT, padx=(5, 0))
+
+        ttk.Label(concurrency_frame, text="后处理并发:").pack(side=tk.LEFT, padx=(15, 0))
+        self.postprocess_workers = tk.IntVar(value=self.engine.postprocess_stage.max_workers)
+        ttk.Spinbox(concurrency_frame, from_=1, to=64, width=4,
+                    textvariable=self.postprocess_workers).pack(side=tk.LEFT, padx=(5, 0))
+
+        ttk.Label(concurrency_frame, text="分段连接数 (1=关闭):").pack(side=tk.LEFT, padx=(15, 0))
+        self.connections = tk.IntVar(value=1)
+        ttk.Spinbox(concurrency_frame, from_=1, to=16, width=4,
+                    textvariable=self.connections).pack(side=tk.LEFT, padx=(5, 0))
+
+        self.use_archive = tk.BooleanVar(value=self.engine.archive is not None)
+        ttk.Checkbutton(concurrency_frame, text="跳过已下载",
+                        variable=self.use_archive).pack(side=tk.LEFT, padx=(15, 0))
+
+        self.expand_playlists = tk.BooleanVar(value=True)
+        ttk.Checkbutton(concurrency_frame, text="展开播放列表/频道",
+                        variable=self.expand_playlists).pack(side=tk.LEFT, padx=(15, 0))
+
+        # 内置模块的下载放到子进程中执行，界面不再与解析争用 GIL
+        self.use_processes = tk.BooleanVar(value=False)
+        ttk.Checkbutton(concurrency_frame, text="多进程下载", variable=self.use_processes,
+                        command=self.on_process_mode_changed).pack(side=tk.LEFT, padx=(15, 0))
+
+        # 性能诊断：各阶段耗时追踪、所有线程的采样分析，关闭时导出
+        self.tracing = tk.BooleanVar(value=False)
+        ttk.Checkbutton(concurrency_frame, text="性能追踪", variable=self.tracing,
+                        command=self.on_tracing_changed).pack(side=tk.LEFT, padx=(15, 0))
+        self.profiling = tk.BooleanVar(value=False)
+        ttk.Checkbutton(concurrency_frame, text="采样分析", variable=self.profiling,
+                        command=self.on_profiling_changed).pack(side=tk.LEFT, padx=(15, 0))
+
+        self.max_concurrent.trace_add('write', self.on_concurrency_changed)
+        self.per_host_limit.trace_add('write', self.on_concurrency_changed)
+        self.postprocess_workers.trace_add('write', self.on_concurrency_changed)
+
+        # 限速设置（内置模块运行中修改立即生效；外部 yt-dlp 的 --limit-rate 在启动时确定）
+        rate_frame = ttk.Frame(download_frame)
+        rate_frame.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=2)
+
+        ttk.Label(rate_frame, text="总限速 KB/s (0=不限):").pack(side=tk.LEFT)
+        self.global_rate_limit = tk.IntVar(value=0)
+        ttk.Spinbox(rate_frame, from_=0, to=10000000, increment=100, width=8,
+                    textvariable=self.global_rate_limit).pack(side=tk.LEFT, padx=(5, 15))
+        ttk.Label(rate_frame, text="单个任务限速可在下载队列右键菜单中设置；外部 yt-dlp 下载中的任务在下次开始时生效",
+                  foreground="gray", font=("Arial", 8)).pack(side=tk.LEFT)
+        self.global_rate_limit.trace_add('write', self.on_rate_limit_changed)
+
+        # 停止（不是暂停）任务后 .part/.ytdl/分片文件的处理方式
+        ttk.Label(rate_frame, text="停止后临时文件:").pack(side=tk.LEFT, padx=(15, 0))
+        self.cancel_cleanup = tk.StringVar(value=CANCEL_CLEANUP_POLICIES['keep'])
+        ttk.Combobox(rate_frame, textvariable=self.cancel_cleanup, state='readonly', width=12,
+                     values=list(CANCEL_CLEANUP_POLICIES.values())).pack(side=tk.LEFT, padx=(5, 0))
+
         # URL 输入框架
         url_frame = ttk.Frame(main_frame)
         url_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 10))
@@ -426,26 +3587,50 @@ class VideoDownloaderApp:
         main_frame.rowconfigure(3, weight=1)
 
         # 创建树形视图显示下载队列
-        columns = ("url", "progress", "status", "actions")
+        columns = ("url", "size", "duration", "progress", "status", "retries", "actions")
         self.download_tree = ttk.Treeview(list_frame, columns=columns, show="headings", height=8)
 
         # 设置列
-        self.download_tree.heading("url", text="URL")
+        self.download_tree.heading("url", text="标题/URL")
+        self.download_tree.heading("size", text="大小")
+        self.download_tree.heading("duration", text="时长")
         self.download_tree.heading("progress", text="进度")
         self.download_tree.heading("status", text="状态")
+        self.download_tree.heading("retries", text="重试")
         self.download_tree.heading("actions", text="操作")
 
         self.download_tree.column("url", width=300)
+        self.download_tree.column("size", width=80)
+        self.download_tree.column("duration", width=70)
         self.download_tree.column("progress", width=150)
         self.download_tree.column("status", width=100)
+        self.download_tree.column("retries", width=50, anchor=tk.CENTER)
         self.download_tree.column("actions", width=150)
 
         self.download_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
 
-        # 添加滚动条
-        tree_scroll = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.download_tree.yview)
-        tree_scroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        self.download_tree.configure(yscrollcommand=tree_scroll.set)
+        # 队列数据只保存在 download_items 中，树形视图只保留可见的几行，
+        # 滚动时把这几行换成对应窗口的内容
+        self.queue_order = []  # 按加入顺序排列的 download_id
+        self.queue_order_stale = False
+        self.queue_rows = []  # 可见行的 item id
+        self.queue_row_values = []  # 每个可见行上次写入的内容，未变化时不重绘
+        self.queue_selection = set()
+        self.queue_applied_selection = ()
+        self.queue_offset = 0
+        self.queue_dirty = False
+
+        self.tree_scroll = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.on_queue_scroll)
+        self.tree_scroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.download_tree.bind('<Configure>', lambda event: self.render_queue_view())
+        self.download_tree.bind('<<TreeviewSelect>>', self.on_queue_select)
+        self.download_tree.bind('<MouseWheel>', self.on_queue_mousewheel)
+        self.download_tree.bind('<Button-4>', lambda event: self.scroll_queue(-3) or "break")
+        self.download_tree.bind('<Button-5>', lambda event: self.scroll_queue(3) or "break")
+
+        # 暂停的任务用不同颜色单独标示
+        self.download_tree.tag_configure('paused', background='#fff4d6')
+        self.setup_tree_context_menu()
 
         # 控制按钮框架
         control_frame = ttk.Frame(list_frame)
@@ -453,8 +3638,12 @@ class VideoDownloaderApp:
 
         ttk.Button(control_frame, text="开始全部", command=self.start_all_downloads).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(control_frame, text="暂停全部", command=self.pause_all_downloads).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(control_frame, text="继续全部", command=self.resume_all_downloads).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(control_frame, text="清除已完成", command=self.clear_completed).pack(side=tk.LEFT)
 
+        self.paused_label = ttk.Label(control_frame, text="", foreground="#b8860b")
+        self.paused_label.pack(side=tk.RIGHT)
+
         # 日志框架
         log_frame = ttk.LabelFrame(main_frame, text="下载日志", padding="5")
         log_frame.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
@@ -462,11 +3651,49 @@ class VideoDownloaderApp:
         log_frame.rowconfigure(0, weight=1)
         main_frame.rowconfigure(4, weight=1)
 
-        self.log_text = scrolledtext.ScrolledText(log_frame, height=10)
-        self.log_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-
-        # 创建信号对象
-        self.download_signal = DownloadSignal(self)
+        # 日志筛选
+        filter_frame = ttk.Frame(log_frame)
+        filter_frame.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 2))
+        ttk.Label(filter_frame, text="筛选:").pack(side=tk.LEFT)
+        self.log_filter = tk.StringVar(value="全部")
+        self.log_filter_choices = {"全部": None, "系统": "system"}
+        self.log_filter_combo = ttk.Combobox(filter_frame, textvariable=self.log_filter, state='readonly',
+                                             width=60, postcommand=self.refresh_log_filter_choices)
+        self.log_filter_combo.pack(side=tk.LEFT, padx=(5, 0))
+        self.log_filter_combo.bind('<<ComboboxSelected>>', self.on_log_filter_selected)
+
+        # 日志只保存在环形缓冲区中，文本框只渲染可见的几行
+        log_frame.rowconfigure(0, weight=0)
+        log_frame.rowconfigure(1, weight=1)
+        self.log_buffer = LogRingBuffer(self.LOG_CAPACITY)
+        self.log_view_id = None
+        self.log_offset = 0
+        self.log_follow = True
+        self.log_dirty = False
+
+        self.log_text = tk.Text(log_frame, height=10, wrap=tk.NONE, state='disabled')
+        self.log_text.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.log_scroll = ttk.Scrollbar(log_frame, orient=tk.VERTICAL, command=self.on_log_scroll)
+        self.log_scroll.grid(row=1, column=1, sticky=(tk.N, tk.S))
+        self.log_line_height = tkfont.Font(font=self.log_text.cget('font')).metrics('linespace')
+
+        self.log_text.bind('<Configure>', lambda event: self.render_log_view())
+        self.log_text.bind('<MouseWheel>', self.on_log_mousewheel)
+        self.log_text.bind('<Button-4>', lambda event: self.scroll_log(-3))
+        self.log_text.bind('<Button-5>', lambda event: self.scroll_log(3))
+
+        self.file_logger = self.setup_file_logger()
+
+        # 统计面板（滚动窗口，每秒刷新）
+        stats_frame = ttk.LabelFrame(main_frame, text="统计", padding="5")
+        stats_frame.grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E))
+        self.stats_label = ttk.Label(stats_frame, text="", justify=tk.LEFT)
+        self.stats_label.pack(side=tk.LEFT)
+        self.root.after(self.STATS_REFRESH_MS, self.refresh_stats)
+
+        # 启动界面事件处理循环
+        self.root.after(self.UI_TICK_MS, self.process_ui_events)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def on_quality_selected(self, event):
         """画质选择变化事件"""
@@ -478,6 +3705,101 @@ class VideoDownloaderApp:
             self.custom_quality_entry.config(state='disabled')
             self.custom_quality.set("")
 
+    def on_concurrency_changed(self, *args):
+        """并发设置变化事件，调高上限后立即派发排队中的任务"""
+        try:
+            self.engine.scheduler.max_concurrent = max(1, int(self.max_concurrent.get()))
+            self.engine.scheduler.per_host_limit = max(0, int(self.per_host_limit.get()))
+            self.engine.postprocess_stage.set_max_workers(int(self.postprocess_workers.get()))
+        except (tk.TclError, ValueError):
+            return
+        self.dispatch_downloads()
+
+    def on_process_mode_changed(self):
+        """切换多进程下载，之后开始的任务生效"""
+        self.engine.set_process_workers(None if self.use_processes.get() else 0)
+        self.add_log("system", "多进程下载: " + (f"已启用 ({self.engine.process_pool.max_workers} 个进程)"
+                                            if self.engine.process_pool is not None else "已关闭"))
+
+    def on_tracing_changed(self):
+        """开始追踪；停止时导出为 Chrome trace JSON 或 CSV"""
+        tracer = self.engine.tracer
+        if self.tracing.get():
+            tracer.start()
+            self.add_log("system", "性能追踪已开始")
+            return
+        count = tracer.stop()
+        file_path = filedialog.asksaveasfilename(
+            title="导出性能追踪", defaultextension=".json", initialfile="ytdlp-gui-trace.json",
+            filetypes=[("Chrome trace (chrome://tracing, Perfetto)", "*.json"), ("CSV", "*.csv")])
+        if not file_path:
+            self.add_log("system", f"性能追踪已停止，{count} 个区间未导出")
+            return
+        try:
+            tracer.export(file_path)
+            self.add_log("system", f"性能追踪已导出 {count} 个区间: {file_path}")
+        except OSError as e:
+            messagebox.showerror("错误", f"导出失败: {e}")
+
+    def on_profiling_changed(self):
+        """开始采样分析；停止时在日志中列出热点函数，并可导出折叠栈"""
+        if self.profiling.get():
+            self.profiler.start()
+            self.add_log("system", "采样分析已开始")
+            return
+        samples = self.profiler.stop()
+        hotspots = ", ".join(f"{name} {share:.0%}" for name, share in self.profiler.hotspots())
+        self.add_log("system", f"采样分析已停止，共 {samples} 次采样" + (f"，热点: {hotspots}" if hotspots else ""))
+        file_path = filedialog.asksaveasfilename(
+            title="导出采样结果", defaultextension=".txt", initialfile="ytdlp-gui-profile.txt",
+            filetypes=[("折叠栈 (flamegraph.pl, speedscope)", "*.txt")])
+        if file_path:
+            try:
+                self.profiler.export(file_path)
+                self.add_log("system", f"采样结果已导出: {file_path}")
+            except OSError as e:
+                messagebox.showerror("错误", f"导出失败: {e}")
+
+    def on_rate_limit_changed(self, *args):
+        """总限速变化事件，正在下载的任务按新速率分配带宽"""
+        try:
+            rate = max(0, int(self.global_rate_limit.get())) * 1024
+        except (tk.TclError, ValueError):
+            return
+        self.engine.limiter.set_global_rate(rate)
+
+    def set_rate_limit(self, download_id, rate):
+        """设置单个任务的限速（字节/秒，0 表示不限速）
+
+        内置模块和下载进程中的任务立即生效；外部 yt-dlp 的 --limit-rate 启动后不能修改，下次开始时生效
+        """
+        item_info = self.download_items.get(download_id)
+        if item_info is None:
+            return
+        item_info['rate_limit'] = rate
+        self.engine.limiter.set_job_rate(download_id, rate)
+        if self.journal is not None:
+            self.journal.update(download_id, rate_limit=rate)
+        self.add_log(download_id, f"单任务限速: {format_speed(rate)}" if rate else "单任务限速: 不限")
+
+    def ask_rate_limit(self):
+        """为选中的下载项设置限速"""
+        selected = [download_id for download_id in self.queue_selection if download_id in self.download_items]
+        if not selected:
+            return
+        current = self.download_items[selected[0]].get('rate_limit', 0)
+        value = simpledialog.askinteger("设置限速", "单个任务限速 KB/s (0=不限):", parent=self.root,
+                                        initialvalue=current // 1024, minvalue=0)
+        if value is not None:
+            self.apply_to_selected(lambda download_id: self.set_rate_limit(download_id, value * 1024))
+
+    def get_connections(self):
+        """获取分段下载连接数"""
+        try:
+            return min(16, max(1, int(self.connections.get())))
+        except (tk.TclError, ValueError):
+            return 1
+
     def get_selected_quality(self):
         """获取选择的画质"""
         selected = self.quality.get()
@@ -497,6 +3819,41 @@ class VideoDownloaderApp:
         # 绑定右键事件
         self.url_text.bind("<Button-3>", self.show_url_context_menu)
 
+    def setup_tree_context_menu(self):
+        """设置下载队列的右键菜单"""
+        self.tree_context_menu = tk.Menu(self.download_tree, tearoff=0)
+        self.tree_context_menu.add_command(label="开始/继续", command=lambda: self.apply_to_selected(self.start_download))
+        self.tree_context_menu.add_command(label="暂停", command=lambda: self.apply_to_selected(self.pause_download))
+        self.tree_context_menu.add_command(label="停止", command=lambda: self.apply_to_selected(self.stop_download))
+        self.tree_context_menu.add_separator()
+        self.tree_context_menu.add_command(label="设置限速...", command=self.ask_rate_limit)
+        self.tree_context_menu.add_separator()
+        self.tree_context_menu.add_command(label="全选", command=self.select_all_queue)
+
+        self.download_tree.bind("<Button-3>", self.show_tree_context_menu)
+
+    def show_tree_context_menu(self, event):
+        """显示下载队列的右键菜单"""
+        row = self.download_tree.identify_row(event.y)
+        if row and row not in self.download_tree.selection():
+            self.queue_selection = {self.queue_order[self.queue_offset + self.queue_rows.index(row)]}
+            self.render_queue_view()
+        try:
+            self.tree_context_menu.tk_popup(event.x_root, event.y_root)
+        finally:
+            self.tree_context_menu.grab_release()
+
+    def apply_to_selected(self, action):
+        """对队列中选中的下载项执行操作"""
+        for download_id in list(self.download_items):
+            if download_id in self.queue_selection:
+                action(download_id)
+
+    def select_all_queue(self):
+        """选中队列中的全部下载项（包括不在可见窗口内的）"""
+        self.queue_selection = set(self.download_items)
+        self.render_queue_view()
+
     def show_url_context_menu(self, event):
         """显示URL输入框的右键菜单"""
         try:
@@ -537,96 +3894,40 @@ class VideoDownloaderApp:
         self.url_text.mark_set(tk.INSERT, "1.0")
         self.url_text.see(tk.INSERT)
 
-    def auto_find_ffmpeg(self):
-        """自动查找FFmpeg可执行文件"""
-        if sys.platform == "win32":
-            # Windows平台下的常见FFmpeg安装位置
-            possible_paths = [
-                # 当前目录
-                "ffmpeg.exe",
-                # 程序所在目录
-                os.path.join(os.path.dirname(os.path.abspath(__file__)), "ffmpeg.exe"),
-                # PATH环境变量
-                *[os.path.join(path, "ffmpeg.exe") for path in os.environ.get("PATH", "").split(os.pathsep) if path],
-                # 常见安装目录
-                "C:\\ffmpeg\\bin\\ffmpeg.exe",
-                "C:\\Program Files\\ffmpeg\\bin\\ffmpeg.exe",
-                "C:\\Program Files (x86)\\ffmpeg\\bin\\ffmpeg.exe",
-                os.path.expanduser("~\\ffmpeg\\bin\\ffmpeg.exe"),
-            ]
-
-            # 递归搜索当前目录和子目录
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            for root, dirs, files in os.walk(current_dir):
-                if "ffmpeg.exe" in files:
-                    possible_paths.append(os.path.join(root, "ffmpeg.exe"))
-
-            # 检查每个可能的路径
-            for path in possible_paths:
-                if os.path.exists(path):
-                    try:
-                        # 验证是否是有效的FFmpeg可执行文件
-                        result = subprocess.run([path, '-version'],
-                                                capture_output=True, text=True, timeout=5)
-                        if result.returncode == 0 and "ffmpeg version" in result.stdout:
-                            self.ffmpeg_path.set(path)
-                            self.add_log("system", f"自动找到 FFmpeg: {path}")
-                            return
-                    except (subprocess.SubprocessError, OSError):
-                        continue
+    def start_tool_discovery(self):
+        """查找 FFmpeg / yt-dlp：缓存有效时直接使用，否则在后台线程中查找"""
+        if sys.platform != "win32":
+            return
 
+        pending = []
+        for name in ('ffmpeg', 'yt-dlp'):
+            hit, path = self.tool_discovery.cached(name)
+            if hit:
+                self.on_tool_found(name, path, True)
+            else:
+                pending.append(name)
+
+        if pending:
+            threading.Thread(target=self.discover_tools, args=(pending,), daemon=True).start()
+
+    def discover_tools(self, names):
+        """后台线程：探测工具路径，结果通过界面事件队列回传"""
+        for name in names:
+            path = self.tool_discovery.discover(name)
+            self.download_signal.call(self.on_tool_found, name, path, False)
+
+    def on_tool_found(self, name, path, cached):
+        """工具查找结果（主线程）"""
+        variable = self.ffmpeg_path if name == 'ffmpeg' else self.ytdlp_path
+        label = "FFmpeg" if name == 'ffmpeg' else "yt-dlp"
+        if path:
+            # 用户已经手动填写的路径不覆盖
+            if not variable.get().strip():
+                variable.set(path)
+                self.add_log("system", f"自动找到 {label}: {path}" + (" (缓存)" if cached else ""))
+        elif name == 'ffmpeg':
             self.add_log("system", "未找到 FFmpeg，请手动设置路径")
-
-    def auto_find_ytdlp(self):
-        """自动查找 yt-dlp 可执行文件"""
-        if sys.platform == "win32":
-            # Windows平台下的常见yt-dlp安装位置
-            possible_paths = [
-                # 当前目录
-                "yt-dlp.exe",
-                "yt-dlp",
-                # 程序所在目录
-                os.path.join(os.path.dirname(os.path.abspath(__file__)), "yt-dlp.exe"),
-                os.path.join(os.path.dirname(os.path.abspath(__file__)), "yt-dlp"),
-                # PATH环境变量
-                *[os.path.join(path, "yt-dlp.exe") for path in os.environ.get("PATH", "").split(os.pathsep) if path],
-                *[os.path.join(path, "yt-dlp") for path in os.environ.get("PATH", "").split(os.pathsep) if path],
-                # 常见安装目录
-                "C:\\yt-dlp\\yt-dlp.exe",
-                os.path.expanduser("~\\yt-dlp\\yt-dlp.exe"),
-            ]
-
-            # 递归搜索当前目录和子目录
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            for root, dirs, files in os.walk(current_dir):
-                if "yt-dlp.exe" in files:
-                    possible_paths.append(os.path.join(root, "yt-dlp.exe"))
-                if "yt-dlp" in files and not root.endswith('.exe'):
-                    possible_paths.append(os.path.join(root, "yt-dlp"))
-
-            # 检查每个可能的路径
-            for path in possible_paths:
-                if os.path.exists(path):
-                    try:
-                        # 验证是否是有效的yt-dlp可执行文件
-                        startupinfo = None
-                        creationflags = 0
-                        if sys.platform == "win32":
-                            startupinfo = subprocess.STARTUPINFO()
-                            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                            startupinfo.wShowWindow = 0
-                            creationflags = subprocess.CREATE_NO_WINDOW
-
-                        result = subprocess.run([path, '--version'],
-                                                capture_output=True, text=True, timeout=5,
-                                                startupinfo=startupinfo, creationflags=creationflags)
-                        if result.returncode == 0:
-                            self.ytdlp_path.set(path)
-                            self.add_log("system", f"自动找到 yt-dlp: {path}")
-                            return
-                    except (subprocess.SubprocessError, OSError):
-                        continue
-
+        else:
             self.add_log("system", "未找到 yt-dlp，将使用内置模块")
 
     def browse_ytdlp_path(self):
@@ -657,23 +3958,6 @@ class VideoDownloaderApp:
 
         messages = []
 
-        def run_hidden_process(cmd, timeout=10):
-            """运行隐藏窗口的进程"""
-            startupinfo = None
-            creationflags = 0
-            if sys.platform == "win32":
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = 0
-                creationflags = subprocess.CREATE_NO_WINDOW
-
-            return subprocess.run(cmd,
-                                  capture_output=True,
-                                  text=True,
-                                  timeout=timeout,
-                                  startupinfo=startupinfo,
-                                  creationflags=creationflags)
-
         # 测试 yt-dlp 路径
         if ytdlp_path:
             if os.path.exists(ytdlp_path):
@@ -728,81 +4012,388 @@ class VideoDownloaderApp:
             messagebox.showwarning("输入错误", "请选择或输入画质设置")
             return
 
-        added_count = 0
-        for url in urls:
-            # 生成下载ID
-            download_id = f"download_{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{added_count}"
-
-            # 添加到树形视图
-            item_id = self.download_tree.insert("", tk.END, values=(
-                url[:50] + "..." if len(url) > 50 else url,
-                "0%",
-                "等待中",
-                "开始 停止"
-            ))
-
-            # 保存下载项信息
-            self.download_items[download_id] = {
-                'url': url,
-                'item_id': item_id,
-                'status': 'pending',
-                'progress': 0,
-                'quality': quality
-            }
-
-            # 添加日志
-            self.add_log(download_id, f"已添加到下载队列: {url} (画质: {quality})")
-            added_count += 1
-
         # 清空输入框
         self.url_text.delete("1.0", tk.END)
 
+        self.add_urls_in_chunks(urls, quality, self.get_connections())
+
+    def add_urls_in_chunks(self, urls, quality, connections, start=0, added=0, skipped=0):
+        """分批加入大量 URL，每批之间让出事件循环，粘贴上万行时界面不卡住"""
+        chunk_added, chunk_skipped = self.add_urls(urls[start:start + self.ADD_CHUNK_SIZE], quality, connections)
+        added += len(chunk_added)
+        skipped += len(chunk_skipped)
+        start += self.ADD_CHUNK_SIZE
+        if start < len(urls):
+            self.root.after(1, self.add_urls_in_chunks, urls, quality, connections, start, added, skipped)
+            return
+
         # 显示添加结果
-        self.add_log("system", f"成功添加 {added_count} 个下载任务")
+        self.add_log("system", f"成功添加 {added} 个下载任务" +
+                     (f"，跳过 {skipped} 个重复/已下载" if skipped else ""))
+
+    def add_urls(self, urls, quality, connections=1, start=False):
+        """把一批 URL 加入下载队列，返回 (新增的 download_id 列表, [(url, 跳过原因)])"""
+        added = []
+        skipped = []
+        expand = self.expand_playlists.get()
+        for url in urls:
+            key = get_dedup_key(url)
+            reason = self.check_duplicate(key)
+            if reason:
+                self.add_log("system", f"跳过{reason}: {url}")
+                skipped.append((url, reason))
+                continue
+
+            if expand and is_collection_url(url):
+                # 播放列表/频道先展开，条目陆续加入队列
+                download_id = self.create_download_item(url, quality, status='expanding', status_text="展开中",
+                                                        key=key, connections=connections)
+                self.start_expansion(download_id)
+            else:
+                download_id = self.create_download_item(url, quality, key=key, connections=connections)
+                self.add_log(download_id, f"已添加到下载队列: {url} (画质: {quality})")
+            added.append(download_id)
+            if start:
+                self.start_download(download_id)
+        return added, skipped
+
+    def check_duplicate(self, key):
+        """检查去重键，重复时返回原因，否则返回 None"""
+        if key in self.queued_keys:
+            return "重复任务"
+        if self.engine.archive is not None and self.use_archive.get() and key in self.engine.archive:
+            return "已下载"
+        return None
+
+    def set_item_status(self, download_id, status, message=None):
+        """修改下载项状态，并记录到队列日志"""
+        item_info = self.download_items[download_id]
+        self.paused_count += (status == 'paused') - (item_info['status'] == 'paused')
+        item_info['status'] = status
+        if status != 'downloading':
+            item_info.pop('awaiting_metadata', None)
+        fields = {'status': status, 'progress': item_info['progress']}
+        if message is not None:
+            item_info['message'] = message
+            fields['message'] = message
+        if self.journal is not None:
+            self.journal.update(download_id, **fields)
+        self.notify('status', download_id, **fields)
+
+    def remove_download_item(self, download_id):
+        """从队列和树形视图中移除下载项"""
+        item_info = self.download_items.pop(download_id, None)
+        if item_info is None:
+            return
+        if item_info['status'] == 'paused':
+            self.paused_count -= 1
+        # 顺序列表在下次渲染时统一过滤，批量清除时不必逐个删除
+        self.queue_order_stale = True
+        self.queue_selection.discard(download_id)
+        self.queue_dirty = True
+        if self.queued_keys.get(item_info.get('key')) == download_id:
+            del self.queued_keys[item_info['key']]
+        self.engine.workers.pop(download_id, None)
+        self.engine.metadata_extractor.cancel(download_id)
+        if self.journal is not None:
+            self.journal.remove(download_id)
+        self.notify('removed', download_id)
+
+    def create_download_item(self, url, quality, status='pending', status_text="等待中", title=None, key=None,
+                             download_id=None, progress=0, connections=1):
+        """创建下载项并加入下载队列，返回 download_id"""
+        # 生成下载ID
+        if download_id is None:
+            download_id = f"download_{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{next(self.id_counter)}"
+
+        # 保存下载项信息，树形视图在下个刷新周期按可见窗口重绘
+        item_info = self.download_items[download_id] = DownloadItem(
+            url, quality, status=status, progress=progress, connections=connections, status_text=status_text,
+            tags=('paused',) if status == 'paused' else ())
+        self.queue_order.append(download_id)
+        self.queue_dirty = True
+        if title:
+            item_info['title'] = title
+        if status == 'paused':
+            self.paused_count += 1
+        if key:
+            item_info['key'] = key
+            self.queued_keys[key] = download_id
+        if self.journal is not None:
+            self.journal.add(download_id, item_info)
+        self.notify('added', download_id, url=url, title=title, quality=quality, status=status, progress=progress)
+        return download_id
+
+    def get_item_key(self, download_id):
+        item_info = self.download_items[download_id]
+        return item_info.get('key') or get_dedup_key(item_info['url'])
+
+    def prefetch_metadata(self):
+        """提前解析调度队列最前面几个任务的视频信息（解析阶段），命中缓存时直接显示
+
+        每个刷新周期最多一次；同一站点进行中的解析数不超过单站点并发限制
+        """
+        self.prefetch_dirty = False
+        host_limit = self.engine.scheduler.per_host_limit
+        for download_id, host in self.engine.scheduler.peek(self.PREFETCH_LOOKAHEAD):
+            item_info = self.download_items.get(download_id)
+            if item_info is None or item_info.get('metadata') is not None or is_collection_url(item_info['url']):
+                continue
+            info = self.engine.metadata_cache.get(self.get_item_key(download_id))
+            if info is not None:
+                self.metadata_ready(download_id, info, None)
+                continue
+            if host_limit > 0 and self.engine.metadata_extractor.active_on(host) >= host_limit:
+                continue
+            item_info['metadata'] = 'extracting'
+            self.engine.metadata_extractor.extract(download_id, item_info['url'], self.get_item_key(download_id),
+                                            item_info['quality'], self.ytdlp_path.get().strip(), self.metadata_ready)
+
+    def metadata_ready(self, download_id, info, error):
+        """视频信息解析完成（主线程），更新列表显示；已派发、等待解析结果的任务开始下载"""
+        item_info = self.download_items.get(download_id)
+        self.prefetch_dirty = True
+        if item_info is None:
+            return
 
-    def start_download(self, download_id):
+        if info is not None:
+            item_info['metadata'] = 'ready'
+            if info.get('title') and info.get('title') != item_info.get('title'):
+                item_info['title'] = info['title']
+                if self.journal is not None:
+                    self.journal.update(download_id, title=info['title'])
+            item_info['filesize'] = get_info_filesize(info)
+            item_info['duration'] = info.get('duration')
+            self.update_tree_metadata(download_id)
+            self.notify('metadata', download_id, title=item_info.get('title'), filesize=item_info['filesize'],
+                        duration=item_info['duration'])
+        else:
+            # 解析失败时由下载线程重新解析并报告错误
+            item_info['metadata'] = 'failed'
+            if error:
+                self.add_log(download_id, f"解析视频信息失败: {error}")
+
+        if item_info.pop('awaiting_metadata', None) and item_info['status'] == 'downloading':
+            self.launch_worker(download_id)
+
+    def start_expansion(self, download_id):
+        url = self.download_items[download_id]['url']
+        self.add_log(download_id, f"正在展开播放列表/频道: {url}")
+        self.engine.expander.expand(download_id, url, self.ytdlp_path.get().strip(),
+                             self.add_expanded_entries, self.expansion_finished)
+
+    def add_expanded_entries(self, parent_id, entries):
+        """展开得到的一批条目加入队列（主线程）"""
+        parent = self.download_items.get(parent_id)
+        if parent is None or parent['status'] != 'expanding':
+            return
+
+        for entry in entries:
+            key = entry.get('key') or get_dedup_key(entry['url'])
+            if self.check_duplicate(key):
+                parent['skipped'] = parent.get('skipped', 0) + 1
+                continue
+            download_id = self.create_download_item(entry['url'], parent['quality'], title=entry.get('title'),
+                                                    key=key, connections=parent['connections'])
+            if parent.get('autostart'):
+                self.start_download(download_id)
+
+        total = parent['expanded'] = parent.get('expanded', 0) + len(entries)
+        self.update_tree_item(parent_id, status=f"展开中 ({total})")
+
+    def expansion_finished(self, parent_id, count, error):
+        """展开结束（主线程）"""
+        parent = self.download_items.get(parent_id)
+        if parent is None or parent['status'] != 'expanding':
+            return
+
+        if error and not count:
+            self.set_item_status(parent_id, 'error', error)
+            self.update_tree_item(parent_id, status=f"错误: {error}")
+            self.add_log(parent_id, f"展开失败: {error}")
+        elif count:
+            # 展开完成后移除占位的播放列表项
+            skipped = parent.get('skipped', 0)
+            self.add_log(parent_id, f"展开完成: {parent['url']} 共 {count} 个视频" +
+                         (f"，跳过 {skipped} 个重复/已下载" if skipped else "") +
+                         (f" (部分失败: {error})" if error else ""))
+            self.remove_download_item(parent_id)
+        else:
+            # 没有条目，按单个视频处理
+            self.set_item_status(parent_id, 'pending')
+            self.update_tree_item(parent_id, status="等待中")
+            if parent.get('autostart'):
+                self.start_download(parent_id)
+
+    def start_download(self, download_id, priority=0):
+        """将下载任务加入调度队列，由调度器在有空闲槽位时启动"""
         if download_id not in self.download_items:
             return
 
         item_info = self.download_items[download_id]
+        if item_info['status'] == 'expanding':
+            # 展开中的播放列表：后续条目加入后自动开始
+            item_info['autostart'] = True
+            return
+        if item_info['status'] in ('downloading', 'queued', 'postprocessing'):
+            return
+
+        worker = self.engine.workers.get(download_id)
+        if worker is not None and not worker.done.is_set():
+            # 上一个下载线程还未退出（正在暂停/停止），退出后再开始
+            item_info['resume_pending'] = True
+            self.update_tree_item(download_id, status="等待恢复")
+            return
+
+        if item_info['status'] == 'paused':
+            # 继续下载的任务优先派发
+            priority = min(priority, -1)
+        elif item_info['status'] == 'error':
+            # 手动重新开始的任务重新计算自动重试次数
+            item_info.pop('retries', None)
+
+        self.enqueue_download(download_id, priority)
+        self.dispatch_downloads()
+
+    def enqueue_download(self, download_id, priority=0):
+        """加入调度队列，排到队列前面时提前解析视频信息"""
+        item_info = self.download_items[download_id]
+        if self.engine.scheduler.submit(download_id, item_info['url'], priority):
+            self.set_item_status(download_id, 'queued')
+            self.update_tree_item(download_id, status="排队中", tags=())
+            self.prefetch_dirty = True
+
+    def pause_download(self, download_id):
+        """暂停下载：保留 .part 文件，继续时从已下载的位置接着下载"""
+        item_info = self.download_items.get(download_id)
+        if item_info is None:
+            return
+
+        if item_info['status'] in ('downloading', 'postprocessing'):
+            worker = self.engine.workers.get(download_id)
+            if worker is not None:
+                worker.pause()
+            if self.engine.release_slot(download_id):
+                self.dispatch_downloads()
+        elif item_info['status'] == 'queued':
+            self.engine.scheduler.cancel(download_id)
+        elif not (item_info['status'] == 'paused' and item_info.get('resume_pending')):
+            return
+
+        self.set_item_status(download_id, 'paused')
+        item_info.pop('resume_pending', None)
+        self.update_tree_item(download_id, status=f"已暂停 ({item_info['progress']}%)", tags=('paused',))
+
+    def resume_all_downloads(self):
+        for download_id, item_info in list(self.download_items.items()):
+            if item_info['status'] == 'paused':
+                self.start_download(download_id)
+
+    def download_interrupted(self, download_id):
+        """下载线程因暂停/停止已经退出（主线程）"""
+        self.engine.worker_done(download_id)
+        item_info = self.download_items.get(download_id)
+        if item_info is not None and item_info.pop('resume_pending', False):
+            self.start_download(download_id)
+
+    def download_postprocessing(self, download_id):
+        """下载阶段结束、进入后处理（主线程）：释放下载槽位，派发下一个任务"""
+        released = self.engine.release_slot(download_id)
+        item_info = self.download_items.get(download_id)
+        if item_info is not None and item_info['status'] == 'downloading':
+            self.set_item_status(download_id, 'postprocessing')
+            self.update_tree_item(download_id, progress=100, status="后处理中")
+        if released:
+            self.dispatch_downloads()
+
+    def update_paused_count(self):
+        """暂停数有变化时刷新标签（每个刷新周期一次，批量暂停/继续时不逐项刷新）"""
+        if self.paused_count != self.paused_count_shown:
+            self.paused_count_shown = self.paused_count
+            self.paused_label.config(text=f"已暂停 {self.paused_count} 个" if self.paused_count else "")
+
+    def dispatch_downloads(self):
+        """从调度器取出可以开始的任务并启动下载线程"""
+        for download_id in self.engine.scheduler.pop_ready():
+            self.prefetch_dirty = True
+            if download_id in self.download_items:
+                self.launch_worker(download_id)
+            else:
+                self.engine.scheduler.release(download_id)
+
+    def launch_worker(self, download_id):
+        item_info = self.download_items[download_id]
 
         # 更新状态
-        item_info['status'] = 'downloading'
+        self.set_item_status(download_id, 'downloading')
+        if item_info.get('metadata') == 'extracting':
+            # 解析阶段正在解析这个任务：占着槽位等结果，不在下载线程里重复解析
+            item_info['awaiting_metadata'] = True
+            self.update_tree_item(download_id, status="解析中")
+            return
         self.update_tree_item(download_id, status="下载中")
 
+        # 解析阶段已经得到视频信息的，下载时不再重新解析
+        info = None
+        if item_info.get('metadata') == 'ready':
+            info = self.engine.metadata_cache.get(self.get_item_key(download_id))
+
         # 创建下载线程
-        worker = DownloadWorker(
+        self.engine.start_worker(
+            download_id,
             item_info['url'],
-            self.download_dir.get(),
             item_info['quality'],  # 使用保存的画质设置
-            self.download_signal,
-            download_id,
+            self.download_dir.get(),
             self.ytdlp_path.get().strip(),
-            self.ffmpeg_path.get().strip()
+            self.ffmpeg_path.get().strip(),
+            self.use_archive.get(),
+            item_info['connections'],
+            item_info.get('rate_limit', 0),
+            info
         )
 
-        self.download_workers[download_id] = worker
-        worker.start()
-
     def stop_download(self, download_id):
-        if download_id in self.download_workers:
-            worker = self.download_workers[download_id]
-            worker.stop()
+        self.engine.scheduler.cancel(download_id)
+        self.engine.expander.cancel(download_id)
+
+        if download_id in self.engine.workers:
+            worker = self.engine.workers[download_id]
+            cleanup = {text: policy for policy, text in CANCEL_CLEANUP_POLICIES.items()}[self.cancel_cleanup.get()]
+            worker.stop(cleanup)
 
         if download_id in self.download_items:
             item_info = self.download_items[download_id]
-            item_info['status'] = 'stopped'
-            self.update_tree_item(download_id, status="已停止")
+            self.set_item_status(download_id, 'stopped')
+            item_info.pop('resume_pending', None)
+            self.update_tree_item(download_id, status="已停止", tags=())
+
+        # 被停止的任务不会再回调 download_finished，这里直接释放槽位和限速配额，不等线程/进程退出
+        if self.engine.release_slot(download_id):
+            self.dispatch_downloads()
 
     def start_all_downloads(self):
         for download_id in self.download_items:
-            if self.download_items[download_id]['status'] == 'pending':
-                self.start_download(download_id)
+            if self.download_items[download_id]['status'] == 'expanding':
+                self.download_items[download_id]['autostart'] = True
+            elif self.download_items[download_id]['status'] == 'pending':
+                self.enqueue_download(download_id)
+        self.dispatch_downloads()
+        self.add_log("system", f"调度器: {self.engine.scheduler.running_count()} 个下载中, "
+                               f"{self.engine.scheduler.queued_count()} 个排队中")
 
     def pause_all_downloads(self):
-        for download_id in self.download_items:
-            if self.download_items[download_id]['status'] == 'downloading':
-                self.stop_download(download_id)
+        # 先把排队中的任务退回等待状态，避免暂停下载时又被调度器派发
+        for download_id, item_info in self.download_items.items():
+            if item_info['status'] == 'expanding':
+                item_info['autostart'] = False
+            elif item_info['status'] == 'queued':
+                self.engine.scheduler.cancel(download_id)
+                self.set_item_status(download_id, 'pending')
+                self.update_tree_item(download_id, status="等待中")
+
+        for download_id, item_info in list(self.download_items.items()):
+            if item_info['status'] == 'downloading':
+                self.pause_download(download_id)
 
     def clear_completed(self):
         items_to_remove = []
@@ -810,20 +4401,11 @@ class VideoDownloaderApp:
         # 遍历所有下载项，找出已完成、错误或已停止的项
         for download_id, item_info in self.download_items.items():
             if item_info['status'] in ['completed', 'error', 'stopped']:
-                # 从树形视图中删除
-                try:
-                    self.download_tree.delete(item_info['item_id'])
-                except tk.TclError:
-                    # 如果项已经被删除，忽略错误
-                    pass
                 items_to_remove.append(download_id)
 
-        # 从数据结构中移除
+        # 从树形视图和数据结构中移除
         for download_id in items_to_remove:
-            if download_id in self.download_workers:
-                del self.download_workers[download_id]
-            if download_id in self.download_items:
-                del self.download_items[download_id]
+            self.remove_download_item(download_id)
 
         # 添加日志记录
         if items_to_remove:
@@ -831,81 +4413,698 @@ class VideoDownloaderApp:
         else:
             self.add_log("system", "没有可清除的已完成项目")
 
-    def update_tree_item(self, download_id, progress=None, status=None):
+    def update_tree_item(self, download_id, progress=None, status=None, tags=None):
+        """更新下载项的显示内容，可见行在下个刷新周期统一重绘"""
         if download_id not in self.download_items:
             return
 
         item_info = self.download_items[download_id]
-        item_id = item_info['item_id']
-
-        current_values = list(self.download_tree.item(item_id, 'values'))
-
         if progress is not None:
-            current_values[1] = f"{progress}%"
             item_info['progress'] = progress
-
         if status is not None:
-            current_values[2] = status
-            item_info['status'] = status
+            item_info['status_text'] = status
+        if tags is not None:
+            item_info['tags'] = tuple(tags)
+        self.queue_dirty = True
+
+    def update_tree_metadata(self, download_id):
+        """显示解析得到的标题、大小和时长"""
+        self.queue_dirty = True
+
+    def get_queue_row(self, item_info):
+        """下载项在树形视图中的一行 (values, tags)"""
+        name = item_info.get('title') or item_info['url']
+        return ((
+            name[:50] + "..." if len(name) > 50 else name,
+            format_size(item_info.get('filesize')),
+            format_eta(item_info.get('duration')) or "",
+            f"{item_info['progress']}%",
+            item_info['status_text'],
+            item_info.get('retries', ""),
+            "开始 停止"
+        ), item_info['tags'])
+
+    def measure_queue_rows(self):
+        """按第一行的实际位置计算可容纳的行数，还没有显示出来时返回 None"""
+        height = self.download_tree.winfo_height()
+        if height <= 1 or not self.queue_rows:
+            return None
+        bbox = self.download_tree.bbox(self.queue_rows[0])
+        if not bbox:
+            return None
+        # bbox 的 y 即表头高度
+        return max(1, (height - bbox[1]) // bbox[3])
+
+    def get_queue_visible_rows(self):
+        return self.measure_queue_rows() or len(self.queue_rows) or int(self.download_tree.cget('height'))
+
+    def render_queue_view(self):
+        """只渲染当前可见窗口内的下载项，内容未变化的行不重绘"""
+        self.queue_dirty = False
+        if self.queue_order_stale:
+            self.queue_order = [download_id for download_id in self.queue_order if download_id in self.download_items]
+            self.queue_order_stale = False
+
+        total = len(self.queue_order)
+        measured = self.measure_queue_rows()
+        visible = measured or self.get_queue_visible_rows()
+        self.queue_offset = min(self.queue_offset, max(0, total - visible))
+        rows = min(visible, total)
+
+        # 行数随窗口大小和队列长度变化
+        while len(self.queue_rows) < rows:
+            self.queue_rows.append(self.download_tree.insert("", tk.END))
+            self.queue_row_values.append(None)
+        while len(self.queue_rows) > rows:
+            self.download_tree.delete(self.queue_rows.pop())
+            self.queue_row_values.pop()
+        if measured is None and rows < total:
+            # 行高还量不出来，下个刷新周期按实际大小重新计算
+            self.queue_dirty = True
+
+        selection = []
+        for slot, row in enumerate(self.queue_rows):
+            download_id = self.queue_order[self.queue_offset + slot]
+            values = self.get_queue_row(self.download_items[download_id])
+            if values != self.queue_row_values[slot]:
+                self.download_tree.item(row, values=values[0], tags=values[1])
+                self.queue_row_values[slot] = values
+            if download_id in self.queue_selection:
+                selection.append(row)
+
+        selection = tuple(selection)
+        if selection != self.download_tree.selection():
+            self.queue_applied_selection = selection
+            self.download_tree.selection_set(selection)
+
+        if total:
+            self.tree_scroll.set(self.queue_offset / total, min(1.0, (self.queue_offset + visible) / total))
+        else:
+            self.tree_scroll.set(0.0, 1.0)
+
+    def on_queue_select(self, event):
+        """用户在可见行中改变选择时同步到 queue_selection"""
+        selection = self.download_tree.selection()
+        if selection == self.queue_applied_selection:
+            # 渲染时恢复选择触发的事件
+            return
+        self.queue_applied_selection = selection
+        self.queue_selection = {self.queue_order[self.queue_offset + self.queue_rows.index(row)]
+                                for row in selection if row in self.queue_rows}
+
+    def scroll_queue(self, delta):
+        max_offset = max(0, len(self.queue_order) - self.get_queue_visible_rows())
+        self.queue_offset = min(max(0, self.queue_offset + delta), max_offset)
+        self.render_queue_view()
+
+    def on_queue_scroll(self, *args):
+        """队列滚动条回调"""
+        visible = self.get_queue_visible_rows()
+        if args[0] == 'moveto':
+            self.scroll_queue(int(float(args[1]) * len(self.queue_order)) - self.queue_offset)
+        elif args[0] == 'scroll':
+            step = visible if args[2] == 'pages' else 1
+            self.scroll_queue(int(args[1]) * step)
+
+    def on_queue_mousewheel(self, event):
+        self.scroll_queue(-3 if event.delta > 0 else 3)
+        return "break"
+
+    def process_ui_events(self):
+        """在主线程中批量应用工作线程发来的事件（每个刷新周期一次）"""
+        tracer = self.engine.tracer
+        try:
+            progress, logs, finished, calls = self.download_signal.drain()
+
+            with tracer.span('ui.progress'):
+                for download_id, (percent, speed, eta) in progress.items():
+                    self.update_progress(download_id, percent, speed, eta)
+
+            if logs:
+                with tracer.span('ui.logs'):
+                    self.append_logs(logs)
+
+            with tracer.span('ui.finished'):
+                for download_id, (success, message) in finished:
+                    self.download_finished(download_id, success, message)
+
+                for func, args in calls:
+                    func(*args)
+
+            if self.log_dirty:
+                with tracer.span('ui.render_log'):
+                    self.render_log_view()
+            self.update_paused_count()
+
+            if self.prefetch_dirty:
+                self.prefetch_metadata()
+
+            if self.engine.scheduler.has_timers():
+                # 自动重试的任务到时间、站点冷却结束后派发
+                self.dispatch_downloads()
+
+            if self.queue_dirty:
+                with tracer.span('ui.render_queue'):
+                    self.render_queue_view()
+
+            if self.control_server is not None:
+                self.control_server.flush()
+
+            if self.journal is not None:
+                # 最后几条记录之后没有新的写入时，也在 SYNC_INTERVAL 内同步到磁盘
+                self.journal.sync()
+        finally:
+            self.root.after(self.UI_TICK_MS, self.process_ui_events)
 
-        self.download_tree.item(item_id, values=current_values)
+    def refresh_stats(self):
+        """刷新统计面板"""
+        try:
+            stats = self.engine.metrics.snapshot()
+            rates = stats['rates']
+            latencies = stats['latencies']
+
+            def seconds(value):
+                return f"{value:.2f}s" if value is not None else "-"
+
+            totals = {}
+            failures = {}
+            for (name, extractor), value in stats['counters'].items():
+                totals[name] = totals.get(name, 0) + value
+                if name == 'failed':
+                    failures[extractor] = value
+            worst = sorted(failures.items(), key=lambda item: -item[1])[:3]
+
+            lines = [
+                f"速度: 5秒 {format_speed(rates[5])} | 1分钟 {format_speed(rates[60])} | 5分钟 {format_speed(rates[300])}"
+                f"    下载中: {stats['active']}    已下载: {format_size(stats['bytes_total']) or '0 B'}"
+                f"    后处理: {self.engine.postprocess_stage.active} 个进行中, {self.engine.postprocess_stage.waiting} 个等待",
+                f"1分钟平均耗时: 首字节 {seconds(latencies['ttfb'])} | 解析 {seconds(latencies['extraction'])}"
+                f" | 后处理 {seconds(latencies['postprocess'])}"
+                f"    完成 {totals.get('completed', 0)}  失败 {totals.get('failed', 0)}  重试 {totals.get('retries', 0)}" +
+                ("    失败最多: " + ", ".join(f"{extractor}({count})" for extractor, count in worst) if worst else ""),
+            ]
+            self.stats_label.config(text="\n".join(lines))
+        finally:
+            self.root.after(self.STATS_REFRESH_MS, self.refresh_stats)
 
     def update_progress(self, download_id, percent, speed, eta=None):
-        if download_id in self.download_items:
+        # 已停止/已结束的任务忽略迟到的进度事件
+        if download_id in self.download_items and self.download_items[download_id]['status'] == 'downloading':
             speed_str = self.format_speed(speed)
             if eta:
                 status = f"下载中 - {speed_str} - ETA: {eta}"
             else:
                 status = f"下载中 - {speed_str}" if speed > 0 else "下载中"
             self.update_tree_item(download_id, progress=percent, status=status)
+            self.notify('progress', download_id, progress=percent, speed=speed or 0, eta=eta)
 
     def download_finished(self, download_id, success, message):
         if download_id in self.download_items:
+            item_info = self.download_items[download_id]
+            worker = self.engine.worker_done(download_id, success, self.get_item_key(download_id))
+            if worker is not None and worker.info_stale:
+                item_info['metadata'] = None
+
             if success:
                 self.update_tree_item(download_id, progress=100, status="已完成")
-                self.download_items[download_id]['status'] = 'completed'
-            else:
-                self.update_tree_item(download_id, status=f"错误: {message}")
-                self.download_items[download_id]['status'] = 'error'
+                self.set_item_status(download_id, 'completed')
+            elif item_info['status'] in ('downloading', 'postprocessing'):
+                self.retry_or_fail(download_id, message, worker.extractor if worker is not None else None)
+        else:
+            self.engine.worker_done(download_id, success)
+
+        # 自动开始下一个排队任务
+        self.dispatch_downloads()
+
+    def retry_or_fail(self, download_id, message, extractor=None):
+        """下载失败：临时错误和站点限流延迟后自动重新排队，其余标记为错误"""
+        item_info = self.download_items[download_id]
+        retries = item_info.get('retries', 0)
+        kind, delay = self.engine.retry_later(download_id, item_info['url'], message, retries, extractor=extractor)
+        if delay is None:
+            self.update_tree_item(download_id, status=f"错误: {message}")
+            self.set_item_status(download_id, 'error', message)
+            return
 
-            if download_id in self.download_workers:
-                del self.download_workers[download_id]
+        item_info['retries'] = retries + 1
+        self.set_item_status(download_id, 'queued', message)
+        if self.journal is not None:
+            self.journal.update(download_id, retries=retries + 1)
+        self.update_tree_item(download_id, status=f"等待重试 ({delay:.0f} 秒后)")
+        self.notify('retry', download_id, retries=retries + 1, delay=round(delay, 1), error_kind=kind)
+        self.add_log(download_id, f"{ERROR_KIND_TEXT[kind]}，{delay:.0f} 秒后第 {retries + 1} 次重试: {message}")
 
     def add_log(self, download_id, message):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] {message}"
-        self.log_text.insert(tk.END, log_entry + "\n")
-        self.log_text.see(tk.END)
+        self.append_logs([(download_id, message, datetime.now())])
+
+    def append_logs(self, entries):
+        """批量写入日志，entries 为 (download_id, message, time) 列表"""
+        records = []
+        for download_id, message, created in entries:
+            line = f"[{created.strftime('%Y-%m-%d %H:%M:%S')}] {message}"
+            records.append((download_id, line))
+            if self.file_logger:
+                self.file_logger.info("%s %s", download_id, line)
+
+        evicted = self.log_buffer.extend(records)
+        if not self.log_follow and self.log_view_id is None:
+            # 保持查看位置不随旧日志淘汰而跳动
+            self.log_offset = max(0, self.log_offset - evicted)
+        self.log_dirty = True
+
+    def setup_file_logger(self):
+        """完整日志写入磁盘上的滚动日志文件"""
+        try:
+            log_dir = os.path.join(get_app_data_dir(), "logs")
+            os.makedirs(log_dir, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                os.path.join(log_dir, "ytdlp-gui.log"),
+                maxBytes=self.LOG_FILE_MAX_BYTES,
+                backupCount=self.LOG_FILE_BACKUPS,
+                encoding="utf-8"
+            )
+        except OSError:
+            return None
+
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger = logging.getLogger("ytdlp-gui")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.handlers[:] = [handler]
+        return logger
+
+    def get_log_visible_rows(self):
+        height = self.log_text.winfo_height()
+        if height <= 1:
+            return int(self.log_text.cget('height'))
+        return max(1, height // self.log_line_height)
+
+    def render_log_view(self):
+        """只渲染当前可见窗口内的日志行"""
+        self.log_dirty = False
+        lines = self.log_buffer.view(self.log_view_id)
+        total = len(lines)
+        visible = self.get_log_visible_rows()
+        max_offset = max(0, total - visible)
+
+        if self.log_follow or self.log_offset > max_offset:
+            self.log_offset = max_offset
+
+        window = itertools.islice(lines, self.log_offset, self.log_offset + visible)
+        if self.log_view_id is None:
+            window = (line for _, line in window)
+
+        self.log_text.config(state='normal')
+        self.log_text.delete("1.0", tk.END)
+        self.log_text.insert("1.0", "\n".join(window))
+        self.log_text.config(state='disabled')
+
+        if total:
+            self.log_scroll.set(self.log_offset / total, min(1.0, (self.log_offset + visible) / total))
+        else:
+            self.log_scroll.set(0.0, 1.0)
+
+    def scroll_log(self, delta):
+        total = len(self.log_buffer.view(self.log_view_id))
+        max_offset = max(0, total - self.get_log_visible_rows())
+        self.log_offset = min(max(0, self.log_offset + delta), max_offset)
+        self.log_follow = self.log_offset >= max_offset
+        self.render_log_view()
+
+    def on_log_scroll(self, *args):
+        """日志滚动条回调"""
+        visible = self.get_log_visible_rows()
+        if args[0] == 'moveto':
+            total = len(self.log_buffer.view(self.log_view_id))
+            self.scroll_log(int(float(args[1]) * total) - self.log_offset)
+        elif args[0] == 'scroll':
+            step = visible if args[2] == 'pages' else 1
+            self.scroll_log(int(args[1]) * step)
+
+    def on_log_mousewheel(self, event):
+        self.scroll_log(-3 if event.delta > 0 else 3)
+
+    def refresh_log_filter_choices(self):
+        """刷新日志筛选下拉框，列出当前队列中的下载任务"""
+        self.log_filter_choices = {"全部": None, "系统": "system"}
+        items = itertools.islice(self.download_items.items(), self.LOG_FILTER_MAX_ITEMS)
+        for index, (download_id, item_info) in enumerate(items, 1):
+            self.log_filter_choices[f"{index}. {item_info['url']}"] = download_id
+        self.log_filter_combo.config(values=list(self.log_filter_choices))
+
+    def on_log_filter_selected(self, event):
+        """日志筛选变化事件"""
+        self.log_view_id = self.log_filter_choices.get(self.log_filter.get())
+        self.log_follow = True
+        self.render_log_view()
 
     def format_speed(self, speed_bytes):
         """格式化下载速度显示"""
-        if speed_bytes == 0:
-            return "0 B/s"
-        elif speed_bytes >= 1024 * 1024 * 1024:
-            return f"{speed_bytes / (1024 * 1024 * 1024):.2f} GB/s"
-        elif speed_bytes >= 1024 * 1024:
-            return f"{speed_bytes / (1024 * 1024):.2f} MB/s"
-        elif speed_bytes >= 1024:
-            return f"{speed_bytes / 1024:.2f} KB/s"
+        return format_speed(speed_bytes)
+
+    def notify(self, event, download_id, **fields):
+        """把任务变化推送给控制接口的订阅者（未启用时不做任何事）"""
+        if self.control_server is not None:
+            self.control_server.publish(event, download_id, **fields)
+
+    def start_control_server(self, port, token=None):
+        """启动本地 HTTP 控制接口，当前队列作为初始状态；没有指定令牌时每次启动随机生成"""
+        server = ControlServer(self.download_signal.call, self.api_submit, self.api_control, port=port,
+                               metrics=self.engine.metrics, token=token)
+        try:
+            server.start()
+        except OSError as e:
+            self.add_log("system", f"控制接口启动失败: {e}")
+            return
+        self.control_server = server
+        for download_id, item_info in self.download_items.items():
+            self.notify('added', download_id, url=item_info['url'], title=item_info.get('title'),
+                        quality=item_info['quality'], status=item_info['status'], progress=item_info['progress'])
+        self.add_log("system", f"控制接口已启动: http://{server.host}:{server.port}  令牌: {server.token}")
+
+    def api_submit(self, payload):
+        """控制接口的批量添加（主线程）"""
+        quality = payload.get('quality') or self.get_selected_quality() or "最佳画质"
+        connections = payload.get('connections') or self.get_connections()
+        added, skipped = self.add_urls(payload['urls'], quality, connections, start=payload.get('start', True))
+        self.add_log("system", f"控制接口添加 {len(added)} 个下载任务" +
+                     (f"，跳过 {len(skipped)} 个重复/已下载" if skipped else ""))
+        return {
+            'added': [{'id': download_id, 'url': self.download_items[download_id]['url']}
+                      for download_id in added if download_id in self.download_items],
+            'skipped': [{'url': url, 'reason': reason} for url, reason in skipped],
+        }
+
+    def api_control(self, download_id, action):
+        """控制接口的暂停/继续/取消（主线程），返回受影响的任务数"""
+        handler, statuses = {
+            'pause': (self.pause_download, ('queued', 'downloading', 'postprocessing')),
+            'resume': (self.start_download, ('paused', 'pending')),
+            'cancel': (self.stop_download, ('queued', 'downloading', 'postprocessing', 'paused', 'pending',
+                                            'expanding')),
+        }[action]
+        if download_id == 'all':
+            download_ids = [download_id for download_id, item_info in self.download_items.items()
+                            if item_info['status'] in statuses]
         else:
-            return f"{speed_bytes:.0f} B/s"
+            download_ids = [download_id] if download_id in self.download_items else []
+        for download_id in download_ids:
+            handler(download_id)
+        return len(download_ids)
+
+    def restore_queue(self):
+        """从队列日志恢复上次的下载队列（等待中、暂停、失败的任务）"""
+        if self.journal is None:
+            return
+
+        saved = self.journal.load()
+        restored = 0
+        for download_id, record in saved.items():
+            status = record.get('status', 'pending')
+            if status in ('completed', 'stopped') or 'url' not in record:
+                continue
+            if status == 'queued':
+                status = 'pending'
+            elif status in ('downloading', 'postprocessing'):
+                # 中断的下载保留了 .part 文件，按暂停处理
+                status = 'paused'
+
+            progress = record.get('progress', 0)
+            status_text = {
+                'pending': "等待中",
+                'paused': f"已暂停 ({progress}%)",
+                'error': f"错误: {record.get('message', '')}",
+                'expanding': "展开中",
+            }.get(status, "等待中")
+            self.create_download_item(record['url'], record.get('quality', "最佳画质"), status=status,
+                                      status_text=status_text, title=record.get('title'),
+                                      key=record.get('key') or get_dedup_key(record['url']),
+                                      download_id=download_id, progress=progress,
+                                      connections=record.get('connections', 1))
+            if record.get('message'):
+                self.download_items[download_id]['message'] = record['message']
+            if record.get('rate_limit'):
+                self.download_items[download_id]['rate_limit'] = record['rate_limit']
+            if record.get('retries'):
+                self.download_items[download_id]['retries'] = record['retries']
+            restored += 1
+
+        try:
+            self.journal.open(lambda: self.download_items)
+        except OSError as e:
+            self.add_log("system", f"无法写入队列日志: {e}")
+            self.journal = None
+
+        # 未完成展开的播放列表重新展开（已加入的条目会被去重）
+        for download_id, item_info in list(self.download_items.items()):
+            if item_info['status'] == 'expanding':
+                self.start_expansion(download_id)
+
+        if restored:
+            self.add_log("system", f"已恢复上次的 {restored} 个下载任务")
+
+    def on_close(self):
+        # 排队和正在下载的任务转为暂停，保留 .part 文件供下次继续
+        for download_id, item_info in list(self.download_items.items()):
+            if item_info['status'] == 'queued':
+                self.pause_download(download_id)
+        for download_id, item_info in list(self.download_items.items()):
+            if item_info['status'] in ('downloading', 'postprocessing'):
+                self.pause_download(download_id)
+        if self.journal is not None:
+            self.journal.close()
+        if self.control_server is not None:
+            self.control_server.stop()
+        self.profiler.stop()
+        self.engine.close()
+        self.root.destroy()
 
     def run(self):
         self.root.mainloop()
 
 
-def main():
-    # 检查必要的依赖
-    try:
-        import yt_dlp
-    except ImportError:
-        print("错误: 未安装 yt-dlp")
-        print("请运行: pip install yt-dlp")
-        return
+class HeadlessRunner:
+    """无界面模式：从参数、文件或标准输入读取 URL，用 N 个并行下载线程下载
+
+    每个事件输出一行 JSON 到标准输出；全部成功退出码为 0，有失败为 1，被中断为 130
+    """
+
+    TICK = 0.5  # 秒，事件处理和进度输出间隔
+
+    def __init__(self, args):
+        self.args = args
+        self.signal = DownloadSignal(self)
+        self.engine = DownloadEngine(self.signal, max(1, args.jobs), max(0, args.per_host),
+                                     max(0, args.rate_limit) * 1024, max(0, args.pp_jobs))
+        self.engine.retry_policy.max_retries = max(0, args.retries)
+        if args.processes:
+            self.engine.set_process_workers(args.processes if args.processes > 0 else None)
+        if args.trace:
+            self.engine.tracer.start()
+        self.profiler = SamplingProfiler() if args.profile else None
+        self.id_counter = itertools.count()
+        self.jobs = {}  # download_id -> url
+        self.retries = {}  # download_id -> 已自动重试次数
+        self.playlists = {}  # 展开中的播放列表 id -> url
+        self.keys = set()
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def emit(self, event, **fields):
+        print(json.dumps(dict(event=event, time=round(time.time(), 3), **fields), ensure_ascii=False), flush=True)
+
+    def read_urls(self):
+        """URL 来自命令行参数和 --input 文件（- 表示标准输入），都没有时读取标准输入"""
+        urls = list(self.args.urls)
+        if self.args.input == '-' or (not self.args.input and not urls):
+            urls.extend(sys.stdin)
+        elif self.args.input:
+            with open(self.args.input, encoding='utf-8') as f:
+                urls.extend(f)
+        return [url.strip() for url in urls if url.strip() and not url.strip().startswith('#')]
+
+    def add(self, url, key=None):
+        key = key or get_dedup_key(url)
+        archive = self.engine.archive
+        if key in self.keys or (archive is not None and not self.args.no_archive and key in archive):
+            self.skipped += 1
+            self.emit('skipped', url=url, reason="duplicate" if key in self.keys else "archived")
+            return
+        self.keys.add(key)
+
+        if not self.args.no_expand and is_collection_url(url):
+            parent_id = f"playlist_{next(self.id_counter)}"
+            self.playlists[parent_id] = url
+            self.emit('expanding', id=parent_id, url=url)
+            self.engine.expander.expand(parent_id, url, self.args.ytdlp, self.add_entries, self.expansion_finished)
+            return
+
+        download_id = f"job_{next(self.id_counter)}"
+        self.jobs[download_id] = url
+        self.engine.scheduler.submit(download_id, url)
+        self.emit('queued', id=download_id, url=url)
+
+    def add_entries(self, parent_id, entries):
+        for entry in entries:
+            self.add(entry['url'], entry.get('key'))
+
+    def expansion_finished(self, parent_id, count, error):
+        url = self.playlists.pop(parent_id)
+        if error and not count:
+            self.failed += 1
+            self.emit('finished', id=parent_id, url=url, success=False, message=error)
+        elif count:
+            self.emit('expanded', id=parent_id, url=url, count=count)
+        else:
+            # 没有条目，按单个视频处理
+            download_id = f"job_{next(self.id_counter)}"
+            self.jobs[download_id] = url
+            self.engine.scheduler.submit(download_id, url)
+            self.emit('queued', id=download_id, url=url)
+
+    def download_interrupted(self, download_id):
+        self.engine.worker_done(download_id)
+
+    def download_postprocessing(self, download_id):
+        self.engine.release_slot(download_id)
+        if download_id in self.engine.workers:
+            self.emit('postprocessing', id=download_id)
+
+    def process_events(self):
+        progress, logs, finished, calls = self.signal.drain()
+
+        for download_id, (percent, speed, eta) in progress.items():
+            self.emit('progress', id=download_id, percent=percent, speed=speed or 0, eta=eta)
+
+        if self.args.verbose:
+            for download_id, message, _ in logs:
+                self.emit('log', id=download_id, message=message)
+
+        for download_id, (success, message) in finished:
+            worker = self.engine.worker_done(download_id, success)
+            if not success:
+                attempt = self.retries.get(download_id, 0)
+                kind, delay = self.engine.retry_later(download_id, self.jobs[download_id], message, attempt,
+                                                      extractor=worker.extractor if worker is not None else None)
+                if delay is not None:
+                    self.retries[download_id] = attempt + 1
+                    self.emit('retry', id=download_id, url=self.jobs[download_id], attempt=attempt + 1,
+                              delay=round(delay, 1), error_kind=kind, message=message)
+                    continue
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.emit('finished', id=download_id, url=self.jobs.get(download_id), success=success, message=message,
+                      retries=self.retries.get(download_id, 0))
+
+        for func, args in calls:
+            func(*args)
+
+    def export_diagnostics(self):
+        """把 --trace 的阶段耗时和 --profile 的采样结果写入文件"""
+        if self.args.trace:
+            count = self.engine.tracer.stop()
+            try:
+                self.engine.tracer.export(self.args.trace)
+                self.emit('trace', path=self.args.trace, spans=count)
+            except OSError as e:
+                print(f"导出性能追踪失败: {e}", file=sys.stderr)
+        if self.profiler is not None:
+            samples = self.profiler.stop()
+            try:
+                self.profiler.export(self.args.profile)
+                self.emit('profile', path=self.args.profile, samples=samples,
+                          hotspots=[[name, round(share, 3)] for name, share in self.profiler.hotspots()])
+            except OSError as e:
+                print(f"导出采样结果失败: {e}", file=sys.stderr)
 
-    app = VideoDownloaderApp()
+    def run(self):
+        if self.profiler is not None:
+            self.profiler.start()
+        try:
+            for url in self.read_urls():
+                self.add(url)
+
+            while self.playlists or self.engine.scheduler.queued_count() or self.engine.workers:
+                for download_id in self.engine.scheduler.pop_ready():
+                    self.engine.start_worker(download_id, self.jobs[download_id], self.args.quality, self.args.output,
+                                             self.args.ytdlp, self.args.ffmpeg, not self.args.no_archive,
+                                             max(1, self.args.connections))
+                    self.emit('started', id=download_id, url=self.jobs[download_id])
+                time.sleep(self.TICK)
+                self.process_events()
+        except KeyboardInterrupt:
+            # 正在下载的任务按暂停处理，保留 .part 文件，下次运行时继续
+            workers = list(self.engine.workers.values())
+            for worker in workers:
+                worker.pause()
+            for worker in workers:
+                worker.done.wait()
+            self.emit('interrupted', completed=self.completed, failed=self.failed)
+            return 130
+        finally:
+            self.engine.close()
+            self.export_diagnostics()
+
+        metrics = self.engine.metrics.snapshot()
+        self.emit('summary', completed=self.completed, failed=self.failed, skipped=self.skipped,
+                  bytes=metrics['bytes_total'], ttfb=self.engine.metrics.mean('ttfb'),
+                  retries=sum(value for (name, _), value in metrics['counters'].items() if name == 'retries'))
+        return 1 if self.failed else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="YTDLP-Gui 视频下载器（默认打开图形界面）")
+    parser.add_argument('--headless', action='store_true', help="无界面模式：下载参数、文件或标准输入中的 URL")
+    parser.add_argument('urls', nargs='*', help="要下载的 URL（无界面模式）")
+    parser.add_argument('-i', '--input', help="URL 列表文件，每行一个，- 表示标准输入")
+    parser.add_argument('-o', '--output', default=os.path.expanduser("~/Downloads"), help="下载目录")
+    parser.add_argument('-j', '--jobs', type=int, default=3, help="最大同时下载数")
+    parser.add_argument('--per-host', type=int, default=2, help="单站点并发数，0 表示不限")
+    parser.add_argument('--pp-jobs', type=int, default=0, help="同时进行的后处理（FFmpeg 合并/转码）数，0 表示 CPU 核数")
+    parser.add_argument('-q', '--quality', default="最佳画质",
+                        help="画质：最佳画质、仅音频、2160p...360p 或 yt-dlp 格式选择器")
+    parser.add_argument('-c', '--connections', type=int, default=1, help="分段下载连接数")
+    parser.add_argument('--processes', type=int, default=0,
+                        help="内置模块在 N 个子进程中下载（-1 表示 CPU 核数），0 表示在线程中下载")
+    parser.add_argument('--rate-limit', type=int, default=0, help="总限速 KB/s，0 表示不限")
+    parser.add_argument('--retries', type=int, default=RetryPolicy().max_retries,
+                        help="临时错误和站点限流时自动重试的次数，0 表示不重试")
+    parser.add_argument('--ytdlp', default='', help="外部 yt-dlp 可执行文件路径（默认使用内置模块）")
+    parser.add_argument('--ffmpeg', default='', help="FFmpeg 路径")
+    parser.add_argument('--no-archive', action='store_true', help="不跳过已下载的视频")
+    parser.add_argument('--no-expand', action='store_true', help="不展开播放列表/频道")
+    parser.add_argument('-v', '--verbose', action='store_true', help="同时输出下载日志")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="记录各阶段耗时并导出（.csv 为表格，其余为 Chrome trace-event JSON）")
+    parser.add_argument('--profile', metavar='FILE', help="对所有线程采样分析，结果以折叠栈格式导出")
+    parser.add_argument('--api-port', type=int, default=0,
+                        help="在 127.0.0.1 上启用 HTTP 控制接口的端口（界面模式），0 表示不启用")
+    parser.add_argument('--api-token', default=os.environ.get('YTDLP_GUI_API_TOKEN'),
+                        help="控制接口的访问令牌（默认读取环境变量 YTDLP_GUI_API_TOKEN，都没有时随机生成并写入日志）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # 检查必要的依赖（只检查是否安装，导入推迟到第一次下载）
+    if importlib.util.find_spec("yt_dlp") is None and not (args.headless and args.ytdlp):
+        print("错误: 未安装 yt-dlp", file=sys.stderr)
+        print("请运行: pip install yt-dlp", file=sys.stderr)
+        return 2
+
+    if args.headless:
+        return HeadlessRunner(args).run()
+
+    app = VideoDownloaderApp(api_port=args.api_port, api_token=args.api_token)
     app.run()
 
 
 if __name__ == "__main__":
-    main()
+    # 打包成 exe 后多进程下载的子进程需要
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())